@@ -0,0 +1,95 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+
+from comments.models import Comment
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    """修复重复或缺失的评论楼层号，并回填 Post.floor_count"""
+
+    help = '修复评论楼层号并同步帖子楼层计数器'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批处理的帖子数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计不修改')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        dry_run = options['dry_run']
+
+        renumbered = self.repair_duplicates(dry_run)
+        synced = self.sync_counters(chunk_size, dry_run)
+
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}重新编号评论 {renumbered} 条，同步帖子计数器 {synced} 个'
+        ))
+
+    def repair_duplicates(self, dry_run):
+        """把重复楼层和未分配楼层的评论顺延到帖子末尾"""
+        duplicated = set(
+            Comment.objects.values('post_id', 'floor_number')
+            .annotate(total=Count('id'))
+            .filter(total__gt=1)
+            .values_list('post_id', flat=True)
+        )
+        duplicated.update(
+            Comment.objects.filter(floor_number__lte=0).values_list('post_id', flat=True).distinct()
+        )
+
+        renumbered = 0
+        for post_id in sorted(duplicated):
+            with transaction.atomic():
+                comments = list(
+                    Comment.objects.select_for_update()
+                    .filter(post_id=post_id)
+                    .order_by('floor_number', 'created_at', 'id')
+                )
+                max_floor = max((c.floor_number for c in comments), default=0)
+                seen = set()
+                changed = []
+                for comment in comments:
+                    if comment.floor_number <= 0 or comment.floor_number in seen:
+                        max_floor += 1
+                        comment.floor_number = max_floor
+                        changed.append(comment)
+                    seen.add(comment.floor_number)
+                if changed and not dry_run:
+                    Comment.objects.bulk_update(changed, ['floor_number'])
+                renumbered += len(changed)
+        return renumbered
+
+    def sync_counters(self, chunk_size, dry_run):
+        """按批把落后于最大楼层号的 Post.floor_count 追平"""
+        synced = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # 锁住本批帖子行，避免与并发分配楼层交错
+                posts = Post.objects.filter(id__gt=last_id).order_by('id').only('id', 'floor_count')
+                if not dry_run:
+                    posts = posts.select_for_update()
+                posts = list(posts[:chunk_size])
+                if not posts:
+                    break
+                last_id = posts[-1].id
+
+                max_floors = dict(
+                    Comment.objects.filter(post_id__in=[p.id for p in posts])
+                    .values('post_id')
+                    .annotate(max_floor=Max('floor_number'))
+                    .values_list('post_id', 'max_floor')
+                )
+                changed = []
+                for post in posts:
+                    expected = max_floors.get(post.id) or 0
+                    # 只向上追平，已分配过的楼层号不回收
+                    if post.floor_count < expected:
+                        post.floor_count = expected
+                        changed.append(post)
+                if changed and not dry_run:
+                    Post.objects.bulk_update(changed, ['floor_count'])
+                synced += len(changed)
+        return synced
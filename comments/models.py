@@ -1,12 +1,37 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Prefetch
+from django.db.models.functions import Substr
 from django.utils import timezone
 from django.contrib.auth import get_user_model
 from posts.models import Post
+from tieba.models import TiebaMember
+from tieba_project.counters import VisibilityCounted, adjust, adjust_rows
 
 User = get_user_model()
 
 
-class Comment(models.Model):
+# 引用父评论时只返回的内容长度
+PARENT_PREVIEW_LENGTH = 100
+
+
+class CommentQuerySet(models.QuerySet):
+    """评论查询集"""
+    
+    def for_page(self):
+        """预加载评论分页所需的作者、父评论摘要和图片，查询数与分页大小无关"""
+        parent_stubs = Comment.objects.select_related('author').only(
+            'id', 'author__id', 'author__username', 'author__nickname', 'author__avatar'
+        ).annotate(
+            # 多取一个字符，用于判断内容是否被截断
+            content_preview=Substr('content', 1, PARENT_PREVIEW_LENGTH + 1)
+        )
+        return self.select_related('author').prefetch_related(
+            Prefetch('parent', queryset=parent_stubs),
+            'images',
+        )
+
+
+class Comment(VisibilityCounted, models.Model):
     """评论模型"""
     
     STATUS_CHOICES = [
@@ -24,10 +49,11 @@ class Comment(models.Model):
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     
     # 楼层信息
-    floor_number = models.IntegerField('楼层号', default=1)
+    floor_number = models.IntegerField('楼层号', default=0)  # 0 表示保存时自动分配
     
     # 状态信息
     status = models.IntegerField('状态', choices=STATUS_CHOICES, default=0)
+    is_anonymous = models.BooleanField('是否匿名', default=False)
     
     # 统计信息
     like_count = models.IntegerField('点赞数', default=0)
@@ -42,6 +68,8 @@ class Comment(models.Model):
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
     
+    objects = CommentQuerySet.as_manager()
+    
     class Meta:
         db_table = 'comment'
         verbose_name = '评论'
@@ -50,7 +78,7 @@ class Comment(models.Model):
             models.Index(fields=['post', 'floor_number']),
             models.Index(fields=['post', 'created_at']),
             models.Index(fields=['author', 'created_at']),
-            models.Index(fields=['parent']),
+            models.Index(fields=['parent', 'status', 'created_at', 'id']),
         ]
         ordering = ['floor_number']
     
@@ -60,12 +88,22 @@ class Comment(models.Model):
     def save(self, *args, **kwargs):
         """保存时自动设置楼层号"""
         if not self.floor_number:
-            # 获取帖子的最大楼层号
-            max_floor = Comment.objects.filter(post=self.post).aggregate(
-                models.Max('floor_number')
-            )['floor_number__max'] or 0
-            self.floor_number = max_floor + 1
+            # 从帖子的楼层计数器分配楼层号，与插入处于同一事务，失败时一并回滚
+            with transaction.atomic():
+                self.floor_number = self.post.allocate_floor()
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
+    
+    def update_counters(self, amount):
+        """评论变为可见（1）或不再可见（-1）时同步帖子、父评论、作者及其成员关系的计数"""
+        adjust(Post, self.post_id, reply_count=amount)
+        if self.parent_id:
+            adjust(Comment, self.parent_id, reply_count=amount)
+        adjust(User, self.author_id, comment_count=amount)
+        adjust_rows(
+            TiebaMember.objects.filter(tieba_id=self.post.tieba_id, user_id=self.author_id), comment_count=amount
+        )
 
 
 class CommentLike(models.Model):
@@ -1,7 +1,38 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Comment, CommentLike, CommentImage, CommentReport, Mention, CommentHistory
+from .models import Comment, CommentLike, CommentImage, CommentReport, Mention, CommentHistory, PARENT_PREVIEW_LENGTH
 from users.serializers import UserSimpleSerializer
 from posts.serializers import PostListSerializer
+from posts.viewer_state import ViewerStateListSerializer, get_viewer_state
+from tieba_project.pagination import KeysetPagination, encode_cursor
+
+
+# 评论详情中预览的楼中楼回复条数
+REPLY_PREVIEW_SIZE = 5
+# 楼中楼回复的游标排序键
+REPLY_ORDERING = ('created_at', 'id')
+
+
+def get_reply_page(comment, context, size=REPLY_PREVIEW_SIZE):
+    """获取评论的第一页回复，next 为回复列表接口的游标地址
+
+    沿 (parent, status, created_at, id) 索引只读取 size + 1 条，不扫描全部回复。
+    """
+    replies = Comment.objects.filter(parent=comment, status=1).for_page()
+    page, next_position = KeysetPagination(REPLY_ORDERING).paginate(replies, page_size=size)
+    
+    next_url = None
+    if next_position is not None:
+        next_url = reverse('comment-replies', args=[comment.id]) + f'?cursor={encode_cursor(next_position)}'
+        request = context.get('request')
+        if request is not None:
+            next_url = request.build_absolute_uri(next_url)
+    
+    return {
+        'count': comment.reply_count,
+        'next': next_url,
+        'results': CommentListSerializer(page, many=True, context=context).data,
+    }
 
 
 class CommentImageSerializer(serializers.ModelSerializer):
@@ -9,7 +40,7 @@ class CommentImageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CommentImage
-        fields = ['id', 'image', 'description', 'created_at']
+        fields = ['id', 'image', 'sort_order', 'created_at']
 
 
 class CommentCreateSerializer(serializers.ModelSerializer):
@@ -39,6 +70,7 @@ class CommentCreateSerializer(serializers.ModelSerializer):
             except Comment.DoesNotExist:
                 pass
         
+        # 计数在评论变为可见时由 Comment.save 同步
         comment = Comment.objects.create(**validated_data)
         
         # 处理图片
@@ -64,21 +96,30 @@ class CommentListSerializer(serializers.ModelSerializer):
             'id', 'content', 'author', 'parent', 'created_at',
             'like_count', 'reply_count', 'is_liked', 'images', 'is_anonymous'
         ]
+        list_serializer_class = ViewerStateListSerializer
+    
+    def preload_viewer_state(self, state, comments):
+        """一次性加载当前用户对整页评论的点赞状态"""
+        state.prefetch(CommentLike, 'comment', [comment.id for comment in comments])
     
     def get_parent(self, obj):
         if obj.parent:
+            # 未经 for_page 预加载时退回到完整内容
+            content = getattr(obj.parent, 'content_preview', None)
+            if content is None:
+                content = obj.parent.content
+            if len(content) > PARENT_PREVIEW_LENGTH:
+                content = content[:PARENT_PREVIEW_LENGTH] + '...'
             return {
                 'id': obj.parent.id,
-                'content': obj.parent.content,
+                'content': content,
                 'author': UserSimpleSerializer(obj.parent.author).data
             }
         return None
     
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return CommentLike.objects.filter(comment=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(CommentLike, 'comment', obj.id) if state else False
 
 
 class CommentDetailSerializer(serializers.ModelSerializer):
@@ -103,10 +144,8 @@ class CommentDetailSerializer(serializers.ModelSerializer):
         ]
     
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return CommentLike.objects.filter(comment=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(CommentLike, 'comment', obj.id) if state else False
     
     def get_is_author(self, obj):
         request = self.context.get('request')
@@ -115,9 +154,9 @@ class CommentDetailSerializer(serializers.ModelSerializer):
         return False
     
     def get_replies(self, obj):
-        """获取回复列表"""
-        replies = Comment.objects.filter(parent=obj, status=1).order_by('created_at')
-        return CommentListSerializer(replies, many=True, context=self.context).data
+        """获取回复预览：前几条回复、回复总数和后续分页地址"""
+        size = self.context.get('reply_preview_size', REPLY_PREVIEW_SIZE)
+        return get_reply_page(obj, self.context, size=size)
 
 
 class CommentUpdateSerializer(serializers.ModelSerializer):
@@ -172,4 +211,4 @@ class CommentHistorySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = CommentHistory
-        fields = ['id', 'content', 'created_at']
\ No newline at end of file
+        fields = ['id', 'content', 'edited_at']
\ No newline at end of file
@@ -0,0 +1,195 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from posts.models import Post
+from tieba.models import Category, Tieba
+from tieba_project.background import flush_all
+from users.models import User
+
+from .models import PARENT_PREVIEW_LENGTH, Comment
+from .serializers import REPLY_PREVIEW_SIZE, CommentListSerializer
+
+
+def create_thread(username='author'):
+    """创建一个已发布的帖子及其所在贴吧"""
+    user = User.objects.create_user(username=username, password='password', email=f'{username}@example.com')
+    category = Category.objects.create(name=f'{username}-category')
+    tieba = Tieba.objects.create(name=f'{username}-tieba', owner=user, category=category, status=1)
+    post = Post.objects.create(title='标题', content='内容', author=user, tieba=tieba, status=1)
+    return user, post
+
+
+class FloorAllocationTests(TransactionTestCase):
+    """并发回复时的楼层号分配"""
+
+    REQUESTS = 200
+    WORKERS = 16
+
+    def tearDown(self):
+        flush_all()
+
+    def test_parallel_creates_get_unique_contiguous_floors(self):
+        user, post = create_thread()
+        url = reverse('comment-create')
+
+        def reply(index):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                return client.post(url, {'post': post.id, 'content': f'回复 {index}'}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            statuses = list(executor.map(reply, range(self.REQUESTS)))
+
+        self.assertEqual(statuses, [201] * self.REQUESTS)
+        floors = sorted(Comment.objects.filter(post=post).values_list('floor_number', flat=True))
+        self.assertEqual(floors, list(range(1, self.REQUESTS + 1)))
+        post.refresh_from_db()
+        self.assertEqual(post.floor_count, self.REQUESTS)
+
+
+class CommentCounterTests(TransactionTestCase):
+    """评论计数只计入可见（status == 1）的评论"""
+
+    def setUp(self):
+        self.user, self.post = create_thread()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        flush_all()
+
+    def counts(self):
+        return (
+            Post.objects.values_list('reply_count', flat=True).get(pk=self.post.pk),
+            User.objects.values_list('comment_count', flat=True).get(pk=self.user.pk),
+        )
+
+    def create_comment(self):
+        response = self.client.post(reverse('comment-create'), {'post': self.post.id, 'content': '回复'})
+        self.assertEqual(response.status_code, 201)
+        return Comment.objects.get(pk=response.data['comment']['id'])
+
+    def delete_comment(self, comment):
+        response = self.client.delete(reverse('comment-delete', args=[comment.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_then_delete_leaves_no_drift(self):
+        comment = self.create_comment()
+        self.assertEqual(self.counts(), (0, 0))
+        self.delete_comment(comment)
+        self.assertEqual(self.counts(), (0, 0))
+
+    def test_publish_then_delete(self):
+        comment = self.create_comment()
+        comment.status = 1
+        comment.save()
+        self.assertEqual(self.counts(), (1, 1))
+        self.delete_comment(comment)
+        self.delete_comment(comment)
+        self.assertEqual(self.counts(), (0, 0))
+
+
+class CommentPageTests(TransactionTestCase):
+    """评论分页的查询数与分页大小无关，引用的父评论只返回内容摘要"""
+
+    def setUp(self):
+        self.user, self.post = create_thread()
+        self.parent = Comment.objects.create(post=self.post, author=self.user, content='长' * 300, status=1)
+
+    def tearDown(self):
+        flush_all()
+
+    def add_replies(self, count, start=0):
+        for index in range(start, start + count):
+            author = User.objects.create_user(
+                username=f'replier{index}', password='password', email=f'replier{index}@example.com'
+            )
+            Comment.objects.create(post=self.post, author=author, parent=self.parent, content=f'回复 {index}', status=1)
+
+    def count_queries(self):
+        replies = Comment.objects.filter(parent=self.parent, status=1).for_page()
+        with CaptureQueriesContext(connection) as queries:
+            data = CommentListSerializer(replies, many=True, context={}).data
+        return len(queries), data
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.add_replies(2)
+        small, data = self.count_queries()
+        self.assertEqual(len(data), 2)
+        self.add_replies(6, start=2)
+        large, data = self.count_queries()
+        self.assertEqual(len(data), 8)
+        self.assertEqual(small, large)
+
+    def test_quoted_parent_is_trimmed(self):
+        self.add_replies(1)
+        _, data = self.count_queries()
+        parent = data[0]['parent']
+        self.assertEqual(parent['id'], self.parent.id)
+        self.assertEqual(parent['content'], '长' * PARENT_PREVIEW_LENGTH + '...')
+        self.assertEqual(parent['author']['username'], self.user.username)
+
+    def test_replies_endpoint_quotes_parent(self):
+        self.add_replies(3)
+        response = APIClient().get(reverse('comment-replies', args=[self.parent.id]))
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([item['content'] for item in results], ['回复 0', '回复 1', '回复 2'])
+        self.assertTrue(all(item['parent']['content'].endswith('...') for item in results))
+
+
+class ReplyPreviewTests(TransactionTestCase):
+    """评论详情只返回前几条回复、回复总数和后续分页游标"""
+
+    def setUp(self):
+        self.user, self.post = create_thread()
+        self.parent = Comment.objects.create(post=self.post, author=self.user, content='楼主', status=1)
+        for index in range(REPLY_PREVIEW_SIZE + 3):
+            Comment.objects.create(post=self.post, author=self.user, parent=self.parent, content=f'回复 {index}', status=1)
+        self.client = APIClient()
+
+    def tearDown(self):
+        flush_all()
+
+    def test_detail_returns_bounded_preview(self):
+        response = self.client.get(reverse('comment-detail', args=[self.parent.id]))
+        self.assertEqual(response.status_code, 200)
+        replies = response.json()['replies']
+        self.assertEqual(replies['count'], REPLY_PREVIEW_SIZE + 3)
+        self.assertEqual(
+            [item['content'] for item in replies['results']],
+            [f'回复 {index}' for index in range(REPLY_PREVIEW_SIZE)],
+        )
+        self.assertIn(reverse('comment-replies', args=[self.parent.id]), replies['next'])
+
+    def test_next_cursor_continues_after_preview(self):
+        replies = self.client.get(reverse('comment-detail', args=[self.parent.id])).json()['replies']
+        response = self.client.get(replies['next'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item['content'] for item in response.json()['results']],
+            [f'回复 {index}' for index in range(REPLY_PREVIEW_SIZE, REPLY_PREVIEW_SIZE + 3)],
+        )
+
+    def test_short_thread_has_no_next(self):
+        other = Comment.objects.create(post=self.post, author=self.user, content='沙发', status=1)
+        Comment.objects.create(post=self.post, author=self.user, parent=other, content='回复', status=1)
+        replies = self.client.get(reverse('comment-detail', args=[other.id])).json()['replies']
+        self.assertEqual(replies['count'], 1)
+        self.assertEqual(len(replies['results']), 1)
+        self.assertIsNone(replies['next'])
+
+    def test_reply_count_follows_visibility(self):
+        reply = Comment.objects.filter(parent=self.parent).first()
+        reply.status = 2
+        reply.save()
+        self.parent.refresh_from_db()
+        self.assertEqual(self.parent.reply_count, REPLY_PREVIEW_SIZE + 2)
@@ -4,17 +4,55 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.db.models import Q
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 
 from .models import Comment, CommentLike, CommentImage, CommentReport, Mention, CommentHistory
 from .serializers import (
     CommentCreateSerializer, CommentListSerializer, CommentDetailSerializer,
     CommentUpdateSerializer, CommentLikeSerializer, CommentReportSerializer,
-    CommentReportCreateSerializer, MentionSerializer, CommentHistorySerializer
+    CommentReportCreateSerializer, MentionSerializer, CommentHistorySerializer,
+    REPLY_ORDERING
 )
 from posts.models import Post
-from users.models import UserActivity
+from posts.hot_score import hot_scores
+from tieba.activity import EVENT_COMMENT, tieba_activity
+from users.activity_log import activity_logger
+from search.backends import DOC_COMMENT
+from search.indexer import load_in_order, search_ids
+from tieba_project.conditional import conditional
+from tieba_project.likes import like_engine
+from tieba_project.pagination import KeysetPagination, cached_count
+from tieba_project.response_cache import bump, get_versions
+
+
+def thread_stamp(request, post_id):
+    """帖子评论列表的版本戳：楼层数、回复数、最后回复时间和帖子的评论范围版本"""
+    row = Post.objects.filter(id=post_id, status=1).values_list(
+        'updated_at', 'last_reply_at', 'floor_count', 'reply_count'
+    ).first()
+    if row is None:
+        return None
+    updated_at, last_reply_at = row[0], row[1]
+    parts = [*row, *get_versions([f'comments:post:{post_id}'])]
+    return parts, max(updated_at, last_reply_at) if last_reply_at else updated_at
+
+
+def comment_stamp(request, comment_id):
+    """评论详情和回复列表的版本戳
+
+    回复预览随新回复变化，而评论本身没有最后回复时间，因此只提供 ETag，不提供 Last-Modified。
+    """
+    row = Comment.objects.filter(id=comment_id, status=1).values_list(
+        'post_id', 'updated_at', 'reply_count', 'like_count',
+        'post__updated_at', 'post__reply_count', 'post__like_count',
+    ).first()
+    if row is None:
+        return None
+    parts = [*row, *get_versions([f'comments:post:{row[0]}'])]
+    if request.user.is_authenticated:
+        parts.append(comment_id in like_engine.active_ids(CommentLike, request.user.id, [comment_id]))
+    return parts, None
 
 
 class CommentListView(APIView):
@@ -22,34 +60,27 @@ class CommentListView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(conditional(thread_stamp))
     def get(self, request, post_id):
         """获取帖子评论列表"""
         try:
             post = Post.objects.get(id=post_id, status=1)
             
-            # 获取顶级评论（没有父评论的评论）
+            # 获取顶级评论（没有父评论的评论），按楼层顺序
             comments = Comment.objects.filter(
                 post=post, parent__isnull=True, status=1
-            ).select_related('author').prefetch_related('images').order_by('-is_top', 'created_at')
+            ).for_page()
             
             # 分页
-            page = self.paginate_queryset(comments, request)
-            if page is not None:
-                serializer = CommentListSerializer(page, many=True, context={'request': request})
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = CommentListSerializer(comments[:20], many=True, context={'request': request})
-            return Response(serializer.data)
+            paginator = KeysetPagination(('floor_number', 'id'))
+            page = paginator.paginate_queryset(comments, request)
+            serializer = CommentListSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(
+                serializer.data, count=cached_count(comments, f'comment_list_count:{post.id}')
+            )
             
         except Post.DoesNotExist:
             return Response({'error': '帖子不存在'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
 
 
 class CommentCreateView(APIView):
@@ -68,13 +99,11 @@ class CommentCreateView(APIView):
                 return Response({'error': '帖子不存在'}, status=status.HTTP_404_NOT_FOUND)
             
             comment = serializer.save(author=request.user)
-            
-            # 更新帖子评论计数
-            post.comment_count += 1
-            post.save()
+            hot_scores.touch(post.id)
+            tieba_activity.record(post.tieba_id, EVENT_COMMENT)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='comment_create',
                 target_type='comment',
@@ -94,6 +123,7 @@ class CommentDetailView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(conditional(comment_stamp))
     def get(self, request, comment_id):
         """获取评论详情"""
         try:
@@ -125,7 +155,7 @@ class CommentUpdateView(APIView):
                 serializer.save()
                 
                 # 记录活动
-                UserActivity.objects.create(
+                activity_logger.log(
                     user=request.user,
                     action='comment_update',
                     target_type='comment',
@@ -150,17 +180,15 @@ class CommentDeleteView(APIView):
     def delete(self, request, comment_id):
         """删除评论"""
         try:
-            comment = Comment.objects.get(id=comment_id, author=request.user)
-            comment.status = 0  # 软删除
-            comment.save()
-            
-            # 更新帖子评论计数
-            post = comment.post
-            post.comment_count -= 1
-            post.save()
+            with transaction.atomic():
+                # 锁住评论行，重复删除时不会重复扣减计数（计数由 Comment.save 按可见状态同步）
+                comment = Comment.objects.select_for_update().get(id=comment_id, author=request.user)
+                comment.status = 0  # 软删除
+                comment.save()
+            hot_scores.touch(comment.post_id)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='comment_delete',
                 target_type='comment',
@@ -181,32 +209,27 @@ class CommentLikeView(APIView):
         """点赞/取消点赞评论"""
         try:
             comment = Comment.objects.get(id=comment_id, status=1)
-            like, created = CommentLike.objects.get_or_create(comment=comment, user=request.user)
+            liked, like_count = like_engine.toggle(CommentLike, comment.id, request.user.id)
+            # 评论列表中的点赞状态随之变化，使该帖子评论接口的 ETag 失效
+            bump(f'comments:post:{comment.post_id}')
             
-            if not created:
-                # 取消点赞
-                like.delete()
-                comment.like_count -= 1
+            if not liked:
                 message = '取消点赞成功'
             else:
-                # 点赞成功
-                comment.like_count += 1
                 message = '点赞成功'
                 
                 # 记录活动
-                UserActivity.objects.create(
+                activity_logger.log(
                     user=request.user,
                     action='comment_like',
                     target_type='comment',
                     target_id=comment.id
                 )
             
-            comment.save()
-            
             return Response({
                 'message': message,
-                'like_count': comment.like_count,
-                'is_liked': created
+                'like_count': like_count,
+                'is_liked': liked
             })
             
         except Comment.DoesNotExist:
@@ -246,29 +269,21 @@ class CommentRepliesView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(conditional(comment_stamp))
     def get(self, request, comment_id):
         """获取评论的回复列表"""
         try:
             comment = Comment.objects.get(id=comment_id, status=1)
-            replies = Comment.objects.filter(parent=comment, status=1).order_by('created_at')
             
-            page = self.paginate_queryset(replies, request)
-            if page is not None:
-                serializer = CommentListSerializer(page, many=True, context={'request': request})
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = CommentListSerializer(replies, many=True, context={'request': request})
-            return Response(serializer.data)
+            # 与评论详情中回复预览共用排序键，预览返回的 next 游标可直接翻页
+            paginator = KeysetPagination(REPLY_ORDERING)
+            replies = Comment.objects.filter(parent=comment, status=1).for_page()
+            page = paginator.paginate_queryset(replies, request)
+            serializer = CommentListSerializer(page, many=True, context={'request': request})
+            return paginator.get_paginated_response(serializer.data, count=comment.reply_count)
             
         except Comment.DoesNotExist:
             return Response({'error': '评论不存在'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
 
 
 class UserCommentsView(APIView):
@@ -277,22 +292,12 @@ class UserCommentsView(APIView):
     @method_decorator(login_required)
     def get(self, request):
         """获取用户发表的评论"""
-        comments = Comment.objects.filter(author=request.user, status=1).order_by('-created_at')
+        comments = Comment.objects.filter(author=request.user, status=1).for_page()
         
-        page = self.paginate_queryset(comments, request)
-        if page is not None:
-            serializer = CommentListSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
-        
-        serializer = CommentListSerializer(comments[:20], many=True, context={'request': request})
-        return Response(serializer.data)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
+        paginator = KeysetPagination(('-created_at', '-id'))
+        page = paginator.paginate_queryset(comments, request)
+        serializer = CommentListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
@@ -318,10 +323,8 @@ def search_comments(request):
     if not query:
         return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
     
-    comments = Comment.objects.filter(
-        Q(content__icontains=query),
-        status=1
-    ).order_by('-created_at')
+    _, ids = search_ids(DOC_COMMENT, query, limit=20)
+    comments = load_in_order(Comment.objects.filter(status=1).for_page(), ids)
     
-    serializer = CommentListSerializer(comments[:20], many=True, context={'request': request})
+    serializer = CommentListSerializer(comments, many=True, context={'request': request})
     return Response({'results': serializer.data})
\ No newline at end of file
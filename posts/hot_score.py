@@ -0,0 +1,136 @@
+"""
+帖子热度分与热榜
+
+热度分采用 Reddit 式的对数互动分加发布时间项：
+    score = log10(max(互动分, 1)) + 发布时间戳 / HOT_SCORE_DECAY
+    互动分 = 浏览 * 0.01 + 点赞 * 1 + 回复 * 2 + 收藏 * 3
+发布时间每早 HOT_SCORE_DECAY 秒，需要 10 倍的互动量才能与新帖持平。
+分数只取决于计数和发布时间，算好后不会随时间推移失效，
+因此只在计数变化时重算，结果存入有索引的 Post.hot_score。
+
+计数变化时调用 hot_scores.touch(post_id)，由后台线程批量重算待更新帖子的分数，
+随后刷新受影响贴吧和全站的 Top-N 热榜（缓存中的帖子ID列表），并同步 Post.is_hot，
+同时让搜索索引更新这些帖子的热度。
+refresh_hot_scores 命令分批全量重算，用于回填和修正。
+"""
+
+import math
+import threading
+
+from django.conf import settings
+
+from tieba_project.background import BackgroundBatcher
+from tieba_project.cache_fill import get_or_fill, store
+from tieba_project.response_cache import bump
+
+# 计数字段 -> 互动分权重
+WEIGHTS = {
+    'view_count': 0.01,
+    'like_count': 1.0,
+    'reply_count': 2.0,
+    'collect_count': 3.0,
+}
+
+GLOBAL_LIST_KEY = 'hot_posts:global'
+TIEBA_LIST_KEY = 'hot_posts:tieba:{tieba_id}'
+
+
+def hot_score(counts, created_at, decay):
+    """根据计数字典和发布时间计算热度分"""
+    points = sum(counts[field] * weight for field, weight in WEIGHTS.items())
+    return math.log10(max(points, 1)) + created_at.timestamp() / decay
+
+
+class HotScoreEngine:
+    """热度分增量重算与热榜维护"""
+
+    def __init__(self, decay, list_size, flush_interval, list_timeout):
+        self.decay = decay
+        self.list_size = list_size
+        self.flush_interval = flush_interval
+        self.list_timeout = list_timeout
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batcher = BackgroundBatcher('hot-score', self.flush, flush_interval, '重算帖子热度分失败')
+
+    def score(self, counts, created_at):
+        return hot_score(counts, created_at, self.decay)
+
+    def touch(self, post_id):
+        """标记帖子的计数已变化，稍后重算热度分"""
+        with self._lock:
+            self._dirty.add(post_id)
+        self._batcher.start()
+
+    def flush(self):
+        """重算全部待更新帖子并刷新热榜，返回重算的帖子数"""
+        from .models import Post
+
+        with self._lock:
+            post_ids, self._dirty = self._dirty, set()
+        if not post_ids:
+            return 0
+        with self._flush_lock:
+            try:
+                tieba_ids = self.recompute(post_ids)
+            except Exception:
+                # 重算失败时放回待更新集合，下次继续
+                with self._lock:
+                    self._dirty |= post_ids
+                raise
+            self.refresh_lists(tieba_ids)
+        from search.indexer import search_index
+        search_index.touch(Post, post_ids)
+        return len(post_ids)
+
+    def recompute(self, post_ids):
+        """重算指定帖子的热度分，返回涉及的贴吧ID集合"""
+        from .models import Post
+
+        rows = Post.objects.filter(id__in=post_ids).values('id', 'tieba_id', 'created_at', *WEIGHTS)
+        updated = []
+        tieba_ids = set()
+        for row in rows:
+            updated.append(Post(id=row['id'], hot_score=self.score(row, row['created_at'])))
+            tieba_ids.add(row['tieba_id'])
+        Post.objects.bulk_update(updated, ['hot_score'], batch_size=500)
+        return tieba_ids
+
+    def refresh_lists(self, tieba_ids=()):
+        """沿 hot_score 索引重建全站和指定贴吧的热榜"""
+        from .models import Post
+
+        hot_ids = store(GLOBAL_LIST_KEY, self._build_list(Post.objects.filter(status=1)), self.list_timeout)
+        Post.objects.filter(is_hot=True).exclude(id__in=hot_ids).update(is_hot=False)
+        Post.objects.filter(id__in=hot_ids, is_hot=False).update(is_hot=True)
+
+        for tieba_id in tieba_ids:
+            store(
+                TIEBA_LIST_KEY.format(tieba_id=tieba_id),
+                self._build_list(Post.objects.filter(tieba_id=tieba_id, status=1)),
+                self.list_timeout,
+            )
+        bump('hot_posts')
+
+    def top(self, tieba_id=None, limit=20):
+        """热榜中的帖子ID，按热度从高到低"""
+        from .models import Post
+
+        if tieba_id is None:
+            key, queryset = GLOBAL_LIST_KEY, Post.objects.filter(status=1)
+        else:
+            key = TIEBA_LIST_KEY.format(tieba_id=tieba_id)
+            queryset = Post.objects.filter(tieba_id=tieba_id, status=1)
+        return get_or_fill(key, lambda: self._build_list(queryset), self.list_timeout)[:limit]
+
+    def _build_list(self, queryset):
+        return list(queryset.order_by('-hot_score', '-id').values_list('id', flat=True)[:self.list_size])
+
+
+hot_scores = HotScoreEngine(
+    decay=getattr(settings, 'HOT_SCORE_DECAY', 45000),
+    list_size=getattr(settings, 'HOT_LIST_SIZE', 100),
+    flush_interval=getattr(settings, 'HOT_SCORE_FLUSH_INTERVAL', 30),
+    list_timeout=getattr(settings, 'HOT_LIST_CACHE_SECONDS', 600),
+)
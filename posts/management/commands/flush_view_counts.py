@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.view_counter import MemoryViewBuffer, view_counter
+
+
+class Command(BaseCommand):
+    """把缓冲中的帖子浏览量写回数据库，部署下线前执行（需要 VIEW_COUNTER_BACKEND=redis）"""
+
+    help = '写回缓冲中的帖子浏览量和贴吧总浏览量（需要 VIEW_COUNTER_BACKEND=redis）'
+
+    def handle(self, *args, **options):
+        if isinstance(view_counter.buffer, MemoryViewBuffer):
+            # 命令进程的内存缓冲是空的，服务进程的计数由其后台线程定期写回，进程退出时也会写回
+            raise CommandError('VIEW_COUNTER_BACKEND 为 memory，计数只在服务进程内，由服务的后台线程和退出时的钩子写回')
+
+        total = 0
+        while True:
+            flushed = view_counter.flush()
+            if not flushed:
+                break
+            total += flushed
+        self.stdout.write(self.style.SUCCESS(f'已写回 {total} 个帖子的浏览量'))
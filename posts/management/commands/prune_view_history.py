@@ -0,0 +1,54 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+
+from posts.models import PostViewHistory
+from posts.view_history import trim_history
+
+
+class Command(BaseCommand):
+    """清理过期浏览历史，并把超出上限的用户历史截断"""
+
+    help = '按 TTL 和每用户上限清理帖子浏览历史'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl-days', type=int,
+            default=getattr(settings, 'VIEW_HISTORY_TTL_DAYS', 180),
+            help='保留天数，0 表示不按时间清理',
+        )
+        parser.add_argument(
+            '--max-per-user', type=int,
+            default=getattr(settings, 'VIEW_HISTORY_MAX_PER_USER', 500),
+            help='每个用户最多保留的记录数，0 表示不限制',
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='每条截断语句处理的用户数')
+
+    def handle(self, *args, **options):
+        ttl_days = options['ttl_days']
+        max_per_user = options['max_per_user']
+
+        expired = 0
+        if ttl_days:
+            cutoff = timezone.now() - timedelta(days=ttl_days)
+            expired, _ = PostViewHistory.objects.filter(viewed_at__lt=cutoff).delete()
+
+        trimmed = 0
+        if max_per_user:
+            user_ids = (
+                PostViewHistory.objects.values('user_id')
+                .annotate(total=Count('id'))
+                .filter(total__gt=max_per_user)
+                .values_list('user_id', flat=True)
+            )
+            user_ids = list(user_ids)
+            chunk_size = options['chunk_size']
+            for start in range(0, len(user_ids), chunk_size):
+                trimmed += trim_history(user_ids[start:start + chunk_size], max_per_user)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'已清理过期记录 {expired} 条，超限记录 {trimmed} 条'
+        ))
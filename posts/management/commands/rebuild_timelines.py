@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from posts.timeline import MemoryTimelineStore, home_timeline
+from users.models import User
+
+
+class Command(BaseCommand):
+    """从数据库重建用户的关注动态时间线，用于调整分发阈值或修复时间线后"""
+
+    help = '重建指定用户或全部有关注的用户的关注动态时间线'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids', help='只重建该用户，可重复指定')
+        parser.add_argument('--chunk-size', type=int, default=500, help='每批读取的用户数')
+
+    def handle(self, *args, **options):
+        if isinstance(home_timeline.store, MemoryTimelineStore):
+            self.stdout.write(self.style.WARNING('TIMELINE_BACKEND 为 memory，重建只作用于本进程，不影响运行中的服务'))
+
+        if options['user_ids']:
+            for user_id in options['user_ids']:
+                home_timeline.following_changed(user_id)
+                home_timeline.rebuild(user_id)
+            self.stdout.write(self.style.SUCCESS(f'重建时间线 {len(options["user_ids"])} 个'))
+            return
+
+        chunk_size = options['chunk_size']
+        total = 0
+        last_id = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id, following_count__gt=0)
+                .order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            for user_id in user_ids:
+                home_timeline.following_changed(user_id)
+                home_timeline.rebuild(user_id)
+            total += len(user_ids)
+        self.stdout.write(self.style.SUCCESS(f'重建时间线 {total} 个'))
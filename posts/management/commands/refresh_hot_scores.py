@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts.hot_score import hot_scores
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    """分批全量重算帖子热度分并重建热榜"""
+
+    help = '重算帖子热度分并重建全站、贴吧热榜'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='每批重算的帖子数')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        total = 0
+        tieba_ids = set()
+        last_id = 0
+        while True:
+            post_ids = list(
+                Post.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+            )
+            if not post_ids:
+                break
+            last_id = post_ids[-1]
+            tieba_ids |= hot_scores.recompute(post_ids)
+            total += len(post_ids)
+
+        hot_scores.refresh_lists(tieba_ids)
+        self.stdout.write(self.style.SUCCESS(f'重算帖子 {total} 个，刷新贴吧热榜 {len(tieba_ids)} 个'))
@@ -1,12 +1,17 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from tieba.models import Tieba
+from tieba.activity import EVENT_POST, tieba_activity
+from tieba.models import Tieba, TiebaMember
+from tieba_project.counters import VisibilityCounted, adjust, adjust_rows
+from .hot_score import WEIGHTS as HOT_SCORE_WEIGHTS, hot_scores
+from .timeline import home_timeline
 
 User = get_user_model()
 
 
-class Post(models.Model):
+class Post(VisibilityCounted, models.Model):
     """帖子模型"""
     
     STATUS_CHOICES = [
@@ -35,6 +40,7 @@ class Post(models.Model):
     # 帖子类型和状态
     post_type = models.CharField('帖子类型', max_length=20, choices=TYPE_CHOICES, default='normal')
     status = models.IntegerField('状态', choices=STATUS_CHOICES, default=0)
+    is_anonymous = models.BooleanField('是否匿名', default=False)
     
     # 统计信息
     view_count = models.IntegerField('浏览量', default=0)
@@ -42,11 +48,13 @@ class Post(models.Model):
     like_count = models.IntegerField('点赞数', default=0)
     collect_count = models.IntegerField('收藏数', default=0)
     share_count = models.IntegerField('分享数', default=0)
+    floor_count = models.IntegerField('已分配楼层数', default=0)
     
     # 管理信息
     is_top = models.BooleanField('是否置顶', default=False)
     is_essence = models.BooleanField('是否精华', default=False)
     is_hot = models.BooleanField('是否热门', default=False)
+    hot_score = models.FloatField('热度分', default=0)
     
     # 审核信息
     reviewer = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='reviewed_posts')
@@ -66,11 +74,14 @@ class Post(models.Model):
         indexes = [
             models.Index(fields=['tieba', 'status', 'created_at']),
             models.Index(fields=['author', 'created_at']),
+            models.Index(fields=['author', 'status', 'id']),
             models.Index(fields=['is_top', 'created_at']),
             models.Index(fields=['is_essence', 'created_at']),
             models.Index(fields=['view_count']),
             models.Index(fields=['reply_count']),
             models.Index(fields=['last_reply_at']),
+            models.Index(fields=['status', 'hot_score']),
+            models.Index(fields=['tieba', 'status', 'hot_score']),
         ]
         ordering = ['-is_top', '-created_at']
     
@@ -78,11 +89,40 @@ class Post(models.Model):
         return self.title
     
     def save(self, *args, **kwargs):
-        """保存时自动设置发布时间"""
+        """保存时自动设置发布时间，新帖计算初始热度分"""
         if self.status == 1 and not self.published_at:
             self.published_at = timezone.now()
+        if self._state.adding:
+            self.hot_score = hot_scores.score(
+                {field: getattr(self, field) for field in HOT_SCORE_WEIGHTS}, self.created_at
+            )
         super().save(*args, **kwargs)
     
+    def allocate_floor(self):
+        """原子地分配下一个楼层号"""
+        with transaction.atomic():
+            # UPDATE 会锁住帖子行，并发回复在此排队，保证楼层号不重复；同时记下最后回复时间
+            now = timezone.now()
+            Post.objects.filter(pk=self.pk).update(floor_count=F('floor_count') + 1, last_reply_at=now)
+            self.floor_count = Post.objects.filter(pk=self.pk).values_list('floor_count', flat=True).get()
+            self.last_reply_at = now
+        return self.floor_count
+    
+    def update_counters(self, amount):
+        """帖子变为可见（1）或不再可见（-1）时同步贴吧、作者及其成员关系的发帖数，
+        并在事务提交后更新贴吧活跃度和粉丝的关注动态"""
+        tieba_deltas = {'post_count': amount}
+        post_id, author_id, tieba_id = self.pk, self.author_id, self.tieba_id
+        if amount > 0:
+            tieba_deltas['today_post_count'] = amount
+            transaction.on_commit(lambda: tieba_activity.record(tieba_id, EVENT_POST))
+            transaction.on_commit(lambda: home_timeline.publish(post_id, author_id))
+        else:
+            transaction.on_commit(lambda: home_timeline.retract(post_id, author_id))
+        adjust(Tieba, self.tieba_id, **tieba_deltas)
+        adjust(User, self.author_id, post_count=amount)
+        adjust_rows(TiebaMember.objects.filter(tieba_id=self.tieba_id, user_id=self.author_id), post_count=amount)
+    
     def update_last_reply(self):
         """更新最后回复时间"""
         self.last_reply_at = timezone.now()
@@ -209,6 +249,7 @@ class PostViewHistory(models.Model):
         db_table = 'post_view_history'
         verbose_name = '帖子浏览历史'
         verbose_name_plural = '帖子浏览历史'
+        unique_together = ('user', 'post')
         indexes = [
             models.Index(fields=['user', 'viewed_at']),
             models.Index(fields=['post', 'viewed_at']),
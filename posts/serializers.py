@@ -2,6 +2,10 @@ from rest_framework import serializers
 from .models import Post, PostImage, PostAttachment, PostLike, PostCollect, PostReport, PostViewHistory
 from users.serializers import UserSimpleSerializer
 from tieba.serializers import TiebaSimpleSerializer
+from .viewer_state import ViewerStateListSerializer, get_viewer_state
+
+# 列表中帖子内容摘要的长度
+CONTENT_PREVIEW_LENGTH = 100
 
 
 class PostImageSerializer(serializers.ModelSerializer):
@@ -9,7 +13,7 @@ class PostImageSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PostImage
-        fields = ['id', 'image', 'description', 'created_at']
+        fields = ['id', 'image', 'caption', 'created_at']
 
 
 class PostAttachmentSerializer(serializers.ModelSerializer):
@@ -17,7 +21,7 @@ class PostAttachmentSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PostAttachment
-        fields = ['id', 'file', 'filename', 'file_size', 'created_at']
+        fields = ['id', 'file', 'file_name', 'file_size', 'created_at']
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -62,8 +66,9 @@ class PostListSerializer(serializers.ModelSerializer):
     
     author = UserSimpleSerializer(read_only=True)
     tieba = TiebaSimpleSerializer(read_only=True)
+    content_preview = serializers.SerializerMethodField()
     like_count = serializers.IntegerField(read_only=True)
-    comment_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(source='reply_count', read_only=True)
     is_liked = serializers.SerializerMethodField()
     is_collected = serializers.SerializerMethodField()
     
@@ -72,20 +77,26 @@ class PostListSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'title', 'content_preview', 'author', 'tieba', 'created_at',
             'like_count', 'comment_count', 'view_count', 'is_essence', 'is_top',
-            'is_liked', 'is_collected'
+            'is_anonymous', 'is_liked', 'is_collected'
         ]
+        list_serializer_class = ViewerStateListSerializer
+    
+    def preload_viewer_state(self, state, posts):
+        """一次性加载当前用户对整页帖子的点赞、收藏状态"""
+        post_ids = [post.id for post in posts]
+        state.prefetch(PostLike, 'post', post_ids)
+        state.prefetch(PostCollect, 'post', post_ids)
+    
+    def get_content_preview(self, obj):
+        return obj.content[:CONTENT_PREVIEW_LENGTH]
     
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostLike.objects.filter(post=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(PostLike, 'post', obj.id) if state else False
     
     def get_is_collected(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostCollect.objects.filter(post=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(PostCollect, 'post', obj.id) if state else False
 
 
 class PostDetailSerializer(serializers.ModelSerializer):
@@ -96,7 +107,7 @@ class PostDetailSerializer(serializers.ModelSerializer):
     images = PostImageSerializer(many=True, read_only=True)
     attachments = PostAttachmentSerializer(many=True, read_only=True)
     like_count = serializers.IntegerField(read_only=True)
-    comment_count = serializers.IntegerField(read_only=True)
+    comment_count = serializers.IntegerField(source='reply_count', read_only=True)
     is_liked = serializers.SerializerMethodField()
     is_collected = serializers.SerializerMethodField()
     is_author = serializers.SerializerMethodField()
@@ -110,16 +121,12 @@ class PostDetailSerializer(serializers.ModelSerializer):
         ]
     
     def get_is_liked(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostLike.objects.filter(post=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(PostLike, 'post', obj.id) if state else False
     
     def get_is_collected(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return PostCollect.objects.filter(post=obj, user=request.user).exists()
-        return False
+        state = get_viewer_state(self.context)
+        return state.has(PostCollect, 'post', obj.id) if state else False
     
     def get_is_author(self, obj):
         request = self.context.get('request')
@@ -181,4 +188,8 @@ class PostViewHistorySerializer(serializers.ModelSerializer):
     
     class Meta:
         model = PostViewHistory
-        fields = ['id', 'post', 'viewed_at']
\ No newline at end of file
+        fields = ['id', 'post', 'viewed_at']
+        list_serializer_class = ViewerStateListSerializer
+    
+    def preload_viewer_state(self, state, history):
+        self.fields['post'].preload_viewer_state(state, [item.post for item in history])
\ No newline at end of file
@@ -0,0 +1,504 @@
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from tieba.activity import EVENT_POST, hour_start, tieba_activity
+from tieba.models import Category, Tieba, TiebaMember
+from tieba_project.background import flush_all
+from tieba_project.likes import like_engine
+from tieba_project.response_cache import VERSION_KEY
+from users.models import FollowRelation, User
+
+from .hot_score import hot_score, hot_scores
+from .models import Post, PostCollect, PostLike, PostViewHistory
+from .serializers import CONTENT_PREVIEW_LENGTH, PostListSerializer
+from .timeline import home_timeline
+from .view_counter import MemoryViewBuffer, ViewCounter
+from .view_history import ViewHistoryRecorder, trim_history
+from .viewer_state import ViewerState
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+class PostCounterTests(TransactionTestCase):
+    """发帖统计只计入可见（status == 1）的帖子"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        self.member = TiebaMember.objects.create(tieba=self.tieba, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        flush_all()
+
+    def counts(self):
+        return (
+            Tieba.objects.values_list('post_count', flat=True).get(pk=self.tieba.pk),
+            User.objects.values_list('post_count', flat=True).get(pk=self.user.pk),
+            TiebaMember.objects.values_list('post_count', flat=True).get(pk=self.member.pk),
+        )
+
+    def create_post(self, status=0):
+        return Post.objects.create(title='标题', content='内容', author=self.user, tieba=self.tieba, status=status)
+
+    def delete_post(self, post):
+        response = self.client.delete(reverse('post-delete', args=[post.id]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_then_delete_unpublished_post_leaves_no_drift(self):
+        post = self.create_post()
+        self.assertEqual(self.counts(), (0, 0, 0))
+        self.delete_post(post)
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def test_publish_then_delete(self):
+        post = self.create_post()
+        post.status = 1
+        post.save()
+        self.assertEqual(self.counts(), (1, 1, 1))
+        self.delete_post(post)
+        self.assertEqual(self.counts(), (0, 0, 0))
+        self.delete_post(post)
+        self.assertEqual(self.counts(), (0, 0, 0))
+
+    def recorded_posts(self):
+        flush_all()
+        return tieba_activity.store.totals(EVENT_POST, [hour_start(time.time())])[self.tieba.pk]
+
+    def test_activity_counts_only_published_posts(self):
+        before = self.recorded_posts()
+        post = self.create_post()
+        self.assertEqual(self.recorded_posts(), before)
+        post.status = 1
+        post.save()
+        post.save()
+        self.assertEqual(self.recorded_posts(), before + 1)
+
+    def test_saving_a_visible_post_again_does_not_recount(self):
+        post = self.create_post(status=1)
+        post.title = '新标题'
+        post.save()
+        Post.objects.get(pk=post.pk).save()
+        self.assertEqual(self.counts(), (1, 1, 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHES, RESPONSE_CACHE_VERSION_TIMEOUT=1)
+class PostListCacheTests(TransactionTestCase):
+    """匿名帖子列表的响应缓存范围"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=user, category=category, status=1)
+        Post.objects.create(title='标题', content='内容', author=user, tieba=self.tieba, status=1)
+
+    def tearDown(self):
+        flush_all()
+
+    def test_invalid_tieba_id_creates_no_scope(self):
+        response = self.client.get(reverse('post-list'), {'tieba': 'abc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(VERSION_KEY.format(scope='post:tieba:abc')))
+
+    def test_version_keys_expire(self):
+        response = self.client.get(reverse('post-list'), {'tieba': self.tieba.id})
+        self.assertEqual(len(response.json()['results']), 1)
+        key = VERSION_KEY.format(scope=f'post:tieba:{self.tieba.id}')
+        self.assertIsNotNone(cache.get(key))
+        time.sleep(1.1)
+        self.assertIsNone(cache.get(key))
+
+
+class FlushViewCountsCommandTests(SimpleTestCase):
+    """内存缓冲下命令拒绝执行，不会误报已写回"""
+
+    def test_refuses_with_memory_buffer(self):
+        with self.assertRaises(CommandError):
+            call_command('flush_view_counts')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewCounterTests(TransactionTestCase):
+    """浏览量在后台批量写回，详情接口返回的浏览量包含本次访问"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        self.post = Post.objects.create(
+            title='标题', content='内容', author=self.user, tieba=self.tieba, status=1, view_count=5
+        )
+        self.counter = ViewCounter(MemoryViewBuffer(), flush_interval=3600)
+
+    def tearDown(self):
+        flush_all()
+
+    def stored_counts(self):
+        return (
+            Post.objects.values_list('view_count', flat=True).get(pk=self.post.pk),
+            Tieba.objects.values_list('total_view_count', flat=True).get(pk=self.tieba.pk),
+        )
+
+    def test_detail_counts_the_current_view(self):
+        flush_all()
+        url = reverse('post-detail', args=[self.post.id])
+        self.assertEqual(APIClient().get(url).data['view_count'], 6)
+        self.assertEqual(APIClient().get(url).data['view_count'], 7)
+        flush_all()
+        self.assertEqual(self.stored_counts(), (7, 2))
+        self.assertEqual(APIClient().get(url).data['view_count'], 8)
+
+    def test_record_view_does_not_write(self):
+        self.assertEqual(self.counter.record_view(self.post.id, self.tieba.id), 1)
+        self.assertEqual(self.counter.record_view(self.post.id, self.tieba.id), 2)
+        self.assertEqual(self.stored_counts(), (5, 0))
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.stored_counts(), (7, 2))
+        self.assertEqual(self.counter.get_pending(self.post.id), 0)
+
+    def test_failed_flush_restores_the_buffer(self):
+        self.counter.record_view(self.post.id, self.tieba.id)
+        with mock.patch('posts.view_counter._apply_increments', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.counter.flush()
+        self.assertEqual(self.counter.get_pending(self.post.id), 1)
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertEqual(self.stored_counts(), (6, 1))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewHistoryTests(TransactionTestCase):
+    """浏览历史按 (用户, 帖子) 去重，并截断到每用户上限"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        self.reader = User.objects.create_user(username='reader', password='password', email='reader@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        self.posts = [
+            Post.objects.create(title=f'标题{i}', content='内容', author=self.user, tieba=self.tieba, status=1)
+            for i in range(4)
+        ]
+        self.recorder = ViewHistoryRecorder(batch_size=100, flush_interval=3600, max_per_user=2)
+
+    def tearDown(self):
+        flush_all()
+
+    def history(self, user):
+        return list(
+            PostViewHistory.objects.filter(user=user).order_by('-viewed_at').values_list('post_id', flat=True)
+        )
+
+    def add_history(self, user, post, minutes_ago):
+        return PostViewHistory.objects.create(
+            user=user, post=post, viewed_at=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+
+    def test_repeated_views_keep_one_row(self):
+        post = self.posts[0]
+        self.recorder.record(self.reader.id, post.id, user_agent='first')
+        self.recorder.record(self.reader.id, post.id, user_agent='second')
+        self.assertEqual(self.recorder.flush(), 2)
+        self.recorder.record(self.reader.id, post.id, user_agent='third')
+        self.recorder.flush()
+        rows = PostViewHistory.objects.filter(user=self.reader)
+        self.assertEqual(rows.count(), 1)
+        self.assertEqual(rows.get().user_agent, 'third')
+
+    def test_duplicate_user_post_is_rejected(self):
+        self.add_history(self.reader, self.posts[0], 0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.add_history(self.reader, self.posts[0], 1)
+
+    def test_flush_trims_to_max_per_user(self):
+        for post in self.posts:
+            self.recorder.record(self.reader.id, post.id)
+        self.recorder.record(self.user.id, self.posts[0].id)
+        self.recorder.flush()
+        self.assertEqual(self.history(self.reader), [self.posts[3].id, self.posts[2].id])
+        self.assertEqual(self.history(self.user), [self.posts[0].id])
+
+    def test_trim_history_handles_several_users_at_once(self):
+        for minutes_ago, post in enumerate(self.posts):
+            self.add_history(self.reader, post, minutes_ago)
+            self.add_history(self.user, post, minutes_ago)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(trim_history([self.reader.id, self.user.id], 3), 2)
+        self.assertEqual([q['sql'].split()[0] for q in queries if q['sql'] not in ('BEGIN', 'COMMIT')], ['DELETE'])
+        self.assertEqual(self.history(self.reader), [post.id for post in self.posts[:3]])
+        self.assertEqual(self.history(self.user), [post.id for post in self.posts[:3]])
+
+    def test_prune_command_applies_ttl_and_limit(self):
+        self.add_history(self.user, self.posts[0], 60 * 24 * 10)
+        for minutes_ago, post in enumerate(self.posts):
+            self.add_history(self.reader, post, minutes_ago)
+        call_command('prune_view_history', ttl_days=7, max_per_user=2, stdout=mock.Mock())
+        self.assertEqual(self.history(self.user), [])
+        self.assertEqual(self.history(self.reader), [self.posts[0].id, self.posts[1].id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HomeTimelineTests(TransactionTestCase):
+    """普通作者的帖子在可见时推送、不再可见时移除，大V作者的帖子在读取时合并"""
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='password', email='reader@example.com')
+        self.author = User.objects.create_user(username='author', password='password', email='author@example.com')
+        self.star = User.objects.create_user(
+            username='star', password='password', email='star@example.com', follower_count=5
+        )
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.author, category=category, status=1)
+        for following in (self.author, self.star):
+            FollowRelation.objects.create(follower=self.reader, following=following)
+        patcher = mock.patch.object(home_timeline, 'fanout_threshold', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        home_timeline.following_changed(self.reader.id)
+
+    def tearDown(self):
+        flush_all()
+        home_timeline.following_changed(self.reader.id)
+
+    def create_post(self, author, status=1):
+        return Post.objects.create(title='标题', content='内容', author=author, tieba=self.tieba, status=status)
+
+    def stored(self):
+        result = home_timeline.store.read(self.reader.id, None, 100, home_timeline.size)
+        return None if result is None else result[0]
+
+    def test_push_on_publish_and_retract_on_soft_delete(self):
+        self.assertEqual(home_timeline.page(self.reader.id)[0], [])
+        draft = self.create_post(self.author, status=0)
+        flush_all()
+        self.assertEqual(self.stored(), [])
+
+        draft.status = 1
+        draft.save()
+        flush_all()
+        self.assertEqual(self.stored(), [draft.id])
+
+        draft.status = 3
+        draft.save()
+        flush_all()
+        self.assertEqual(self.stored(), [])
+
+    def test_pull_authors_are_merged_on_read(self):
+        home_timeline.page(self.reader.id)
+        pushed = self.create_post(self.author)
+        pulled = self.create_post(self.star)
+        flush_all()
+        self.assertEqual(self.stored(), [pushed.id])
+        self.assertEqual(home_timeline.page(self.reader.id)[0], [pulled.id, pushed.id])
+
+    def test_rebuild_reads_visible_posts_of_push_authors(self):
+        posts = [self.create_post(self.author) for _ in range(3)]
+        self.create_post(self.author, status=0)
+        self.create_post(self.star)
+        flush_all()
+        self.assertIsNone(self.stored())
+        self.assertEqual(home_timeline.rebuild(self.reader.id), [post.id for post in reversed(posts)])
+        self.assertEqual(self.stored(), [post.id for post in reversed(posts)])
+
+    def test_follow_and_unfollow_invalidate_the_timeline(self):
+        other = User.objects.create_user(username='other', password='password', email='other@example.com')
+        post = self.create_post(other)
+        flush_all()
+        client = APIClient()
+        client.force_authenticate(self.reader)
+
+        home_timeline.page(self.reader.id)
+        self.assertEqual(client.post(reverse('follow-user', args=[other.id])).status_code, 200)
+        self.assertIsNone(self.stored())
+        self.assertEqual(home_timeline.page(self.reader.id)[0], [post.id])
+
+        self.assertEqual(client.post(reverse('unfollow-user', args=[other.id])).status_code, 200)
+        self.assertIsNone(self.stored())
+        self.assertEqual(home_timeline.page(self.reader.id)[0], [])
+
+
+class PostSerializerContractTests(TransactionTestCase):
+    """帖子接口保留前端使用的 is_anonymous、content_preview 和 comment_count 字段"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        TiebaMember.objects.create(tieba=self.tieba, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        flush_all()
+
+    def test_create_and_update_accept_is_anonymous(self):
+        response = self.client.post(
+            reverse('post-create'), {'title': '标题', 'content': '内容', 'tieba': self.tieba.id, 'is_anonymous': True}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data['post']['is_anonymous'])
+        post = Post.objects.get(pk=response.data['post']['id'])
+        self.assertTrue(post.is_anonymous)
+
+        response = self.client.put(reverse('post-update', args=[post.id]), {'is_anonymous': False}, format='json')
+        self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertFalse(post.is_anonymous)
+
+    def test_list_fields(self):
+        post = Post.objects.create(
+            title='标题', content='长' * (CONTENT_PREVIEW_LENGTH + 20), author=self.user, tieba=self.tieba,
+            status=1, reply_count=3,
+        )
+        data = PostListSerializer(post, context={}).data
+        self.assertEqual(data['content_preview'], '长' * CONTENT_PREVIEW_LENGTH)
+        self.assertEqual(data['comment_count'], 3)
+        self.assertFalse(data['is_anonymous'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ViewerStateTests(TransactionTestCase):
+    """列表页的 is_liked / is_collected 按整页批量解析"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author', password='password', email='author@example.com')
+        self.reader = User.objects.create_user(username='reader', password='password', email='reader@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.author, category=category, status=1)
+        self.posts = [
+            Post.objects.create(title=f'标题{i}', content='内容', author=self.author, tieba=self.tieba, status=1)
+            for i in range(5)
+        ]
+        like_engine.toggle(PostLike, self.posts[0].id, self.reader.id)
+        like_engine.toggle(PostLike, self.posts[2].id, self.reader.id)
+        like_engine.toggle(PostCollect, self.posts[2].id, self.reader.id)
+        like_engine.flush()
+
+    def tearDown(self):
+        flush_all()
+
+    def serialize(self, user):
+        context = {'request': mock.Mock(user=user)}
+        return PostListSerializer(self.posts, many=True, context=context).data
+
+    def test_page_is_resolved_with_one_lookup_per_relation(self):
+        with mock.patch.object(like_engine, 'active_ids', wraps=like_engine.active_ids) as active_ids:
+            data = self.serialize(self.reader)
+        self.assertEqual(active_ids.call_count, 2)
+        self.assertEqual([item['is_liked'] for item in data], [True, False, True, False, False])
+        self.assertEqual([item['is_collected'] for item in data], [False, False, True, False, False])
+
+    def test_anonymous_viewer_skips_lookups(self):
+        with mock.patch.object(like_engine, 'active_ids') as active_ids:
+            data = self.serialize(AnonymousUser())
+        active_ids.assert_not_called()
+        self.assertFalse(any(item['is_liked'] or item['is_collected'] for item in data))
+
+    def test_single_object_lookup_is_cached(self):
+        state = ViewerState(self.reader)
+        with mock.patch.object(like_engine, 'active_ids', wraps=like_engine.active_ids) as active_ids:
+            self.assertTrue(state.has(PostLike, 'post', self.posts[0].id))
+            self.assertTrue(state.has(PostLike, 'post', self.posts[0].id))
+            self.assertFalse(state.has(PostLike, 'post', self.posts[1].id))
+        self.assertEqual(active_ids.call_count, 2)
+
+    def test_history_page_reports_viewer_state(self):
+        for post in self.posts[:3]:
+            PostViewHistory.objects.create(user=self.reader, post=post)
+        client = APIClient()
+        client.force_login(self.reader)
+        response = client.get(reverse('user-post-history'))
+        self.assertEqual(response.status_code, 200)
+        items = {item['post']['id']: item['post'] for item in response.json()['results']}
+        self.assertTrue(items[self.posts[0].id]['is_liked'])
+        self.assertTrue(items[self.posts[2].id]['is_collected'])
+        self.assertFalse(items[self.posts[1].id]['is_liked'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class HotScoreTests(TransactionTestCase):
+    """热度分随发布时间衰减，计数变化后重算并刷新热榜"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        self.other_tieba = Tieba.objects.create(name='other', owner=self.user, category=category, status=1)
+
+    def tearDown(self):
+        flush_all()
+
+    def create_post(self, tieba=None, days_ago=0, **counts):
+        return Post.objects.create(
+            title='标题', content='内容', author=self.user, tieba=tieba or self.tieba, status=1,
+            created_at=timezone.now() - timedelta(days=days_ago), **counts,
+        )
+
+    def hot_ids(self, **params):
+        response = self.client.get(reverse('hot-posts'), params)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['hot_posts']]
+
+    def test_ten_times_the_points_offsets_one_decay_period(self):
+        now = timezone.now()
+        counts = dict.fromkeys(['view_count', 'reply_count', 'collect_count'], 0)
+        older = hot_score({**counts, 'like_count': 100}, now - timedelta(seconds=hot_scores.decay), hot_scores.decay)
+        newer = hot_score({**counts, 'like_count': 10}, now, hot_scores.decay)
+        self.assertAlmostEqual(older, newer)
+
+    def test_new_posts_outrank_old_popular_posts(self):
+        old = self.create_post(days_ago=30, like_count=500, view_count=10000)
+        new = self.create_post(like_count=1)
+        hot_scores.refresh_lists({self.tieba.id})
+        self.assertEqual(self.hot_ids(), [new.id, old.id])
+        response = self.client.get(reverse('post-list'), {'sort': 'hot'})
+        self.assertEqual([item['id'] for item in response.json()['results']], [new.id, old.id])
+
+    def test_touch_recomputes_score_and_lists(self):
+        first = self.create_post(like_count=5)
+        second = self.create_post()
+        with mock.patch.object(hot_scores, 'list_size', 1):
+            hot_scores.refresh_lists({self.tieba.id})
+            self.assertEqual(self.hot_ids(), [first.id])
+
+            Post.objects.filter(pk=second.pk).update(like_count=50)
+            hot_scores.touch(second.id)
+            flush_all()
+            self.assertEqual(self.hot_ids(), [second.id])
+        self.assertEqual(
+            dict(Post.objects.values_list('id', 'is_hot')), {first.id: False, second.id: True}
+        )
+
+    def test_tieba_list_only_contains_its_posts(self):
+        own = self.create_post(like_count=1)
+        other = self.create_post(tieba=self.other_tieba, like_count=100)
+        hot_scores.refresh_lists({self.tieba.id, self.other_tieba.id})
+        self.assertEqual(self.hot_ids(tieba=self.tieba.id), [own.id])
+        self.assertEqual(self.hot_ids(), [other.id, own.id])
+
+    def test_refresh_command_recomputes_scores(self):
+        post = self.create_post(days_ago=1, like_count=7, reply_count=2)
+        expected = Post.objects.values_list('hot_score', flat=True).get(pk=post.pk)
+        Post.objects.filter(pk=post.pk).update(hot_score=0)
+        call_command('refresh_hot_scores', stdout=mock.Mock())
+        self.assertAlmostEqual(Post.objects.values_list('hot_score', flat=True).get(pk=post.pk), expected)
+        self.assertEqual(self.hot_ids(), [post.id])
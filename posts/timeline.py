@@ -0,0 +1,316 @@
+"""
+关注动态（首页时间线）
+
+每个用户的时间线是一份有上限的帖子ID列表（只存ID，从新到旧读取），混合两种分发方式：
+    写扩散：粉丝数低于 TIMELINE_FANOUT_THRESHOLD 的作者的帖子变为可见后，帖子ID排队，
+            由后台线程按批读取粉丝，推入其中已加载的时间线，超出 TIMELINE_SIZE 时丢弃最旧的ID。
+    读扩散：粉丝数达到阈值的作者发帖不推送，读取时按 (作者, ID) 查询这些作者的新帖，与时间线合并。
+时间线未加载（首次访问、被淘汰或过期、关注关系变化后失效）时，从数据库取关注的普通作者
+最近的 TIMELINE_SIZE 个帖子重建。时间线达到上限后，比其中最旧ID更早的动态改为直接查询数据库。
+
+帖子可见状态的变化由 Post.update_counters 在事务提交后通知：变为可见时 publish 推送，
+不再可见（删除、审核、封禁）时 retract 从粉丝已加载的时间线中移除；读取时仍按 status=1 过滤兜底。
+作者粉丝数跨过阈值后，合并时按ID去重；从读扩散回落为写扩散的作者，
+其此前的帖子在时间线重建后出现，rebuild_timelines 命令可主动重建。
+
+存储后端由 settings.TIMELINE_BACKEND 选择：
+    memory  进程内升序ID数组，按 LRU 淘汰用户，适合单进程部署和开发环境
+    redis   Redis 有序集合（成员与分数均为帖子ID），多进程共享，按 TIMELINE_CACHE_SECONDS 过期
+"""
+
+import bisect
+import heapq
+import threading
+from array import array
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from tieba_project.background import BackgroundBatcher
+from tieba_project.cache_fill import get_or_fill
+
+PULL_AUTHORS_KEY = 'timeline:pull_authors:{user_id}'
+PULL_AUTHORS_TIMEOUT = 60 * 5
+
+
+class MemoryTimelineStore:
+    """进程内时间线，每个用户一个升序的帖子ID数组"""
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._timelines = OrderedDict()
+
+    def load(self, user_id, post_ids, size):
+        timeline = array('q', sorted(post_ids)[-size:])
+        with self._lock:
+            self._timelines[user_id] = timeline
+            self._timelines.move_to_end(user_id)
+            while len(self._timelines) > self.max_users:
+                self._timelines.popitem(last=False)
+
+    def push(self, user_ids, post_id, size):
+        """把帖子ID加入已加载的时间线，未加载的用户跳过"""
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                index = bisect.bisect_left(timeline, post_id)
+                if index < len(timeline) and timeline[index] == post_id:
+                    continue
+                timeline.insert(index, post_id)
+                if len(timeline) > size:
+                    del timeline[:len(timeline) - size]
+
+    def discard(self, user_ids, post_id):
+        """从已加载的时间线中移除帖子ID"""
+        with self._lock:
+            for user_id in user_ids:
+                timeline = self._timelines.get(user_id)
+                if timeline is None:
+                    continue
+                index = bisect.bisect_left(timeline, post_id)
+                if index < len(timeline) and timeline[index] == post_id:
+                    del timeline[index]
+
+    def read(self, user_id, before, limit, size):
+        """返回 (早于 before 的最多 limit 个ID（从新到旧）, 完整区间下界)，未加载时返回 None
+
+        时间线未满时下界为 0；已满时为最旧的ID，更早的帖子可能已被丢弃。
+        """
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return None
+            self._timelines.move_to_end(user_id)
+            end = bisect.bisect_left(timeline, before) if before is not None else len(timeline)
+            post_ids = timeline[max(0, end - limit):end].tolist()
+            floor = timeline[0] if len(timeline) >= size else 0
+        post_ids.reverse()
+        return post_ids, floor
+
+    def remove(self, user_id):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+
+
+class RedisTimelineStore:
+    """基于 Redis 有序集合的时间线
+
+    集合中固定保留成员 0，用于区分"时间线为空"和"未加载"，读取时排除。
+    """
+
+    KEY = 'timeline:{user_id}'
+
+    # KEYS: 各用户的时间线；ARGV: 帖子ID, 上限
+    PUSH_SCRIPT = """
+    for i = 1, #KEYS do
+        if redis.call('EXISTS', KEYS[i]) == 1 then
+            redis.call('ZADD', KEYS[i], ARGV[1], ARGV[1])
+            redis.call('ZREMRANGEBYRANK', KEYS[i], 1, -(tonumber(ARGV[2]) + 1))
+        end
+    end
+    return 0
+    """
+
+    def __init__(self, url, ttl):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._push = self._client.register_script(self.PUSH_SCRIPT)
+        self.ttl = ttl
+
+    def load(self, user_id, post_ids, size):
+        key = self.KEY.format(user_id=user_id)
+        members = {0: 0}
+        members.update((post_id, post_id) for post_id in sorted(post_ids)[-size:])
+        pipe = self._client.pipeline()
+        pipe.delete(key)
+        pipe.zadd(key, members)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def push(self, user_ids, post_id, size):
+        keys = [self.KEY.format(user_id=user_id) for user_id in user_ids]
+        if keys:
+            self._push(keys=keys, args=[post_id, size])
+
+    def discard(self, user_ids, post_id):
+        pipe = self._client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zrem(self.KEY.format(user_id=user_id), post_id)
+        pipe.execute()
+
+    def read(self, user_id, before, limit, size):
+        key = self.KEY.format(user_id=user_id)
+        pipe = self._client.pipeline(transaction=False)
+        pipe.zrevrangebyscore(key, f'({before}' if before is not None else '+inf', '(0', start=0, num=limit)
+        pipe.zcard(key)
+        pipe.zrange(key, 1, 1)
+        pipe.expire(key, self.ttl)
+        post_ids, total, oldest, _ = pipe.execute()
+        if not total:
+            return None
+        floor = int(oldest[0]) if total - 1 >= size and oldest else 0
+        return [int(post_id) for post_id in post_ids], floor
+
+    def remove(self, user_id):
+        self._client.delete(self.KEY.format(user_id=user_id))
+
+
+class HomeTimeline:
+    """关注动态的写扩散、读扩散与分页读取"""
+
+    def __init__(self, store, size, fanout_threshold, batch_size, flush_interval):
+        self.store = store
+        self.size = size
+        self.fanout_threshold = fanout_threshold
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batcher = BackgroundBatcher(
+            'home-timeline', self.flush, flush_interval, '关注动态推送失败，帖子已放回队列'
+        )
+
+    def publish(self, post_id, author_id):
+        """帖子变为可见后调用：排队推送给粉丝，粉丝数达到阈值的作者在推送时跳过，留待读取时合并"""
+        self._enqueue(post_id, author_id, True)
+
+    def retract(self, post_id, author_id):
+        """帖子不再可见后调用：排队从粉丝的时间线中移除"""
+        self._enqueue(post_id, author_id, False)
+
+    def _enqueue(self, post_id, author_id, visible):
+        with self._lock:
+            self._pending.append((post_id, author_id, visible))
+        self._batcher.start()
+
+    def flush(self):
+        """推送或移除全部排队的帖子，返回处理的帖子数"""
+        with self._lock:
+            items, self._pending = self._pending, []
+        if not items:
+            return 0
+        with self._flush_lock:
+            for index, (post_id, author_id, visible) in enumerate(items):
+                try:
+                    self.fan_out(post_id, author_id, visible)
+                except Exception:
+                    # 未处理的帖子放回队列，下次继续；重复推送同一ID不会产生重复项
+                    with self._lock:
+                        self._pending[:0] = items[index:]
+                    raise
+        return len(items)
+
+    def fan_out(self, post_id, author_id, visible=True):
+        """把帖子ID推入（visible 为 False 时移出）普通作者的粉丝的时间线"""
+        from users.models import User
+
+        if not User.objects.filter(pk=author_id, follower_count__lt=self.fanout_threshold).exists():
+            return
+        for batch in self._follower_batches(author_id):
+            if visible:
+                self.store.push(batch, post_id, self.size)
+            else:
+                self.store.discard(batch, post_id)
+
+    def _follower_batches(self, author_id):
+        """按批读取作者的粉丝ID"""
+        from users.models import FollowRelation
+
+        follower_ids = (
+            FollowRelation.objects.filter(following_id=author_id)
+            .values_list('follower_id', flat=True)
+            .iterator(chunk_size=self.batch_size)
+        )
+        batch = []
+        for follower_id in follower_ids:
+            batch.append(follower_id)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def following_changed(self, user_id):
+        """关注或取消关注后调用，时间线在下次读取时重建"""
+        self.store.remove(user_id)
+        cache.delete(PULL_AUTHORS_KEY.format(user_id=user_id))
+
+    def rebuild(self, user_id):
+        """从数据库重建时间线：关注的普通作者最近的帖子，返回从新到旧的ID"""
+        from .models import Post
+
+        post_ids = list(
+            Post.objects.filter(
+                author__follower_relations__follower_id=user_id,
+                author__follower_count__lt=self.fanout_threshold,
+                status=1,
+            ).order_by('-id').values_list('id', flat=True)[:self.size]
+        )
+        self.store.load(user_id, post_ids, self.size)
+        return post_ids
+
+    def pull_authors(self, user_id):
+        """用户关注的、粉丝数达到阈值的作者ID，短时间缓存"""
+        from users.models import FollowRelation
+
+        return get_or_fill(
+            PULL_AUTHORS_KEY.format(user_id=user_id),
+            lambda: list(
+                FollowRelation.objects.filter(
+                    follower_id=user_id, following__follower_count__gte=self.fanout_threshold
+                ).values_list('following_id', flat=True)
+            ),
+            PULL_AUTHORS_TIMEOUT,
+        )
+
+    def page(self, user_id, before=None, limit=20):
+        """返回 (早于 before 的帖子ID（从新到旧）, 下一页的 before)，没有下一页时为 None"""
+        from .models import Post
+
+        result = self.store.read(user_id, before, limit, self.size)
+        if result is None:
+            timeline = self.rebuild(user_id)
+            floor = timeline[-1] if len(timeline) >= self.size else 0
+            post_ids = [post_id for post_id in timeline if before is None or post_id < before][:limit]
+        else:
+            post_ids, floor = result
+
+        # 读扩散：合并粉丝数达到阈值的作者在时间线完整区间内的新帖
+        authors = self.pull_authors(user_id)
+        if authors:
+            pulled = Post.objects.filter(author_id__in=authors, status=1, id__gte=floor)
+            if before is not None:
+                pulled = pulled.filter(id__lt=before)
+            pulled_ids = pulled.order_by('-id').values_list('id', flat=True)[:limit]
+            post_ids = heapq.nlargest(limit, set(post_ids).union(pulled_ids))
+
+        # 时间线已满且已读到最旧的ID，更早的动态直接查询数据库
+        if len(post_ids) < limit and floor:
+            upper = floor if before is None else min(before, floor)
+            post_ids += Post.objects.filter(
+                author__follower_relations__follower_id=user_id, status=1, id__lt=upper
+            ).order_by('-id').values_list('id', flat=True)[:limit - len(post_ids)]
+
+        return post_ids, (post_ids[-1] if len(post_ids) >= limit else None)
+
+
+def _build_timeline():
+    if getattr(settings, 'TIMELINE_BACKEND', 'memory') == 'redis':
+        store = RedisTimelineStore(settings.REDIS_URL, ttl=getattr(settings, 'TIMELINE_CACHE_SECONDS', 3 * 24 * 3600))
+    else:
+        store = MemoryTimelineStore(max_users=getattr(settings, 'TIMELINE_MAX_USERS', 10000))
+    return HomeTimeline(
+        store,
+        size=getattr(settings, 'TIMELINE_SIZE', 800),
+        fanout_threshold=getattr(settings, 'TIMELINE_FANOUT_THRESHOLD', 10000),
+        batch_size=getattr(settings, 'TIMELINE_BATCH_SIZE', 1000),
+        flush_interval=getattr(settings, 'TIMELINE_FLUSH_INTERVAL', 1),
+    )
+
+
+home_timeline = _build_timeline()
@@ -18,6 +18,7 @@ urlpatterns = [
     
     # 用户相关
     path('user/history/', views.UserPostHistoryView.as_view(), name='user-post-history'),
+    path('feed/', views.FeedView.as_view(), name='post-feed'),
     
     # 推荐和热门
     path('hot/', views.hot_posts, name='hot-posts'),
@@ -0,0 +1,187 @@
+"""
+帖子浏览量写回缓冲
+
+PostDetailView 每次访问只在缓冲区中累加计数，由后台线程按配置的时间间隔批量写回数据库，
+请求线程不执行写回：帖子使用 F() 原子更新 view_count，同时汇总到 Tieba.total_view_count。
+更新通过 QuerySet.update 完成，不会改写整行，也不会刷新 updated_at。
+写回提交后才从缓冲中删除取出的计数，写回失败时放回缓冲。
+
+缓冲后端由 settings.VIEW_COUNTER_BACKEND 选择：
+    memory  进程内字典，适合单进程部署；进程正常退出时由 BackgroundBatcher 的 atexit 钩子写回，
+            被强制杀死（SIGKILL、OOM）时未写回的计数会丢失；flush_view_counts 命令不适用
+    redis   Redis 哈希，多进程共享，可用 flush_view_counts 命令统一写回
+"""
+
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from tieba_project.background import BackgroundBatcher
+
+FLUSH_LOCK_KEY = 'view_counter:flush_lock'
+
+
+class MemoryViewBuffer:
+    """进程内浏览量缓冲"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._posts = defaultdict(int)
+        self._tiebas = defaultdict(int)
+
+    def incr(self, post_id, tieba_id, amount=1):
+        """累加计数，返回帖子尚未写回的浏览量"""
+        with self._lock:
+            self._posts[post_id] += amount
+            self._tiebas[tieba_id] += amount
+            return self._posts[post_id]
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._posts.get(post_id, 0)
+
+    def drain(self):
+        """取出并清空当前缓冲，返回 (帖子增量, 贴吧增量)"""
+        with self._lock:
+            posts, tiebas = self._posts, self._tiebas
+            self._posts, self._tiebas = defaultdict(int), defaultdict(int)
+        return dict(posts), dict(tiebas)
+
+    def done(self):
+        """写回提交后调用，取出的计数已不在缓冲中"""
+
+    def restore(self, posts, tiebas):
+        """写回失败时把增量放回缓冲"""
+        with self._lock:
+            for post_id, amount in posts.items():
+                self._posts[post_id] += amount
+            for tieba_id, amount in tiebas.items():
+                self._tiebas[tieba_id] += amount
+
+
+class RedisViewBuffer:
+    """基于 Redis 哈希的浏览量缓冲"""
+
+    POST_KEY = 'view_counter:post'
+    TIEBA_KEY = 'view_counter:tieba'
+    FLUSHING_SUFFIX = ':flushing'
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._response_error = redis.exceptions.ResponseError
+
+    def incr(self, post_id, tieba_id, amount=1):
+        pipe = self._client.pipeline(transaction=False)
+        pipe.hincrby(self.POST_KEY, post_id, amount)
+        pipe.hincrby(self.TIEBA_KEY, tieba_id, amount)
+        pending, _ = pipe.execute()
+        return pending
+
+    def pending(self, post_id):
+        value = self._client.hget(self.POST_KEY, post_id)
+        return int(value) if value else 0
+
+    def drain(self):
+        """通过 RENAME 原子地取走当前哈希，期间的新增计数写入新的哈希
+
+        取走的哈希保留到 done() 才删除，写回中途进程退出时下次优先写回遗留的哈希。
+        """
+        result = []
+        for key in (self.POST_KEY, self.TIEBA_KEY):
+            flushing_key = key + self.FLUSHING_SUFFIX
+            if not self._client.exists(flushing_key):
+                try:
+                    self._client.rename(key, flushing_key)
+                except self._response_error:
+                    # 键不存在说明没有待写回的计数
+                    result.append({})
+                    continue
+            raw = self._client.hgetall(flushing_key)
+            result.append({int(k): int(v) for k, v in raw.items()})
+        return result[0], result[1]
+
+    def done(self):
+        self._client.delete(self.POST_KEY + self.FLUSHING_SUFFIX, self.TIEBA_KEY + self.FLUSHING_SUFFIX)
+
+    def restore(self, posts, tiebas):
+        pipe = self._client.pipeline()
+        for post_id, amount in posts.items():
+            pipe.hincrby(self.POST_KEY, post_id, amount)
+        for tieba_id, amount in tiebas.items():
+            pipe.hincrby(self.TIEBA_KEY, tieba_id, amount)
+        pipe.delete(self.POST_KEY + self.FLUSHING_SUFFIX, self.TIEBA_KEY + self.FLUSHING_SUFFIX)
+        pipe.execute()
+
+
+def _apply_increments(model, field, increments):
+    """按增量值分组，用尽量少的 UPDATE 语句原子累加"""
+    groups = defaultdict(list)
+    for pk, amount in increments.items():
+        if amount:
+            groups[amount].append(pk)
+    for amount, pks in groups.items():
+        model.objects.filter(pk__in=pks).update(**{field: F(field) + amount})
+
+
+class ViewCounter:
+    """浏览量计数器"""
+
+    def __init__(self, buffer, flush_interval):
+        self.buffer = buffer
+        self.flush_interval = flush_interval
+        self._batcher = BackgroundBatcher('view-counter', self.flush, flush_interval, '浏览量写回失败，计数已放回缓冲')
+
+    def record_view(self, post_id, tieba_id):
+        """记录一次浏览，返回帖子尚未写回数据库的浏览量（含本次）"""
+        pending = self.buffer.incr(post_id, tieba_id)
+        self._batcher.start()
+        return pending
+
+    def get_pending(self, post_id):
+        """获取尚未写回数据库的浏览量"""
+        return self.buffer.pending(post_id)
+
+    def flush(self):
+        """把缓冲中的浏览量批量写回数据库，返回写回的帖子数；其他进程正在写回时返回 0"""
+        if not cache.add(FLUSH_LOCK_KEY, 1, 60):
+            return 0
+        try:
+            posts, tiebas = self.buffer.drain()
+            if posts or tiebas:
+                from django.db import transaction
+                from .models import Post
+                from tieba.models import Tieba
+
+                try:
+                    with transaction.atomic():
+                        _apply_increments(Post, 'view_count', posts)
+                        _apply_increments(Tieba, 'total_view_count', tiebas)
+                except Exception:
+                    self.buffer.restore(posts, tiebas)
+                    raise
+            self.buffer.done()
+        finally:
+            cache.delete(FLUSH_LOCK_KEY)
+
+        from .hot_score import hot_scores
+        for post_id in posts:
+            hot_scores.touch(post_id)
+        return len(posts)
+
+
+def _build_counter():
+    backend = getattr(settings, 'VIEW_COUNTER_BACKEND', 'memory')
+    interval = getattr(settings, 'VIEW_COUNTER_FLUSH_INTERVAL', 10)
+    if backend == 'redis':
+        buffer = RedisViewBuffer(settings.REDIS_URL)
+    else:
+        buffer = MemoryViewBuffer()
+    return ViewCounter(buffer, interval)
+
+
+view_counter = _build_counter()
+
@@ -0,0 +1,108 @@
+"""
+帖子浏览历史异步记录
+
+PostDetailView 只把 (用户, 帖子, IP, UA, 时间) 放入队列，由后台线程按批次
+bulk_create(update_conflicts=True) 写入 PostViewHistory：同一用户重复浏览同一帖子
+只保留一条记录并刷新 viewed_at。每批写入后用一条 DELETE（按用户分区的 ROW_NUMBER 窗口）
+把相关用户的历史截断到 VIEW_HISTORY_MAX_PER_USER 条，过期记录由 prune_view_history 命令
+按 VIEW_HISTORY_TTL_DAYS 清理。
+"""
+
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from tieba_project.background import BackgroundBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class ViewHistoryRecorder:
+    """浏览历史批量记录器"""
+
+    def __init__(self, batch_size, flush_interval, max_per_user, max_queue_size=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_per_user = max_per_user
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._write_lock = threading.Lock()
+        self._batcher = BackgroundBatcher(
+            'view-history-recorder', self.flush, flush_interval, '浏览历史批量写入失败，丢弃该批记录'
+        )
+
+    def record(self, user_id, post_id, ip_address=None, user_agent=None):
+        """记录一次浏览，不阻塞请求"""
+        entry = (user_id, post_id, ip_address, user_agent, timezone.now())
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            # 队列积压时丢弃，浏览历史允许少量缺失
+            logger.warning('浏览历史队列已满，丢弃记录 user=%s post=%s', user_id, post_id)
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._batcher.wake()
+        else:
+            self._batcher.start()
+
+    def flush(self):
+        """按批次同步写入队列中的全部记录，返回写入条数；写入失败的批次丢弃"""
+        total = 0
+        while True:
+            entries = []
+            while len(entries) < self.batch_size:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not entries:
+                return total
+            self._write(entries)
+            total += len(entries)
+
+    def _write(self, entries):
+        from .models import PostViewHistory
+
+        # 同一批次内同一用户同一帖子只保留最后一次浏览
+        latest = {}
+        for user_id, post_id, ip_address, user_agent, viewed_at in entries:
+            latest[(user_id, post_id)] = PostViewHistory(
+                user_id=user_id,
+                post_id=post_id,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                viewed_at=viewed_at,
+            )
+
+        with self._write_lock:
+            PostViewHistory.objects.bulk_create(
+                list(latest.values()),
+                update_conflicts=True,
+                unique_fields=['user', 'post'],
+                update_fields=['ip_address', 'user_agent', 'viewed_at'],
+            )
+            if self.max_per_user:
+                trim_history({user_id for user_id, _ in latest}, self.max_per_user)
+
+
+def trim_history(user_ids, max_per_user):
+    """用一条语句只保留各用户最近的 max_per_user 条浏览历史，返回删除条数"""
+    from .models import PostViewHistory
+
+    stale = PostViewHistory.objects.filter(user_id__in=user_ids).annotate(
+        rank=Window(RowNumber(), partition_by=F('user_id'), order_by=[F('viewed_at').desc(), F('id').desc()])
+    ).filter(rank__gt=max_per_user)
+    deleted, _ = PostViewHistory.objects.filter(id__in=stale.values('id')).delete()
+    return deleted
+
+
+view_history_recorder = ViewHistoryRecorder(
+    batch_size=getattr(settings, 'VIEW_HISTORY_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'VIEW_HISTORY_FLUSH_INTERVAL', 5),
+    max_per_user=getattr(settings, 'VIEW_HISTORY_MAX_PER_USER', 500),
+)
+
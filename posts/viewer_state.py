@@ -0,0 +1,71 @@
+"""
+当前用户的点赞 / 收藏状态批量解析
+
+列表序列化器在渲染整页数据之前，通过 ViewerState.prefetch 向 like_engine 批量查询
+当前用户对这一页对象的点赞、收藏关系（含尚未写入数据库的切换）；
+之后 is_liked / is_collected 只做集合查找。
+ViewerState 存放在序列化器 context 中，同一请求内嵌套的序列化器共享同一份结果。
+"""
+
+from django.db import models
+from rest_framework import serializers
+
+from tieba_project.likes import like_engine
+
+
+class ViewerState:
+    """当前用户与一批对象之间的关系状态"""
+
+    def __init__(self, user):
+        self.user = user
+        # (关系模型, 目标字段) -> (已加载的对象ID, 存在关系的对象ID)
+        self._relations = {}
+
+    def _relation(self, relation_model, target_field):
+        key = (relation_model, target_field)
+        if key not in self._relations:
+            self._relations[key] = (set(), set())
+        return self._relations[key]
+
+    def prefetch(self, relation_model, target_field, object_ids):
+        """批量加载当前用户对 object_ids 的关系，已加载的ID不会重复查询"""
+        loaded, hits = self._relation(relation_model, target_field)
+        missing = {pk for pk in object_ids if pk is not None} - loaded
+        if not missing:
+            return
+        hits.update(like_engine.active_ids(relation_model, self.user.pk, missing))
+        loaded.update(missing)
+
+    def has(self, relation_model, target_field, object_id):
+        """当前用户与对象之间是否存在关系，未预加载时按单个对象补查"""
+        loaded, hits = self._relation(relation_model, target_field)
+        if object_id not in loaded:
+            self.prefetch(relation_model, target_field, [object_id])
+        return object_id in hits
+
+
+def get_viewer_state(context):
+    """从序列化器 context 中获取（或创建）当前请求的 ViewerState，匿名用户返回 None"""
+    if 'viewer_state' in context:
+        return context['viewer_state']
+    request = context.get('request')
+    state = None
+    if request and request.user.is_authenticated:
+        state = ViewerState(request.user)
+    context['viewer_state'] = state
+    return state
+
+
+class ViewerStateListSerializer(serializers.ListSerializer):
+    """渲染前为整页数据批量加载当前用户状态的列表序列化器
+
+    子序列化器需要实现 preload_viewer_state(state, items)。
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        items = list(iterable)
+        state = get_viewer_state(self.context)
+        if state is not None and items:
+            self.child.preload_viewer_state(state, items)
+        return super().to_representation(items)
@@ -2,10 +2,12 @@ from rest_framework import status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.exceptions import NotFound
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.db.models import Q
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.db import transaction
 
 from .models import Post, PostImage, PostAttachment, PostLike, PostCollect, PostReport, PostViewHistory
 from .serializers import (
@@ -14,7 +16,34 @@ from .serializers import (
     PostReportSerializer, PostReportCreateSerializer, PostViewHistorySerializer
 )
 from tieba.models import Tieba, TiebaMember
-from users.models import UserActivity
+from users.activity_log import activity_logger
+from .view_counter import view_counter
+from .view_history import view_history_recorder
+from .hot_score import hot_scores
+from .timeline import home_timeline
+from search.backends import DOC_POST
+from search.indexer import load_in_order, search_ids
+from tieba_project.conditional import conditional
+from tieba_project.likes import like_engine
+from tieba_project.pagination import KeysetPagination, cached_count
+from tieba_project.response_cache import cache_anonymous_response
+
+
+def tieba_param(request):
+    """查询参数中的贴吧 ID，缺失或不是整数时返回 None（不按贴吧过滤）"""
+    try:
+        return int(request.GET['tieba'])
+    except (KeyError, ValueError):
+        return None
+
+
+def post_list_scopes(request):
+    """帖子列表缓存依赖的范围：按贴吧过滤时只依赖该贴吧"""
+    tieba_id = tieba_param(request)
+    scopes = [f'post:tieba:{tieba_id}', f'tieba:{tieba_id}'] if tieba_id is not None else ['post', 'tieba']
+    if request.GET.get('sort') == 'hot':
+        scopes.append('hot_posts')
+    return scopes
 
 
 class PostListView(APIView):
@@ -22,48 +51,57 @@ class PostListView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    # 各排序方式的游标排序键，末尾的 id 保证全序
+    ORDERINGS = {
+        'latest': ('-is_top', '-created_at', '-id'),
+        'hot': ('-hot_score', '-id'),
+        'essence': ('-created_at', '-id'),
+    }
+    
+    # 只缓存首页，翻页请求带游标
+    @method_decorator(cache_anonymous_response(
+        post_list_scopes, when=lambda request: KeysetPagination.cursor_query_param not in request.GET
+    ))
     def get(self, request):
         """获取帖子列表"""
         posts = Post.objects.filter(status=1).select_related('author', 'tieba').prefetch_related('images')
         
         # 支持多种过滤条件
-        tieba_id = request.GET.get('tieba')
+        tieba_id = tieba_param(request)
         author_id = request.GET.get('author')
         search_query = request.GET.get('q', '')
         sort_by = request.GET.get('sort', 'latest')  # latest, hot, essence
         
-        if tieba_id:
+        if tieba_id is not None:
             posts = posts.filter(tieba_id=tieba_id)
         
         if author_id:
             posts = posts.filter(author_id=author_id)
         
+        count = None
         if search_query:
-            posts = posts.filter(Q(title__icontains=search_query) | Q(content__icontains=search_query))
+            count, ids = search_ids(DOC_POST, search_query, filters={
+                'tieba_id': tieba_id, 'author_id': author_id
+            }, limit=settings.SEARCH_MAX_RESULTS)
+            posts = posts.filter(id__in=ids)
         
-        # 排序
-        if sort_by == 'hot':
-            posts = posts.order_by('-view_count', '-like_count', '-created_at')
-        elif sort_by == 'essence':
-            posts = posts.filter(is_essence=True).order_by('-created_at')
-        else:  # latest
-            posts = posts.order_by('-created_at')
+        if sort_by == 'essence':
+            posts = posts.filter(is_essence=True)
+        elif sort_by not in self.ORDERINGS:
+            sort_by = 'latest'
         
-        # 分页
-        page = self.paginate_queryset(posts, request)
-        if page is not None:
-            serializer = PostListSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        # 近似总数：吧内最新帖取贴吧帖子数，其余取缓存的计数
+        if count is None:
+            if tieba_id is not None and not author_id and sort_by != 'essence':
+                count = Tieba.objects.filter(id=tieba_id).values_list('post_count', flat=True).first()
+            else:
+                count = cached_count(posts, f'post_list_count:{tieba_id}:{author_id}:{sort_by}')
         
-        serializer = PostListSerializer(posts[:20], many=True, context={'request': request})
-        return Response(serializer.data)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
+        # 分页
+        paginator = KeysetPagination(self.ORDERINGS[sort_by])
+        page = paginator.paginate_queryset(posts, request)
+        serializer = PostListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data, count=count)
 
 
 class PostCreateView(APIView):
@@ -82,16 +120,11 @@ class PostCreateView(APIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
             
+            # 发帖统计、贴吧活跃度和关注动态在帖子变为可见时由 Post.save 同步
             post = serializer.save(author=request.user)
             
-            # 更新贴吧统计
-            tieba = post.tieba
-            tieba.post_count += 1
-            tieba.today_post_count += 1
-            tieba.save()
-            
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='post_create',
                 target_type='post',
@@ -106,33 +139,62 @@ class PostCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def post_stamp(request, post_id):
+    """帖子详情的版本戳：更新时间、最后回复时间、计数和当前用户的点赞/收藏状态
+
+    不含浏览数，304 的重复请求不计入浏览。
+    """
+    row = Post.objects.filter(id=post_id, status=1).values_list(
+        'updated_at', 'last_reply_at', 'reply_count', 'like_count', 'collect_count'
+    ).first()
+    if row is None:
+        return None
+    updated_at, last_reply_at = row[0], row[1]
+    parts = list(row)
+    if request.user.is_authenticated:
+        parts += [
+            post_id in like_engine.active_ids(PostLike, request.user.id, [post_id]),
+            post_id in like_engine.active_ids(PostCollect, request.user.id, [post_id]),
+        ]
+    return parts, max(updated_at, last_reply_at) if last_reply_at else updated_at
+
+
 class PostDetailView(APIView):
     """帖子详情视图"""
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(conditional(post_stamp))
     def get(self, request, post_id):
         """获取帖子详情"""
         try:
             post = Post.objects.get(id=post_id, status=1)
             
-            # 记录浏览历史（仅登录用户）
+            # 记录浏览历史（仅登录用户，异步批量写入）
             if request.user.is_authenticated:
-                PostViewHistory.objects.get_or_create(
-                    user=request.user,
-                    post=post,
-                    defaults={'viewed_at': post.created_at}
+                view_history_recorder.record(
+                    request.user.id,
+                    post.id,
+                    ip_address=self.get_client_ip(request),
+                    user_agent=request.META.get('HTTP_USER_AGENT', '')
                 )
             
-            # 更新浏览计数
-            post.view_count += 1
-            post.save()
+            # 更新浏览计数（写入缓冲，由后台线程批量写回），返回值含本次浏览
+            post.view_count += view_counter.record_view(post.id, post.tieba_id)
             
             serializer = PostDetailSerializer(post, context={'request': request})
             return Response(serializer.data)
             
         except Post.DoesNotExist:
             return Response({'error': '帖子不存在'}, status=status.HTTP_404_NOT_FOUND)
+    
+    def get_client_ip(self, request):
+        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for:
+            ip = x_forwarded_for.split(',')[0]
+        else:
+            ip = request.META.get('REMOTE_ADDR')
+        return ip
 
 
 class PostUpdateView(APIView):
@@ -149,7 +211,7 @@ class PostUpdateView(APIView):
                 serializer.save()
                 
                 # 记录活动
-                UserActivity.objects.create(
+                activity_logger.log(
                     user=request.user,
                     action='post_update',
                     target_type='post',
@@ -174,17 +236,14 @@ class PostDeleteView(APIView):
     def delete(self, request, post_id):
         """删除帖子"""
         try:
-            post = Post.objects.get(id=post_id, author=request.user)
-            post.status = 0  # 软删除
-            post.save()
-            
-            # 更新贴吧统计
-            tieba = post.tieba
-            tieba.post_count -= 1
-            tieba.save()
+            with transaction.atomic():
+                # 锁住帖子行，重复删除时不会重复扣减计数（计数由 Post.save 按可见状态同步）
+                post = Post.objects.select_for_update().get(id=post_id, author=request.user)
+                post.status = 0  # 软删除
+                post.save()
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='post_delete',
                 target_type='post',
@@ -205,32 +264,25 @@ class PostLikeView(APIView):
         """点赞/取消点赞帖子"""
         try:
             post = Post.objects.get(id=post_id, status=1)
-            like, created = PostLike.objects.get_or_create(post=post, user=request.user)
+            liked, like_count = like_engine.toggle(PostLike, post.id, request.user.id)
             
-            if not created:
-                # 取消点赞
-                like.delete()
-                post.like_count -= 1
+            if not liked:
                 message = '取消点赞成功'
             else:
-                # 点赞成功
-                post.like_count += 1
                 message = '点赞成功'
                 
                 # 记录活动
-                UserActivity.objects.create(
+                activity_logger.log(
                     user=request.user,
                     action='post_like',
                     target_type='post',
                     target_id=post.id
                 )
             
-            post.save()
-            
             return Response({
                 'message': message,
-                'like_count': post.like_count,
-                'is_liked': created
+                'like_count': like_count,
+                'is_liked': liked
             })
             
         except Post.DoesNotExist:
@@ -245,32 +297,25 @@ class PostCollectView(APIView):
         """收藏/取消收藏帖子"""
         try:
             post = Post.objects.get(id=post_id, status=1)
-            collect, created = PostCollect.objects.get_or_create(post=post, user=request.user)
+            collected, collect_count = like_engine.toggle(PostCollect, post.id, request.user.id)
             
-            if not created:
-                # 取消收藏
-                collect.delete()
-                post.collect_count -= 1
+            if not collected:
                 message = '取消收藏成功'
             else:
-                # 收藏成功
-                post.collect_count += 1
                 message = '收藏成功'
                 
                 # 记录活动
-                UserActivity.objects.create(
+                activity_logger.log(
                     user=request.user,
                     action='post_collect',
                     target_type='post',
                     target_id=post.id
                 )
             
-            post.save()
-            
             return Response({
                 'message': message,
-                'collect_count': post.collect_count,
-                'is_collected': created
+                'collect_count': collect_count,
+                'is_collected': collected
             })
             
         except Post.DoesNotExist:
@@ -311,29 +356,46 @@ class UserPostHistoryView(APIView):
     @method_decorator(login_required)
     def get(self, request):
         """获取用户浏览历史"""
-        history = PostViewHistory.objects.filter(user=request.user).order_by('-viewed_at')
-        
-        page = self.paginate_queryset(history, request)
-        if page is not None:
-            serializer = PostViewHistorySerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        history = PostViewHistory.objects.filter(user=request.user).select_related(
+            'post__author', 'post__tieba'
+        )
         
-        serializer = PostViewHistorySerializer(history[:20], many=True)
-        return Response(serializer.data)
+        paginator = KeysetPagination(('-viewed_at', '-id'))
+        page = paginator.paginate_queryset(history, request)
+        serializer = PostViewHistorySerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+class FeedView(APIView):
+    """关注动态视图"""
     
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
+    @method_decorator(login_required)
+    def get(self, request):
+        """获取关注的用户发布的帖子，从新到旧，按帖子ID游标翻页"""
+        paginator = KeysetPagination(('-id',))
+        position = paginator.get_position(request)
+        before = position[0] if position else None
+        if before is not None and not isinstance(before, int):
+            raise NotFound(paginator.invalid_cursor_message)
+        
+        post_ids, next_before = home_timeline.page(request.user.id, before, paginator.get_page_size(request))
+        posts = load_in_order(
+            Post.objects.filter(status=1).select_related('author', 'tieba').prefetch_related('images'), post_ids
+        )
+        paginator.next_position = [next_before] if next_before is not None else None
+        
+        serializer = PostListSerializer(posts, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_anonymous_response(['post', 'tieba', 'hot_posts'])
 def hot_posts(request):
-    """热门帖子"""
-    posts = Post.objects.filter(status=1).order_by('-view_count', '-like_count')[:20]
+    """热门帖子，读取预先计算的全站或贴吧热榜"""
+    tieba_id = tieba_param(request)
+    hot_ids = hot_scores.top(tieba_id, limit=20)
+    posts = load_in_order(Post.objects.filter(status=1).select_related('author', 'tieba'), hot_ids)
     
     serializer = PostListSerializer(posts, many=True, context={'request': request})
     return Response({'hot_posts': serializer.data})
@@ -341,9 +403,10 @@ def hot_posts(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_anonymous_response(['post', 'tieba'])
 def recommended_posts(request):
     """推荐帖子"""
-    posts = Post.objects.filter(status=1, is_essence=True).order_by('-created_at')[:10]
+    posts = Post.objects.filter(status=1, is_essence=True).select_related('author', 'tieba').order_by('-created_at')[:10]
     
     serializer = PostListSerializer(posts, many=True, context={'request': request})
     return Response({'recommended_posts': serializer.data})
\ No newline at end of file
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class SearchConfig(AppConfig):
+    """搜索应用"""
+    
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'search'
+    verbose_name = '搜索'
+    
+    def ready(self):
+        from .indexer import connect_signals
+        connect_signals()
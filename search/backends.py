@@ -0,0 +1,224 @@
+"""
+搜索索引后端
+
+后端由 settings.SEARCH_BACKEND 指定，需实现 BaseSearchBackend 的接口。
+默认的 SQLiteFTS5Backend 把索引保存在独立的 SQLite 文件中：
+search_doc 保存文档的过滤和排序字段，search_fts 是 FTS5 全文索引，二者以 rowid 关联。
+"""
+
+import sqlite3
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.test.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .tokenizer import build_match_query, to_index_text
+
+# 文档类型
+DOC_TIEBA = 'tieba'
+DOC_POST = 'post'
+DOC_COMMENT = 'comment'
+DOC_USER = 'user'
+
+SearchDocument = namedtuple('SearchDocument', [
+    'doc_type', 'doc_id', 'title', 'body',
+    'tieba_id', 'author_id', 'category_id', 'popularity', 'created_at',
+])
+
+# 可用于过滤的字段
+FILTER_FIELDS = ('tieba_id', 'author_id', 'category_id')
+
+
+class BaseSearchBackend:
+    """搜索后端接口"""
+
+    def index(self, documents):
+        """写入或更新文档"""
+        raise NotImplementedError
+
+    def remove(self, doc_type, doc_ids):
+        """删除文档"""
+        raise NotImplementedError
+
+    def clear(self, doc_type=None):
+        """清空某一类型（或全部）文档"""
+        raise NotImplementedError
+
+    def update_popularity(self, doc_type, popularity):
+        """只更新文档的热度，popularity 为 {文档ID: 热度}，未被索引的文档忽略"""
+        raise NotImplementedError
+
+    def search(self, doc_type, query, filters=None, sort='relevance', offset=0, limit=20):
+        """搜索文档，返回 (命中总数, 文档ID列表)"""
+        raise NotImplementedError
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """基于 SQLite FTS5 的本地全文索引"""
+
+    SCHEMA = [
+        """
+        CREATE TABLE IF NOT EXISTS search_doc (
+            id INTEGER PRIMARY KEY,
+            doc_type TEXT NOT NULL,
+            doc_id INTEGER NOT NULL,
+            tieba_id INTEGER,
+            author_id INTEGER,
+            category_id INTEGER,
+            popularity REAL NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL DEFAULT 0,
+            UNIQUE (doc_type, doc_id)
+        )
+        """,
+        'CREATE INDEX IF NOT EXISTS search_doc_created ON search_doc (doc_type, created_at)',
+        'CREATE INDEX IF NOT EXISTS search_doc_popularity ON search_doc (doc_type, popularity)',
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(title, body, tokenize='unicode61')",
+    ]
+
+    # 标题命中的权重高于正文
+    RANK = 'bm25(search_fts, 10.0, 1.0)'
+
+    ORDERINGS = {
+        'relevance': RANK,
+        'latest': 'd.created_at DESC',
+        'hot': 'd.popularity DESC, ' + RANK,
+    }
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._ensure_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self):
+        conn = self._connection()
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+    def index(self, documents):
+        conn = self._connection()
+        with self._write_lock, conn:
+            for doc in documents:
+                row = conn.execute(
+                    'SELECT id FROM search_doc WHERE doc_type = ? AND doc_id = ?',
+                    (doc.doc_type, doc.doc_id),
+                ).fetchone()
+                values = (
+                    doc.tieba_id, doc.author_id, doc.category_id,
+                    doc.popularity or 0, doc.created_at.timestamp() if doc.created_at else 0,
+                )
+                if row:
+                    rowid = row[0]
+                    conn.execute(
+                        'UPDATE search_doc SET tieba_id = ?, author_id = ?, category_id = ?, '
+                        'popularity = ?, created_at = ? WHERE id = ?',
+                        values + (rowid,),
+                    )
+                    conn.execute('DELETE FROM search_fts WHERE rowid = ?', (rowid,))
+                else:
+                    rowid = conn.execute(
+                        'INSERT INTO search_doc (doc_type, doc_id, tieba_id, author_id, category_id, '
+                        'popularity, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (doc.doc_type, doc.doc_id) + values,
+                    ).lastrowid
+                conn.execute(
+                    'INSERT INTO search_fts (rowid, title, body) VALUES (?, ?, ?)',
+                    (rowid, to_index_text(doc.title), to_index_text(doc.body)),
+                )
+
+    def remove(self, doc_type, doc_ids):
+        conn = self._connection()
+        with self._write_lock, conn:
+            for doc_id in doc_ids:
+                row = conn.execute(
+                    'SELECT id FROM search_doc WHERE doc_type = ? AND doc_id = ?',
+                    (doc_type, doc_id),
+                ).fetchone()
+                if row:
+                    conn.execute('DELETE FROM search_fts WHERE rowid = ?', (row[0],))
+                    conn.execute('DELETE FROM search_doc WHERE id = ?', (row[0],))
+
+    def clear(self, doc_type=None):
+        conn = self._connection()
+        with self._write_lock, conn:
+            if doc_type is None:
+                conn.execute('DELETE FROM search_fts')
+                conn.execute('DELETE FROM search_doc')
+            else:
+                conn.execute(
+                    'DELETE FROM search_fts WHERE rowid IN (SELECT id FROM search_doc WHERE doc_type = ?)',
+                    (doc_type,),
+                )
+                conn.execute('DELETE FROM search_doc WHERE doc_type = ?', (doc_type,))
+
+    def update_popularity(self, doc_type, popularity):
+        conn = self._connection()
+        with self._write_lock, conn:
+            conn.executemany(
+                'UPDATE search_doc SET popularity = ? WHERE doc_type = ? AND doc_id = ?',
+                [(value or 0, doc_type, doc_id) for doc_id, value in popularity.items()],
+            )
+
+    def search(self, doc_type, query, filters=None, sort='relevance', offset=0, limit=20):
+        match = build_match_query(query)
+        if not match:
+            return 0, []
+
+        where = ['search_fts MATCH ?', 'd.doc_type = ?']
+        params = [match, doc_type]
+        for field, value in (filters or {}).items():
+            if field in FILTER_FIELDS and value is not None:
+                where.append(f'd.{field} = ?')
+                params.append(value)
+        where_sql = ' AND '.join(where)
+        from_sql = 'FROM search_fts JOIN search_doc d ON d.id = search_fts.rowid'
+        order_sql = self.ORDERINGS.get(sort, self.RANK)
+
+        conn = self._connection()
+        total = conn.execute(f'SELECT COUNT(*) {from_sql} WHERE {where_sql}', params).fetchone()[0]
+        if not total:
+            return 0, []
+        rows = conn.execute(
+            f'SELECT d.doc_id {from_sql} WHERE {where_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?',
+            params + [limit, offset],
+        ).fetchall()
+        return total, [row[0] for row in rows]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """获取配置的搜索后端实例"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(
+                    getattr(settings, 'SEARCH_BACKEND', 'search.backends.SQLiteFTS5Backend')
+                )
+                _backend = backend_class(settings.SEARCH_INDEX_PATH)
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_backend(setting, **kwargs):
+    """索引配置变化（如测试中 override_settings）后重新创建后端"""
+    global _backend
+    if setting in ('SEARCH_BACKEND', 'SEARCH_INDEX_PATH'):
+        with _backend_lock:
+            _backend = None
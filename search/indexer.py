@@ -0,0 +1,206 @@
+"""
+模型与搜索索引之间的同步
+
+贴吧、帖子、评论、用户保存或删除后（事务提交时）登记到 search_index 队列，
+由后台线程批量取回最新状态写入索引，不再可见（软删除、封禁等）或已被删除的从索引中移除，
+请求线程不再等待索引写入。
+只更新计数字段的 save(update_fields=...) 不会触发重建；计数写回（点赞、浏览、回复）后
+由写回方调用 search_index.touch 只更新热度。
+"""
+
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from comments.models import Comment
+from posts.models import Post
+from tieba.models import Tieba
+from tieba_project.background import BackgroundBatcher
+
+from .backends import (
+    DOC_COMMENT, DOC_POST, DOC_TIEBA, DOC_USER, SearchDocument, get_backend
+)
+
+User = get_user_model()
+
+
+def tieba_document(tieba):
+    return SearchDocument(
+        doc_type=DOC_TIEBA, doc_id=tieba.id,
+        title=tieba.name, body=tieba.description,
+        tieba_id=tieba.id, author_id=tieba.owner_id, category_id=tieba.category_id,
+        popularity=tieba.member_count, created_at=tieba.created_at,
+    )
+
+
+def post_document(post):
+    return SearchDocument(
+        doc_type=DOC_POST, doc_id=post.id,
+        title=post.title, body=post.content,
+        tieba_id=post.tieba_id, author_id=post.author_id, category_id=None,
+        popularity=post.like_count + post.reply_count + post.collect_count,
+        created_at=post.created_at,
+    )
+
+
+def comment_document(comment):
+    return SearchDocument(
+        doc_type=DOC_COMMENT, doc_id=comment.id,
+        title='', body=comment.content,
+        tieba_id=None, author_id=comment.author_id, category_id=None,
+        popularity=comment.like_count, created_at=comment.created_at,
+    )
+
+
+def user_document(user):
+    return SearchDocument(
+        doc_type=DOC_USER, doc_id=user.id,
+        title=' '.join(filter(None, [user.username, user.nickname])), body=user.bio or '',
+        tieba_id=None, author_id=None, category_id=None,
+        popularity=user.follower_count, created_at=user.created_at,
+    )
+
+
+# 模型 -> (文档类型, 构建文档, 是否可被搜索到, 影响索引内容的字段)
+INDEXED_MODELS = {
+    Tieba: (DOC_TIEBA, tieba_document, lambda obj: obj.status == 1,
+            {'name', 'description', 'category', 'status'}),
+    Post: (DOC_POST, post_document, lambda obj: obj.status == 1,
+           {'title', 'content', 'status', 'tieba'}),
+    Comment: (DOC_COMMENT, comment_document, lambda obj: obj.status == 1,
+              {'content', 'status'}),
+    User: (DOC_USER, user_document, lambda obj: obj.status == 1,
+           {'username', 'nickname', 'bio', 'status'}),
+}
+
+
+def sync_instance(instance):
+    """根据实例当前状态写入或移除索引"""
+    doc_type, build, searchable, _ = INDEXED_MODELS[type(instance)]
+    backend = get_backend()
+    if searchable(instance):
+        backend.index([build(instance)])
+    else:
+        backend.remove(doc_type, [instance.id])
+
+
+class IndexQueue:
+    """待同步到索引的对象，由后台线程批量写入"""
+
+    def __init__(self, flush_interval):
+        self._lock = threading.Lock()
+        # 模型 -> 需要重建文档的ID / 只需更新热度的ID
+        self._documents = defaultdict(set)
+        self._popularity = defaultdict(set)
+        # 索引失败不影响业务写入，可通过 rebuild_search_index 修复
+        self._batcher = BackgroundBatcher('search-index', self.flush, flush_interval, '更新搜索索引失败')
+
+    def add(self, model, pk):
+        """登记对象，稍后按其最新状态写入或移除"""
+        with self._lock:
+            self._documents[model].add(pk)
+        self._batcher.start()
+
+    def touch(self, model, pks):
+        """登记计数已变化的对象，稍后只更新热度"""
+        with self._lock:
+            self._popularity[model].update(pks)
+        self._batcher.start()
+
+    def flush(self):
+        """把登记的对象写入索引，返回处理的对象数"""
+        with self._lock:
+            documents, self._documents = self._documents, defaultdict(set)
+            popularity, self._popularity = self._popularity, defaultdict(set)
+        try:
+            for model, pks in documents.items():
+                self._sync(model, pks)
+            for model, pks in popularity.items():
+                self._sync_popularity(model, pks - documents.get(model, set()))
+        except Exception:
+            self._restore(documents, popularity)
+            raise
+        return sum(map(len, documents.values())) + sum(map(len, popularity.values()))
+
+    def _restore(self, documents, popularity):
+        with self._lock:
+            for model, pks in documents.items():
+                self._documents[model] |= pks
+            for model, pks in popularity.items():
+                self._popularity[model] |= pks
+
+    def _sync(self, model, pks):
+        doc_type, build, searchable, _ = INDEXED_MODELS[model]
+        objects = model.objects.in_bulk(pks)
+        visible = [obj for obj in objects.values() if searchable(obj)]
+        backend = get_backend()
+        backend.index([build(obj) for obj in visible])
+        backend.remove(doc_type, pks - {obj.pk for obj in visible})
+
+    def _sync_popularity(self, model, pks):
+        if not pks:
+            return
+        doc_type, build, searchable, _ = INDEXED_MODELS[model]
+        objects = model.objects.in_bulk(pks)
+        get_backend().update_popularity(
+            doc_type, {obj.pk: build(obj).popularity for obj in objects.values() if searchable(obj)}
+        )
+
+
+search_index = IndexQueue(flush_interval=getattr(settings, 'SEARCH_INDEX_FLUSH_INTERVAL', 2))
+
+
+def _on_save(sender, instance, update_fields=None, **kwargs):
+    _, _, _, tracked = INDEXED_MODELS[sender]
+    if update_fields is not None and not tracked.intersection(update_fields):
+        return
+    pk = instance.pk
+    transaction.on_commit(lambda: search_index.add(sender, pk))
+
+
+def _on_delete(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: search_index.add(sender, pk))
+
+
+def connect_signals():
+    for model in INDEXED_MODELS:
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'search_index_save_{model.__name__}')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'search_index_delete_{model.__name__}')
+
+
+def rebuild(doc_type=None, chunk_size=1000):
+    """全量重建索引，返回 {文档类型: 文档数}"""
+    backend = get_backend()
+    counts = {}
+    for model, (model_doc_type, build, searchable, _) in INDEXED_MODELS.items():
+        if doc_type and doc_type != model_doc_type:
+            continue
+        backend.clear(model_doc_type)
+        total = 0
+        last_id = 0
+        while True:
+            chunk = list(model.objects.filter(id__gt=last_id).order_by('id')[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            documents = [build(obj) for obj in chunk if searchable(obj)]
+            backend.index(documents)
+            total += len(documents)
+        counts[model_doc_type] = total
+    return counts
+
+
+def search_ids(doc_type, query, filters=None, sort='relevance', offset=0, limit=20):
+    """搜索并返回 (命中总数, 按排序排列的对象ID列表)"""
+    return get_backend().search(doc_type, query, filters=filters, sort=sort, offset=offset, limit=limit)
+
+
+def load_in_order(queryset, ids):
+    """按 ids 的顺序取回对象，跳过已不存在的对象"""
+    objects = queryset.in_bulk(ids)
+    return [objects[pk] for pk in ids if pk in objects]
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from search.backends import DOC_COMMENT, DOC_POST, DOC_TIEBA, DOC_USER
+from search.indexer import rebuild
+
+
+class Command(BaseCommand):
+    """全量重建搜索索引"""
+
+    help = '重建贴吧、帖子、评论、用户的全文搜索索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', dest='doc_type', choices=[DOC_TIEBA, DOC_POST, DOC_COMMENT, DOC_USER],
+            help='只重建指定类型',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批读取的记录数')
+
+    def handle(self, *args, **options):
+        counts = rebuild(options['doc_type'], options['chunk_size'])
+        for doc_type, total in counts.items():
+            self.stdout.write(f'{doc_type}: {total}')
+        self.stdout.write(self.style.SUCCESS('搜索索引重建完成'))
@@ -0,0 +1,241 @@
+"""
+搜索词日志：热搜榜与相关搜索
+
+请求中只把 (搜索词, 会话标识, 时间) 追加到进程内队列，由后台线程批量写入存储：
+    - 按分钟、小时两级分桶计数，1h 榜合并最近 60 个分钟桶，24h / 7d 榜合并小时桶
+    - 同一会话在 RELATED_WINDOW 秒内先后搜索的两个词记为一次共现，按天分桶计数，
+      相关搜索合并最近 RELATED_DAYS 天的桶，每个词每天只保留共现最多的 RELATED_KEEP 个词
+存储由 settings.QUERY_LOG_BACKEND 选择 redis（有序集合）或 memory（进程内计数）。
+榜单结果缓存 HOT_SEARCH_CACHE_SECONDS 秒，读取时不逐桶计算。
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+
+from django.conf import settings
+
+from tieba_project.background import BackgroundBatcher
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+# 榜单窗口 -> (桶粒度, 桶数量)
+WINDOWS = {
+    '1h': (MINUTE, 60),
+    '24h': (HOUR, 24),
+    '7d': (HOUR, 24 * 7),
+}
+
+MAX_QUERY_LENGTH = 50
+# 同一会话两次搜索间隔在此范围内视为相关
+RELATED_WINDOW = 10 * MINUTE
+# 每个会话参与共现计算的最近搜索数
+RELATED_RECENT = 5
+# 记住最近搜索的会话数上限
+MAX_SESSIONS = 100000
+# 相关搜索统计的天数
+RELATED_DAYS = 7
+# 每个词每天保留的相关词数
+RELATED_KEEP = 50
+
+
+def normalize_query(query):
+    return ' '.join((query or '').split()).lower()[:MAX_QUERY_LENGTH]
+
+
+def bucket_start(timestamp, granularity):
+    return int(timestamp) // granularity * granularity
+
+
+class MemoryQueryStore:
+    """进程内存储，适合单进程部署和开发环境"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {MINUTE: {}, HOUR: {}}
+        self._related = {}
+
+    def apply(self, counts, pairs):
+        """counts: {(粒度, 桶起点, 搜索词): 次数}，pairs: {(天桶起点, 词A, 词B): 次数}"""
+        with self._lock:
+            for (granularity, start, query), amount in counts.items():
+                self._buckets[granularity].setdefault(start, Counter())[query] += amount
+            touched = set()
+            for (day, a, b), amount in pairs.items():
+                bucket = self._related.setdefault(day, defaultdict(Counter))
+                for x, y in ((a, b), (b, a)):
+                    bucket[x][y] += amount
+                    touched.add((day, x))
+            for day, query in touched:
+                related = self._related[day][query]
+                if len(related) > RELATED_KEEP:
+                    self._related[day][query] = Counter(dict(related.most_common(RELATED_KEEP)))
+            self._expire()
+
+    def _expire(self):
+        now = time.time()
+        for granularity, buckets in self._buckets.items():
+            keep = max(count for g, count in WINDOWS.values() if g == granularity)
+            oldest = bucket_start(now, granularity) - keep * granularity
+            for start in [s for s in buckets if s < oldest]:
+                del buckets[start]
+        oldest = bucket_start(now, DAY) - (RELATED_DAYS - 1) * DAY
+        for day in [d for d in self._related if d < oldest]:
+            del self._related[day]
+
+    def top(self, granularity, starts, limit):
+        total = Counter()
+        with self._lock:
+            for start in starts:
+                total.update(self._buckets[granularity].get(start, {}))
+        return total.most_common(limit)
+
+    def related(self, query, days, limit):
+        total = Counter()
+        with self._lock:
+            for day in days:
+                total.update(self._related.get(day, {}).get(query, {}))
+        return total.most_common(limit)
+
+
+class RedisQueryStore:
+    """基于 Redis 有序集合的存储，多进程共享"""
+
+    PREFIX = 'search:q'
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _bucket_key(self, granularity, start):
+        return f'{self.PREFIX}:{granularity}:{start}'
+
+    def _related_key(self, day, query):
+        return f'{self.PREFIX}:related:{day}:{query}'
+
+    def apply(self, counts, pairs):
+        pipe = self._client.pipeline(transaction=False)
+        for (granularity, start, query), amount in counts.items():
+            key = self._bucket_key(granularity, start)
+            pipe.zincrby(key, amount, query)
+            pipe.expire(key, 8 * DAY)
+        for (day, a, b), amount in pairs.items():
+            for x, y in ((a, b), (b, a)):
+                key = self._related_key(day, x)
+                pipe.zincrby(key, amount, y)
+                pipe.zremrangebyrank(key, 0, -RELATED_KEEP - 1)
+                # 过期时间由天桶决定，写入不会延长
+                pipe.expireat(key, day + (RELATED_DAYS + 1) * DAY)
+        pipe.execute()
+
+    def _union(self, keys, dest, limit):
+        pipe = self._client.pipeline()
+        pipe.zunionstore(dest, keys)
+        pipe.zrevrange(dest, 0, limit - 1, withscores=True)
+        pipe.delete(dest)
+        _, result, _ = pipe.execute()
+        return [(item, int(score)) for item, score in result]
+
+    def top(self, granularity, starts, limit):
+        keys = [self._bucket_key(granularity, start) for start in starts]
+        return self._union(keys, f'{self.PREFIX}:union:{granularity}:{starts[0]}:{len(starts)}', limit)
+
+    def related(self, query, days, limit):
+        keys = [self._related_key(day, query) for day in days]
+        return self._union(keys, f'{self.PREFIX}:union:related:{days[0]}:{query}', limit)
+
+
+class QueryLog:
+    """搜索词日志，记录不阻塞请求，后台批量写入"""
+
+    def __init__(self, store, flush_interval, cache_seconds, max_queue_size=100000):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.cache_seconds = cache_seconds
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._batcher = BackgroundBatcher('search-query-log', self.flush, flush_interval, '写入搜索词日志失败')
+        self._sessions = OrderedDict()
+        self._write_lock = threading.Lock()
+        self._top_cache = {}
+
+    def record(self, query, session=None):
+        """记录一次搜索"""
+        query = normalize_query(query)
+        if not query:
+            return
+        try:
+            self._queue.put_nowait((query, session, time.time()))
+        except queue.Full:
+            return
+        self._batcher.start()
+
+    def top(self, window='24h', limit=10):
+        """热搜榜，返回 [(搜索词, 次数)]"""
+        granularity, count = WINDOWS[window]
+        cache_key = (window, limit)
+        cached = self._top_cache.get(cache_key)
+        now = time.time()
+        if cached and cached[0] > now:
+            return cached[1]
+        current = bucket_start(now, granularity)
+        starts = [current - i * granularity for i in range(count)]
+        result = self.store.top(granularity, starts, limit)
+        self._top_cache[cache_key] = (now + self.cache_seconds, result)
+        return result
+
+    def related(self, query, limit=10):
+        """相关搜索，返回 [(搜索词, 共现次数)]"""
+        query = normalize_query(query)
+        if not query:
+            return []
+        today = bucket_start(time.time(), DAY)
+        return self.store.related(query, [today - i * DAY for i in range(RELATED_DAYS)], limit)
+
+    def flush(self):
+        """同步写入队列中的全部记录"""
+        entries = []
+        while True:
+            try:
+                entries.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if entries:
+            with self._write_lock:
+                self._write(entries)
+        return len(entries)
+
+    def _write(self, entries):
+        counts = Counter()
+        pairs = Counter()
+        for query, session, timestamp in entries:
+            for granularity in (MINUTE, HOUR):
+                counts[(granularity, bucket_start(timestamp, granularity), query)] += 1
+            if session is None:
+                continue
+            recent = self._sessions.pop(session, None) or deque(maxlen=RELATED_RECENT)
+            for previous, previous_at in recent:
+                if previous != query and timestamp - previous_at <= RELATED_WINDOW:
+                    pairs[(bucket_start(timestamp, DAY), *sorted((previous, query)))] += 1
+            recent.append((query, timestamp))
+            self._sessions[session] = recent
+            if len(self._sessions) > MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+        self.store.apply(counts, pairs)
+
+
+def _build_query_log():
+    if getattr(settings, 'QUERY_LOG_BACKEND', 'memory') == 'redis':
+        store = RedisQueryStore(settings.REDIS_URL)
+    else:
+        store = MemoryQueryStore()
+    return QueryLog(
+        store,
+        flush_interval=getattr(settings, 'QUERY_LOG_FLUSH_INTERVAL', 2),
+        cache_seconds=getattr(settings, 'HOT_SEARCH_CACHE_SECONDS', 60),
+    )
+
+
+query_log = _build_query_log()
@@ -0,0 +1,224 @@
+"""
+搜索建议
+
+在内存中维护一份按键排序的前缀索引，数据来自贴吧名称（按成员数加权）、
+热门帖子标题（按浏览量加权）和近 7 天的搜索词（按搜索次数加权，来自 query_log）。
+每条建议同时以原文和拼音首字母（需要安装 pypinyin）作为键，
+查询时用二分查找定位前缀区间；一到两个字符的短前缀在构建时预先算好 Top-K，
+更长的前缀在有序键上按块建线段树，每个节点保存其区间的 Top-K，查询时合并 O(log n) 个节点。
+索引每隔 SUGGESTION_REBUILD_INTERVAL 秒在后台线程重建，重建期间继续使用旧索引。
+"""
+
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from heapq import nlargest
+
+from django.conf import settings
+from django.db import close_old_connections
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # pragma: no cover - 未安装时不支持拼音首字母匹配
+    lazy_pinyin = None
+
+logger = logging.getLogger(__name__)
+
+Suggestion = namedtuple('Suggestion', ['text', 'type', 'id', 'weight'])
+
+# 各数据来源的权重系数，使成员数、浏览量、搜索次数大致可比
+SOURCE_WEIGHTS = {
+    'tieba': 1.0,
+    'post': 0.1,
+    'query': 5.0,
+}
+
+# 预先计算 Top-K 的前缀最大长度
+HOT_PREFIX_LENGTH = 2
+# 线段树叶子覆盖的键数量，区间两端不足一块的部分直接扫描
+BLOCK_SIZE = 64
+TOP_K = 10
+
+
+def prefix_end(prefix):
+    """字典序上紧接在所有以 prefix 开头的字符串之后的字符串，没有上界时返回 None"""
+    for i in range(len(prefix) - 1, -1, -1):
+        if ord(prefix[i]) < sys.maxunicode:
+            return prefix[:i] + chr(ord(prefix[i]) + 1)
+    return None
+
+
+def normalize(text):
+    return ''.join((text or '').split()).lower()
+
+
+def pinyin_initials(text):
+    """汉字转拼音首字母，其他字符原样保留"""
+    if lazy_pinyin is None:
+        return ''
+    return normalize(''.join(lazy_pinyin(text, style=Style.FIRST_LETTER)))
+
+
+class SuggestionIndex:
+    """不可变的前缀索引"""
+
+    def __init__(self, suggestions, top_k=TOP_K):
+        self._suggestions = suggestions
+        self.top_k = top_k
+
+        pairs = []
+        for i, suggestion in enumerate(suggestions):
+            keys = {normalize(suggestion.text), pinyin_initials(suggestion.text)}
+            pairs.extend((key, i) for key in keys if key)
+        pairs.sort()
+        self._keys = [key for key, _ in pairs]
+        self._refs = [i for _, i in pairs]
+
+        candidates = {}
+        for key, i in pairs:
+            for length in range(1, min(len(key), HOT_PREFIX_LENGTH) + 1):
+                candidates.setdefault(key[:length], set()).add(i)
+        self._hot = {
+            prefix: nlargest(top_k, refs, key=self._weight)
+            for prefix, refs in candidates.items()
+        }
+        self._tree = self._build_tree()
+
+    def __len__(self):
+        return len(self._suggestions)
+
+    def _weight(self, i):
+        return self._suggestions[i].weight
+
+    def _top(self, refs):
+        return nlargest(self.top_k, set(refs), key=self._weight)
+
+    def _build_tree(self):
+        """自底向上的线段树，叶子为每块键的 Top-K，内部节点合并两个子节点"""
+        blocks = [
+            self._top(self._refs[start:start + BLOCK_SIZE]) for start in range(0, len(self._refs), BLOCK_SIZE)
+        ]
+        size = len(blocks)
+        tree = [[]] * size + blocks
+        for node in range(size - 1, 0, -1):
+            tree[node] = self._top(tree[2 * node] + tree[2 * node + 1])
+        return tree
+
+    def _range_top(self, lo, hi):
+        """键区间 [lo, hi) 中权重最高的 top_k 条建议"""
+        first = -(-lo // BLOCK_SIZE)
+        last = hi // BLOCK_SIZE
+        if first >= last:
+            return self._top(self._refs[lo:hi])
+        refs = self._refs[lo:first * BLOCK_SIZE] + self._refs[last * BLOCK_SIZE:hi]
+        size = len(self._tree) // 2
+        left, right = first + size, last + size
+        while left < right:
+            if left & 1:
+                refs += self._tree[left]
+                left += 1
+            if right & 1:
+                right -= 1
+                refs += self._tree[right]
+            left //= 2
+            right //= 2
+        return self._top(refs)
+
+    def lookup(self, prefix, limit=TOP_K):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= HOT_PREFIX_LENGTH:
+            refs = self._hot.get(prefix, [])
+        else:
+            lo = bisect_left(self._keys, prefix)
+            # 不能用 prefix + '\uffff' 作上界：扩展平面的字符（如表情）大于 '\uffff'
+            end = prefix_end(prefix)
+            hi = bisect_left(self._keys, end, lo) if end is not None else len(self._keys)
+            refs = self._range_top(lo, hi)
+        return [self._suggestions[i] for i in refs[:limit]]
+
+
+class SuggestionService:
+    """定期重建的搜索建议服务"""
+
+    def __init__(self, rebuild_interval, tieba_limit, post_limit, query_limit):
+        self.rebuild_interval = rebuild_interval
+        self.tieba_limit = tieba_limit
+        self.post_limit = post_limit
+        self.query_limit = query_limit
+        self._index = None
+        self._built_at = 0
+        self._rebuild_lock = threading.Lock()
+
+    def suggest(self, prefix, limit=TOP_K):
+        index = self._index
+        if index is None:
+            # 冷启动时并发请求只构建一次，其余请求等待构建完成
+            with self._rebuild_lock:
+                if self._index is None:
+                    self._build()
+                index = self._index
+        elif time.monotonic() - self._built_at >= self.rebuild_interval:
+            self._rebuild_in_background()
+        return index.lookup(prefix, limit)
+
+    def rebuild(self):
+        """同步重建索引"""
+        with self._rebuild_lock:
+            return self._build()
+
+    def _build(self):
+        self._index = SuggestionIndex(self._collect())
+        self._built_at = time.monotonic()
+        return self._index
+
+    def _rebuild_in_background(self):
+        if self._rebuild_lock.locked():
+            return
+        # 先推迟下次触发，避免并发请求重复启动重建线程
+        self._built_at = time.monotonic()
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception:
+                logger.exception('重建搜索建议索引失败')
+            finally:
+                close_old_connections()
+
+        threading.Thread(target=run, name='suggestion-rebuild', daemon=True).start()
+
+    def _collect(self):
+        from posts.models import Post
+        from tieba.models import Tieba
+        from .query_log import query_log
+
+        suggestions = []
+        tiebas = Tieba.objects.filter(status=1).order_by('-member_count').values_list(
+            'id', 'name', 'member_count'
+        )[:self.tieba_limit]
+        for tieba_id, name, member_count in tiebas:
+            suggestions.append(Suggestion(name, 'tieba', tieba_id, member_count * SOURCE_WEIGHTS['tieba']))
+
+        posts = Post.objects.filter(status=1).order_by('-view_count').values_list(
+            'id', 'title', 'view_count'
+        )[:self.post_limit]
+        for post_id, title, view_count in posts:
+            suggestions.append(Suggestion(title, 'post', post_id, view_count * SOURCE_WEIGHTS['post']))
+
+        for query, count in query_log.top('7d', self.query_limit):
+            suggestions.append(Suggestion(query, 'query', None, count * SOURCE_WEIGHTS['query']))
+
+        return suggestions
+
+
+suggestion_service = SuggestionService(
+    rebuild_interval=getattr(settings, 'SUGGESTION_REBUILD_INTERVAL', 300),
+    tieba_limit=getattr(settings, 'SUGGESTION_TIEBA_LIMIT', 50000),
+    post_limit=getattr(settings, 'SUGGESTION_POST_LIMIT', 20000),
+    query_limit=getattr(settings, 'SUGGESTION_QUERY_LIMIT', 20000),
+)
@@ -0,0 +1,234 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+
+from posts.hot_score import hot_scores
+from posts.models import Post
+from tieba.models import Category, Tieba
+from tieba_project.background import flush_all
+from users.models import User
+
+from . import indexer
+from .backends import DOC_POST, DOC_TIEBA, SearchDocument, SQLiteFTS5Backend, get_backend
+from .query_log import DAY, RELATED_DAYS, RELATED_KEEP, MemoryQueryStore, QueryLog, bucket_start
+from .suggestions import TOP_K, Suggestion, SuggestionIndex, SuggestionService, prefix_end
+
+
+class QueryLogRelatedTests(SimpleTestCase):
+    """相关搜索按天分桶，旧桶过期，每个词只保留共现最多的词"""
+
+    def setUp(self):
+        self.store = MemoryQueryStore()
+        self.log = QueryLog(self.store, flush_interval=60, cache_seconds=0)
+
+    def test_same_session_searches_are_related(self):
+        self.log.record('python', 'session')
+        self.log.record('django', 'session')
+        self.log.record('rust', 'other')
+        self.log.flush()
+        self.assertEqual(self.log.related('python'), [('django', 1)])
+        self.assertEqual(self.log.related('django'), [('python', 1)])
+        self.assertEqual(self.log.related('rust'), [])
+
+    def test_old_days_expire(self):
+        today = bucket_start(time.time(), DAY)
+        self.store.apply({}, {(today - RELATED_DAYS * DAY, 'a', 'old'): 5, (today, 'a', 'new'): 1})
+        self.assertEqual(list(self.store._related), [today])
+        self.assertEqual(self.log.related('a'), [('new', 1)])
+
+    def test_each_query_keeps_top_related(self):
+        today = bucket_start(time.time(), DAY)
+        pairs = {(today, 'a', f'b{i:03}'): i + 1 for i in range(RELATED_KEEP * 2)}
+        self.store.apply({}, pairs)
+        related = self.store._related[today]['a']
+        self.assertEqual(len(related), RELATED_KEEP)
+        self.assertEqual(min(related.values()), RELATED_KEEP + 1)
+
+
+class SuggestionIndexTests(SimpleTestCase):
+    """长前缀在整个前缀区间内按权重取 Top-K"""
+
+    def test_long_prefix_ranks_the_whole_range(self):
+        suggestions = [Suggestion(f'abc{i:05}', 'query', None, i % 97) for i in range(20000)]
+        suggestions.append(Suggestion('abczzz', 'query', None, 1000))
+        suggestions.append(Suggestion('abd', 'query', None, 5000))
+        index = SuggestionIndex(suggestions)
+
+        expected = sorted(suggestions[:-1], key=lambda item: -item.weight)[:TOP_K]
+        result = index.lookup('abc')
+        self.assertEqual(result[0].text, 'abczzz')
+        self.assertEqual([item.weight for item in result], [item.weight for item in expected])
+        for prefix in ('abc0', 'abc01', 'abc123', 'abc1999'):
+            expected = sorted((item.weight for item in suggestions if item.text.startswith(prefix)), reverse=True)
+            self.assertEqual([item.weight for item in index.lookup(prefix)], expected[:TOP_K])
+
+    def test_astral_characters_stay_in_range(self):
+        index = SuggestionIndex([
+            Suggestion('abc\U0001f600', 'query', None, 3),
+            Suggestion('abc\U0002a6a5', 'query', None, 2),
+            Suggestion('abc\uffff', 'query', None, 1),
+            Suggestion('abd', 'query', None, 9),
+        ])
+        self.assertEqual([item.weight for item in index.lookup('abc')], [3, 2, 1])
+        self.assertEqual(prefix_end('ab\U0010ffff'), 'ac')
+        self.assertIsNone(prefix_end('\U0010ffff'))
+
+    def test_short_ranges_are_scanned(self):
+        index = SuggestionIndex([Suggestion('hello', 'query', None, 1), Suggestion('help', 'query', None, 2)])
+        self.assertEqual([item.text for item in index.lookup('hel')], ['help', 'hello'])
+        self.assertEqual(index.lookup('xyz'), [])
+
+
+class SuggestionServiceTests(SimpleTestCase):
+    """冷启动的并发请求只构建一次索引"""
+
+    def test_cold_start_builds_once(self):
+        service = SuggestionService(rebuild_interval=300, tieba_limit=0, post_limit=0, query_limit=0)
+        calls = []
+
+        def collect():
+            calls.append(1)
+            time.sleep(0.2)
+            return [Suggestion('python', 'query', None, 1)]
+
+        service._collect = collect
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(service.suggest('py'))) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([[item.text for item in result] for result in results], [['python']] * 8)
+
+
+def post_doc(doc_id, title, body='', tieba_id=1, popularity=0, days_ago=0):
+    return SearchDocument(
+        doc_type=DOC_POST, doc_id=doc_id, title=title, body=body,
+        tieba_id=tieba_id, author_id=1, category_id=None, popularity=popularity,
+        created_at=timezone.now() - timezone.timedelta(days=days_ago),
+    )
+
+
+class SQLiteFTS5BackendTests(SimpleTestCase):
+    """FTS5 后端的写入、过滤、排序和删除"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.backend = SQLiteFTS5Backend(os.path.join(self.dir.name, 'index.sqlite3'))
+
+    def tearDown(self):
+        self.backend._connection().close()
+        self.dir.cleanup()
+
+    def test_chinese_phrase_and_prefix(self):
+        self.backend.index([post_doc(1, '百度贴吧使用指南'), post_doc(2, '贴吧百度'), post_doc(3, 'Django tips')])
+        self.assertEqual(self.backend.search(DOC_POST, '百度贴吧'), (1, [1]))
+        self.assertEqual(sorted(self.backend.search(DOC_POST, '贴')[1]), [1, 2])
+        self.assertEqual(self.backend.search(DOC_POST, 'djan'), (1, [3]))
+        self.assertEqual(self.backend.search(DOC_POST, '   '), (0, []))
+
+    def test_filters_and_sorting(self):
+        self.backend.index([
+            post_doc(1, 'python 入门', tieba_id=1, popularity=1, days_ago=2),
+            post_doc(2, 'python 进阶', tieba_id=1, popularity=9, days_ago=5),
+            post_doc(3, 'python 实战', tieba_id=2, popularity=5, days_ago=0),
+        ])
+        self.assertEqual(self.backend.search(DOC_POST, 'python', filters={'tieba_id': 1})[0], 2)
+        self.assertEqual(self.backend.search(DOC_POST, 'python', sort='latest')[1], [3, 1, 2])
+        self.assertEqual(self.backend.search(DOC_POST, 'python', sort='hot')[1], [2, 3, 1])
+        self.assertEqual(self.backend.search(DOC_POST, 'python', offset=1, limit=1, sort='latest'), (3, [1]))
+        self.assertEqual(self.backend.search(DOC_TIEBA, 'python'), (0, []))
+
+    def test_reindex_replaces_text_and_remove_clears(self):
+        self.backend.index([post_doc(1, '旧标题')])
+        self.backend.index([post_doc(1, '新标题')])
+        self.assertEqual(self.backend.search(DOC_POST, '旧标'), (0, []))
+        self.assertEqual(self.backend.search(DOC_POST, '新标'), (1, [1]))
+        self.backend.remove(DOC_POST, [1])
+        self.assertEqual(self.backend.search(DOC_POST, '标题'), (0, []))
+        self.backend.index([post_doc(2, '标题')])
+        self.backend.clear(DOC_POST)
+        self.assertEqual(self.backend.search(DOC_POST, '标题'), (0, []))
+
+
+class IndexerTests(TransactionTestCase):
+    """模型保存和删除由后台队列同步到索引，测试索引写在临时目录"""
+
+    def setUp(self):
+        get_backend().clear()
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+
+    def tearDown(self):
+        flush_all()
+
+    def create_post(self, **kwargs):
+        return Post.objects.create(author=self.user, tieba=self.tieba, **kwargs)
+
+    def test_index_lives_outside_the_project(self):
+        self.assertNotEqual(os.path.dirname(get_backend().path), str(settings.BASE_DIR))
+
+    def test_visible_posts_are_indexed_and_soft_delete_removes(self):
+        draft = self.create_post(title='草稿标题', content='内容')
+        post = self.create_post(title='公开标题', content='内容', status=1)
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题'), (1, [post.id]))
+
+        post.status = 2
+        post.save(update_fields=['status'])
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题'), (0, []))
+        self.assertEqual(indexer.load_in_order(Post.objects.all(), [post.id, 0, draft.id]), [post, draft])
+
+    def test_hard_delete_removes(self):
+        post = self.create_post(title='标题', content='内容', status=1)
+        flush_all()
+        post.delete()
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题'), (0, []))
+
+    def test_saves_are_indexed_after_commit(self):
+        flush_all()
+        with transaction.atomic():
+            self.create_post(title='标题', content='内容', status=1)
+            self.assertEqual(indexer.search_index.flush(), 0)
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题')[0], 1)
+
+    def test_counter_only_saves_do_not_reindex(self):
+        post = self.create_post(title='标题', content='内容', status=1)
+        flush_all()
+        post.title = '改名'
+        post.save(update_fields=['view_count'])
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '改名'), (0, []))
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题'), (1, [post.id]))
+
+    def test_counter_flush_updates_popularity(self):
+        quiet = self.create_post(title='标题一', content='内容', status=1)
+        liked = self.create_post(title='标题二', content='内容', status=1)
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题', sort='hot')[1][0], quiet.id)
+
+        Post.objects.filter(id=liked.id).update(like_count=5)
+        hot_scores.touch(liked.id)
+        flush_all()
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题', sort='hot')[1], [liked.id, quiet.id])
+
+    def test_rebuild_indexes_only_visible_objects(self):
+        self.create_post(title='标题', content='内容', status=1)
+        self.create_post(title='标题', content='内容')
+        flush_all()
+        get_backend().clear()
+        self.assertEqual(indexer.rebuild(DOC_POST), {DOC_POST: 1})
+        self.assertEqual(indexer.search_ids(DOC_POST, '标题')[0], 1)
@@ -0,0 +1,54 @@
+"""
+中文分词
+
+中文按连续汉字切成二元组（百度贴吧 -> 百度 度贴 贴吧），每段末尾再补一个单字，
+保证任意单字都能以前缀方式命中；字母数字按单词切分并转为小写。
+索引与查询使用同一套规则，查询时一段连续汉字的二元组组成短语，要求在文档中相邻出现。
+"""
+
+import re
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_SEGMENT_RE = re.compile(rf'([{_CJK}]+)|([^\W_{_CJK}]+)')
+
+
+def _segments(text):
+    """把文本拆成 (片段, 是否汉字) 序列"""
+    for match in _SEGMENT_RE.finditer(text or ''):
+        if match.group(1):
+            yield match.group(1), True
+        else:
+            yield match.group(2).lower(), False
+
+
+def _bigrams(run):
+    return [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text):
+    """把文本切分为索引词列表"""
+    tokens = []
+    for segment, is_cjk in _segments(text):
+        if is_cjk:
+            tokens.extend(_bigrams(segment))
+            tokens.append(segment[-1])
+        else:
+            tokens.append(segment)
+    return tokens
+
+
+def to_index_text(text):
+    """转换为以空格分隔的索引词，交给 FTS5 的 unicode61 分词器"""
+    return ' '.join(tokenize(text))
+
+
+def build_match_query(text):
+    """把用户输入转换为 FTS5 MATCH 表达式，没有可检索内容时返回空字符串"""
+    clauses = []
+    for segment, is_cjk in _segments(text):
+        if is_cjk and len(segment) > 1:
+            clauses.append('"%s"' % ' '.join(_bigrams(segment)))
+        else:
+            # 单字和英文单词按前缀匹配，支持边输入边搜索
+            clauses.append('"%s"*' % segment)
+    return ' AND '.join(clauses)
@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('all/', views.search_all, name='search-all'),
+    path('posts/', views.search_posts, name='search-posts'),
+    path('tieba/', views.search_tieba, name='search-tieba'),
+    path('users/', views.search_users, name='search-users'),
+    path('suggestions/', views.search_suggestions, name='search-suggestions'),
+    path('hot/', views.hot_searches, name='search-hot'),
+    path('related/', views.related_searches, name='search-related'),
+]
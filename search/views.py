@@ -0,0 +1,188 @@
+from rest_framework import status, permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from django.contrib.auth import get_user_model
+
+from posts.models import Post
+from posts.serializers import PostListSerializer
+from tieba.models import Tieba
+from tieba.serializers import TiebaSerializer
+from users.serializers import UserSimpleSerializer
+
+from .backends import DOC_POST, DOC_TIEBA, DOC_USER
+from .indexer import load_in_order, search_ids
+from .query_log import WINDOWS, query_log
+from .suggestions import suggestion_service
+
+User = get_user_model()
+
+MAX_PAGE_SIZE = 50
+
+
+def get_keyword(request):
+    """搜索关键词，兼容 keyword 和 q 两种参数名"""
+    return (request.GET.get('keyword') or request.GET.get('q') or '').strip()
+
+
+def get_paging(request, default_size=20):
+    """解析 page / size 参数，返回 (page, size, offset)"""
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        size = min(max(int(request.GET.get('size', default_size)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        page, size = 1, default_size
+    return page, size, (page - 1) * size
+
+
+def get_session_key(request):
+    """用于相关搜索的会话标识：登录用户用ID，匿名用户用IP"""
+    if request.user.is_authenticated:
+        return f'u{request.user.id}'
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+    if x_forwarded_for:
+        return x_forwarded_for.split(',')[0]
+    return request.META.get('REMOTE_ADDR')
+
+
+def get_int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def _search_posts(request, keyword, page, size, offset):
+    filters = {
+        'tieba_id': get_int_param(request, 'tieba'),
+        'author_id': get_int_param(request, 'author'),
+    }
+    sort = request.GET.get('sort', 'relevance')
+    total, ids = search_ids(DOC_POST, keyword, filters=filters, sort=sort, offset=offset, limit=size)
+    posts = load_in_order(Post.objects.filter(status=1).select_related('author', 'tieba'), ids)
+    return {
+        'count': total,
+        'page': page,
+        'size': size,
+        'results': PostListSerializer(posts, many=True, context={'request': request}).data,
+    }
+
+
+def _search_tieba(request, keyword, page, size, offset):
+    filters = {'category_id': get_int_param(request, 'category')}
+    total, ids = search_ids(DOC_TIEBA, keyword, filters=filters, offset=offset, limit=size)
+    tiebas = load_in_order(Tieba.objects.visible(), ids)
+    return {
+        'count': total,
+        'page': page,
+        'size': size,
+        'results': TiebaSerializer(tiebas, many=True, context={'request': request}).data,
+    }
+
+
+def _search_users(request, keyword, page, size, offset):
+    total, ids = search_ids(DOC_USER, keyword, offset=offset, limit=size)
+    users = load_in_order(User.objects.filter(status=1), ids)
+    return {
+        'count': total,
+        'page': page,
+        'size': size,
+        'results': UserSimpleSerializer(users, many=True).data,
+    }
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_all(request):
+    """综合搜索：分页的帖子结果，以及第一页附带的贴吧、用户"""
+    keyword = get_keyword(request)
+    if not keyword:
+        return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+    query_log.record(keyword, get_session_key(request))
+    page, size, offset = get_paging(request)
+    data = {'keyword': keyword, 'posts': _search_posts(request, keyword, page, size, offset)}
+    if page == 1:
+        data['tiebas'] = _search_tieba(request, keyword, 1, 5, 0)['results']
+        data['users'] = _search_users(request, keyword, 1, 5, 0)['results']
+    return Response(data)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_posts(request):
+    """搜索帖子"""
+    keyword = get_keyword(request)
+    if not keyword:
+        return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+    query_log.record(keyword, get_session_key(request))
+    return Response(_search_posts(request, keyword, *get_paging(request)))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_tieba(request):
+    """搜索贴吧"""
+    keyword = get_keyword(request)
+    if not keyword:
+        return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+    query_log.record(keyword, get_session_key(request))
+    return Response(_search_tieba(request, keyword, *get_paging(request)))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_users(request):
+    """搜索用户"""
+    keyword = get_keyword(request)
+    if not keyword:
+        return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
+
+    query_log.record(keyword, get_session_key(request))
+    return Response(_search_users(request, keyword, *get_paging(request)))
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_suggestions(request):
+    """搜索建议"""
+    prefix = get_keyword(request)
+    if not prefix:
+        return Response({'suggestions': []})
+    
+    suggestions = suggestion_service.suggest(prefix)
+    return Response({'suggestions': [
+        {'text': item.text, 'type': item.type, 'id': item.id} for item in suggestions
+    ]})
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def hot_searches(request):
+    """热搜榜"""
+    window = request.GET.get('window', '24h')
+    if window not in WINDOWS:
+        return Response({'error': '不支持的时间窗口'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = min(get_int_param(request, 'limit') or 10, MAX_PAGE_SIZE)
+    
+    return Response({
+        'window': window,
+        'hot_searches': [
+            {'keyword': keyword, 'count': count} for keyword, count in query_log.top(window, limit)
+        ],
+    })
+
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def related_searches(request):
+    """相关搜索"""
+    keyword = get_keyword(request)
+    if not keyword:
+        return Response({'related': []})
+    limit = min(get_int_param(request, 'limit') or 10, MAX_PAGE_SIZE)
+    
+    return Response({
+        'related': [keyword for keyword, _ in query_log.related(keyword, limit)],
+    })
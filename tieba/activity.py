@@ -0,0 +1,228 @@
+"""
+贴吧活跃度计数
+
+发帖、评论时调用 tieba_activity.record(tieba_id, event)，计数先在进程内累加，
+由后台线程按 TIEBA_ACTIVITY_FLUSH_INTERVAL 批量写入按小时分桶的存储：
+    memory  进程内计数，适合单进程部署和开发环境
+    redis   每个 (事件, 小时) 一个哈希，多进程共享
+读取时不逐次聚合：每隔 TIEBA_ACTIVITY_SNAPSHOT_SECONDS 秒汇总一次
+近 24 小时各贴吧的发帖、评论数和热门贴吧排名，hot_tiebas 和 TiebaSerializer 直接读取快照。
+
+Tieba.today_post_count 在每天零点（TIME_ZONE，即 Asia/Shanghai）重置为当天零点以来的发帖数，
+只支持 redis 存储：由 rollover_tieba_activity 定时任务执行，服务的后台线程跨过零点时也会尝试一次。
+memory 存储下每个进程只有自己启动以来的计数，重置会写入不完整的总数，因此跳过并记录警告。
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from tieba_project.background import BackgroundBatcher
+
+logger = logging.getLogger(__name__)
+
+HOUR = 60 * 60
+# 滚动窗口与保留的小时桶数（需覆盖到前一天零点）
+WINDOW_HOURS = 24
+KEEP_HOURS = 48
+
+EVENT_POST = 'post'
+EVENT_COMMENT = 'comment'
+EVENTS = (EVENT_POST, EVENT_COMMENT)
+
+# 热门贴吧排名中各事件的权重
+HOT_WEIGHTS = {
+    EVENT_POST: 3,
+    EVENT_COMMENT: 1,
+}
+
+ROLLOVER_LOCK_KEY = 'tieba:activity:rollover:{date}'
+
+ActivitySnapshot = namedtuple('ActivitySnapshot', ['stats', 'hot', 'expires_at'])
+
+
+def hour_start(timestamp):
+    return int(timestamp) // HOUR * HOUR
+
+
+def local_midnight(now=None):
+    """当地时区当天零点的时间戳"""
+    local = timezone.localtime(timezone.now() if now is None else now)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+class MemoryActivityStore:
+    """进程内小时桶存储"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = defaultdict(dict)
+
+    def apply(self, counts):
+        """counts: {(事件, 小时起点, 贴吧ID): 次数}"""
+        with self._lock:
+            for (event, start, tieba_id), amount in counts.items():
+                self._buckets[event].setdefault(start, Counter())[tieba_id] += amount
+            oldest = hour_start(time.time()) - KEEP_HOURS * HOUR
+            for buckets in self._buckets.values():
+                for start in [s for s in buckets if s < oldest]:
+                    del buckets[start]
+
+    def totals(self, event, starts):
+        total = Counter()
+        with self._lock:
+            for start in starts:
+                total.update(self._buckets[event].get(start, {}))
+        return total
+
+
+class RedisActivityStore:
+    """基于 Redis 哈希的小时桶存储"""
+
+    PREFIX = 'tieba:activity'
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def _key(self, event, start):
+        return f'{self.PREFIX}:{event}:{start}'
+
+    def apply(self, counts):
+        pipe = self._client.pipeline(transaction=False)
+        for (event, start, tieba_id), amount in counts.items():
+            key = self._key(event, start)
+            pipe.hincrby(key, tieba_id, amount)
+            pipe.expire(key, (KEEP_HOURS + 1) * HOUR)
+        pipe.execute()
+
+    def totals(self, event, starts):
+        pipe = self._client.pipeline(transaction=False)
+        for start in starts:
+            pipe.hgetall(self._key(event, start))
+        total = Counter()
+        for bucket in pipe.execute():
+            total.update({int(k): int(v) for k, v in bucket.items()})
+        return total
+
+
+class TiebaActivity:
+    """贴吧活跃度计数器"""
+
+    def __init__(self, store, flush_interval, snapshot_seconds, hot_size=100):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.snapshot_seconds = snapshot_seconds
+        self.hot_size = hot_size
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._last_rollover = timezone.localdate()
+        self._batcher = BackgroundBatcher(
+            'tieba-activity', self._tick, flush_interval, '写入贴吧活跃度计数失败'
+        )
+
+    def record(self, tieba_id, event, amount=1):
+        """记录一次发帖或评论，不阻塞请求"""
+        with self._lock:
+            self._pending[(event, hour_start(time.time()), tieba_id)] += amount
+        self._batcher.start()
+
+    def flush(self):
+        """把进程内的计数写入存储，返回写入的计数项数"""
+        with self._lock:
+            counts, self._pending = self._pending, Counter()
+        if not counts:
+            return 0
+        try:
+            self.store.apply(counts)
+        except Exception:
+            with self._lock:
+                self._pending.update(counts)
+            raise
+        return len(counts)
+
+    def stats(self, tieba_id):
+        """贴吧近 24 小时的发帖、评论数"""
+        return self.snapshot().stats.get(tieba_id) or {'post_count_24h': 0, 'comment_count_24h': 0}
+
+    def hot(self, limit=20):
+        """近 24 小时最活跃的贴吧ID"""
+        return self.snapshot().hot[:limit]
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.expires_at <= time.monotonic():
+            snapshot = self._snapshot = self._build_snapshot()
+        return snapshot
+
+    def _build_snapshot(self):
+        current = hour_start(time.time())
+        starts = [current - i * HOUR for i in range(WINDOW_HOURS)]
+        posts = self.store.totals(EVENT_POST, starts)
+        comments = self.store.totals(EVENT_COMMENT, starts)
+        stats = {
+            tieba_id: {'post_count_24h': posts[tieba_id], 'comment_count_24h': comments[tieba_id]}
+            for tieba_id in posts.keys() | comments.keys()
+        }
+        scores = Counter()
+        for event, totals in ((EVENT_POST, posts), (EVENT_COMMENT, comments)):
+            for tieba_id, amount in totals.items():
+                scores[tieba_id] += amount * HOT_WEIGHTS[event]
+        hot = [tieba_id for tieba_id, _ in scores.most_common(self.hot_size)]
+        return ActivitySnapshot(stats, hot, time.monotonic() + self.snapshot_seconds)
+
+    def rollover(self, force=False):
+        """把 Tieba.today_post_count 重置为当天零点以来的发帖数，每天只执行一次"""
+        from .models import Tieba
+
+        today = timezone.localdate()
+        if not force and not cache.add(ROLLOVER_LOCK_KEY.format(date=today), 1, 2 * 24 * HOUR):
+            self._last_rollover = today
+            return False
+        self.flush()
+        midnight = local_midnight()
+        starts = range(int(midnight), hour_start(time.time()) + 1, HOUR)
+        today_posts = self.store.totals(EVENT_POST, starts)
+
+        Tieba.objects.exclude(id__in=today_posts).filter(today_post_count__gt=0).update(today_post_count=0)
+        groups = defaultdict(list)
+        for tieba_id, amount in today_posts.items():
+            groups[amount].append(tieba_id)
+        for amount, tieba_ids in groups.items():
+            Tieba.objects.filter(id__in=tieba_ids).update(today_post_count=amount)
+        self._last_rollover = today
+        return True
+
+    def _tick(self):
+        """后台线程定期执行：写入计数，跨过零点后重置今日帖子数"""
+        flushed = self.flush()
+        today = timezone.localdate()
+        if today != self._last_rollover:
+            if isinstance(self.store, MemoryActivityStore):
+                logger.warning('TIEBA_ACTIVITY_BACKEND 为 memory，跳过今日帖子数重置，需要重置时改用 redis')
+                self._last_rollover = today
+            else:
+                self.rollover()
+        return flushed
+
+
+def _build_activity():
+    if getattr(settings, 'TIEBA_ACTIVITY_BACKEND', 'memory') == 'redis':
+        store = RedisActivityStore(settings.REDIS_URL)
+    else:
+        store = MemoryActivityStore()
+    return TiebaActivity(
+        store,
+        flush_interval=getattr(settings, 'TIEBA_ACTIVITY_FLUSH_INTERVAL', 5),
+        snapshot_seconds=getattr(settings, 'TIEBA_ACTIVITY_SNAPSHOT_SECONDS', 60),
+    )
+
+
+tieba_activity = _build_activity()
+
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class TiebaConfig(AppConfig):
+    """贴吧应用"""
+    
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'tieba'
+    verbose_name = '贴吧'
+    
+    def ready(self):
+        from tieba_project.response_cache import connect_signals
+        connect_signals()
+        from .membership import connect_signals as connect_membership_signals
+        connect_membership_signals()
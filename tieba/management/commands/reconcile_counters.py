@@ -0,0 +1,52 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tieba_project.reconcile import COUNTERS, get_last_run, reconcile, set_last_run
+
+# 增量对账向前多检查的时间，覆盖上次对账时尚未提交的事务
+INCREMENTAL_OVERLAP = timedelta(minutes=10)
+
+
+class Command(BaseCommand):
+    """从源表重新统计反范式计数字段，报告并修正偏差"""
+
+    help = '对账贴吧、帖子、评论、用户的计数字段'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='全量对账（默认只检查上次对账后有变化的行）')
+        parser.add_argument('--dry-run', action='store_true', help='只报告偏差不修改')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='每批对账的目标行数')
+        parser.add_argument('--only', nargs='+', metavar='NAME',
+                            help='只对账指定计数，可选: ' + ', '.join(spec.name for spec in COUNTERS))
+
+    def handle(self, *args, **options):
+        specs = COUNTERS
+        if options['only']:
+            specs = [spec for spec in COUNTERS if spec.name in options['only']]
+            unknown = set(options['only']) - {spec.name for spec in specs}
+            if unknown:
+                raise CommandError(f'未知的计数: {", ".join(sorted(unknown))}')
+
+        started_at = timezone.now()
+        last_run = None if options['full'] else get_last_run()
+        since = last_run - INCREMENTAL_OVERLAP if last_run else None
+        self.stdout.write('全量对账' if since is None else f'增量对账，检查 {since:%Y-%m-%d %H:%M:%S} 之后的变化')
+
+        dry_run = options['dry_run']
+        reports = reconcile(specs, since=since, fix=not dry_run, chunk_size=options['chunk_size'])
+        for report in reports:
+            line = (f'{report.spec.name}: 检查 {report.checked} 行，偏差 {report.drifted} 行，'
+                    f'累计偏差 {report.total_drift}，修正 {report.fixed} 行')
+            self.stdout.write(self.style.WARNING(line) if report.drifted else line)
+            for pk, current, expected in report.samples:
+                self.stdout.write(f'    #{pk}: {current} -> {expected}')
+
+        # 只有完整覆盖全部计数的对账才推进增量起点
+        if not dry_run and specs is COUNTERS:
+            set_last_run(started_at)
+        prefix = '[dry-run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}对账完成，共 {sum(r.drifted for r in reports)} 行存在偏差'
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tieba.activity import MemoryActivityStore, tieba_activity
+
+
+class Command(BaseCommand):
+    """重置贴吧今日帖子数，建议在每天零点（Asia/Shanghai）后由定时任务执行"""
+
+    help = '把 Tieba.today_post_count 重置为当天零点以来的发帖数（需要 TIEBA_ACTIVITY_BACKEND=redis）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='当天已执行过也重新执行')
+
+    def handle(self, *args, **options):
+        if isinstance(tieba_activity.store, MemoryActivityStore):
+            # 命令进程的内存计数是空的，执行会把今日帖子数清零，还会占用当天的锁使服务内的重置被跳过
+            raise CommandError('TIEBA_ACTIVITY_BACKEND 为 memory，计数只在服务进程内，今日帖子数由服务的后台线程重置')
+
+        if tieba_activity.rollover(force=options['force']):
+            self.stdout.write(self.style.SUCCESS('今日帖子数已重置'))
+        else:
+            self.stdout.write('今天已经重置过，使用 --force 重新执行')
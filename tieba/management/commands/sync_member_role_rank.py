@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tieba.models import TiebaMember
+
+
+class Command(BaseCommand):
+    """根据 role 回填 TiebaMember.role_rank（新增字段后或直接改库后执行）"""
+
+    help = '同步贴吧成员的角色排序值'
+
+    def handle(self, *args, **options):
+        total = 0
+        for role, rank in TiebaMember.ROLE_RANKS.items():
+            total += TiebaMember.objects.filter(role=role).exclude(role_rank=rank).update(role_rank=rank)
+        # 未知角色按普通成员处理
+        total += TiebaMember.objects.exclude(
+            Q(role__in=TiebaMember.ROLE_RANKS) | Q(role_rank=TiebaMember.MEMBER_RANK)
+        ).update(role_rank=TiebaMember.MEMBER_RANK)
+        self.stdout.write(self.style.SUCCESS(f'更新成员 {total} 条'))
@@ -0,0 +1,107 @@
+"""
+当前用户的贴吧成员关系
+
+用户加入的全部贴吧以 {tieba_id: role} 的形式缓存在 Django cache 中，
+同一请求内再存放到序列化器 context，TiebaSerializer 的 is_member / member_role
+都从这一份映射中读取。
+
+贴吧的管理团队（吧主、大吧主、小吧主）人数很少，单独缓存为成员对象列表，
+成员列表第一页直接取用，不查询成员表。
+
+TiebaMember 保存或删除后（事务提交时）由信号失效这两份缓存，加入、离开、任免、后台修改都经过这里；
+只更新计数字段的 save(update_fields=...) 和 QuerySet.update 不触发失效。
+
+两份缓存的键都带 response_cache 的范围版本号，失效时更新版本号而不是删除键：
+失效前开始、失效后才写入的填充只会写到旧版本的键上，不会再被读到。
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from tieba_project.cache_fill import get_or_fill
+from tieba_project.response_cache import bump, get_versions
+
+from .models import TiebaMember
+
+MEMBER_ROLES_SCOPE = 'member_roles:{user_id}'
+MEMBER_ROLES_CACHE_KEY = 'tieba:member_roles:{user_id}:{version}'
+MEMBER_ROLES_CACHE_TIMEOUT = 60 * 10
+TIEBA_STAFF_SCOPE = 'tieba_staff:{tieba_id}'
+TIEBA_STAFF_CACHE_KEY = 'tieba:staff:{tieba_id}:{version}'
+TIEBA_STAFF_CACHE_TIMEOUT = 60 * 10
+
+# 影响成员关系映射和管理团队的字段
+TRACKED_FIELDS = {'role', 'role_rank', 'is_active', 'joined_at', 'tieba', 'user'}
+
+
+def member_roles_key(user_id):
+    version, = get_versions([MEMBER_ROLES_SCOPE.format(user_id=user_id)])
+    return MEMBER_ROLES_CACHE_KEY.format(user_id=user_id, version=version)
+
+
+def load_member_roles(user_id):
+    """获取用户的 {tieba_id: role} 映射，优先读取缓存"""
+    return get_or_fill(
+        member_roles_key(user_id),
+        lambda: dict(
+            TiebaMember.objects.filter(user_id=user_id, is_active=True)
+            .values_list('tieba_id', 'role')
+        ),
+        MEMBER_ROLES_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_member_roles(user_id):
+    """成员关系变化后使缓存失效"""
+    bump(MEMBER_ROLES_SCOPE.format(user_id=user_id))
+
+
+def tieba_staff_key(tieba_id):
+    version, = get_versions([TIEBA_STAFF_SCOPE.format(tieba_id=tieba_id)])
+    return TIEBA_STAFF_CACHE_KEY.format(tieba_id=tieba_id, version=version)
+
+
+def load_tieba_staff(tieba_id):
+    """获取贴吧管理团队（按角色、加入时间排序），优先读取缓存"""
+    return get_or_fill(
+        tieba_staff_key(tieba_id),
+        lambda: list(
+            TiebaMember.objects.filter(
+                tieba_id=tieba_id, is_active=True, role_rank__lt=TiebaMember.MEMBER_RANK
+            ).select_related('user').order_by('role_rank', 'joined_at', 'id')
+        ),
+        TIEBA_STAFF_CACHE_TIMEOUT,
+    )
+
+
+def invalidate_tieba_staff(tieba_id):
+    """管理团队变化后使缓存失效"""
+    bump(TIEBA_STAFF_SCOPE.format(tieba_id=tieba_id))
+
+
+def _member_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not TRACKED_FIELDS.intersection(update_fields):
+        return
+    user_id, tieba_id = instance.user_id, instance.tieba_id
+
+    def invalidate():
+        invalidate_member_roles(user_id)
+        invalidate_tieba_staff(tieba_id)
+
+    transaction.on_commit(invalidate)
+
+
+def connect_signals():
+    post_save.connect(_member_changed, sender=TiebaMember, dispatch_uid='tieba_member_changed_save')
+    post_delete.connect(_member_changed, sender=TiebaMember, dispatch_uid='tieba_member_changed_delete')
+
+
+def get_member_roles(context):
+    """从序列化器 context 中获取当前请求用户的成员关系映射，匿名用户返回空映射"""
+    if 'member_roles' not in context:
+        request = context.get('request')
+        if request and request.user.is_authenticated:
+            context['member_roles'] = load_member_roles(request.user.id)
+        else:
+            context['member_roles'] = {}
+    return context['member_roles']
@@ -25,6 +25,14 @@ class Category(models.Model):
         return self.name
 
 
+class TiebaQuerySet(models.QuerySet):
+    """贴吧查询集"""
+    
+    def visible(self):
+        """正常状态的贴吧，预先关联吧主和分类供列表序列化使用"""
+        return self.filter(status=1).select_related('owner', 'category')
+
+
 class Tieba(models.Model):
     """贴吧模型"""
     
@@ -64,6 +72,8 @@ class Tieba(models.Model):
     updated_at = models.DateTimeField('更新时间', auto_now=True)
     last_activity_at = models.DateTimeField('最后活动时间', null=True, blank=True)
     
+    objects = TiebaQuerySet.as_manager()
+    
     class Meta:
         db_table = 'tieba'
         verbose_name = '贴吧'
@@ -94,9 +104,19 @@ class TiebaMember(models.Model):
         ('owner', '吧主'),
     ]
     
+    # 角色排序值，越小越靠前；由 save() 根据 role 维护，供数据库端排序
+    ROLE_RANKS = {
+        'owner': 0,
+        'admin': 1,
+        'moderator': 2,
+        'member': 3,
+    }
+    MEMBER_RANK = ROLE_RANKS['member']
+    
     tieba = models.ForeignKey(Tieba, on_delete=models.CASCADE, related_name='members')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tieba_memberships')
     role = models.CharField('角色', max_length=20, choices=ROLE_CHOICES, default='member')
+    role_rank = models.PositiveSmallIntegerField('角色排序', default=MEMBER_RANK, editable=False)
     
     # 成员信息
     join_reason = models.CharField('加入理由', max_length=200, null=True, blank=True)
@@ -118,10 +138,22 @@ class TiebaMember(models.Model):
         indexes = [
             models.Index(fields=['tieba', 'role']),
             models.Index(fields=['user', 'joined_at']),
+            models.Index(fields=['tieba', 'is_active', 'role_rank', 'joined_at', 'id']),
         ]
     
     def __str__(self):
         return f"{self.user.username} - {self.tieba.name}"
+    
+    @property
+    def is_staff(self):
+        return self.role_rank < self.MEMBER_RANK
+    
+    def save(self, *args, **kwargs):
+        self.role_rank = self.ROLE_RANKS.get(self.role, self.MEMBER_RANK)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'role' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'role_rank'}
+        super().save(*args, **kwargs)
 
 
 class TiebaAnnouncement(models.Model):
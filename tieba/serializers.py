@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from .models import Category, Tieba, TiebaMember, TiebaAnnouncement, TiebaApply
-from users.serializers import UserSerializer
+from users.serializers import UserSerializer, UserSimpleSerializer
+from .activity import tieba_activity
+from .membership import get_member_roles
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -11,12 +13,21 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'icon', 'sort_order', 'is_active']
 
 
+class TiebaSimpleSerializer(serializers.ModelSerializer):
+    """贴吧简要信息序列化器"""
+    
+    class Meta:
+        model = Tieba
+        fields = ['id', 'name', 'avatar']
+
+
 class TiebaSerializer(serializers.ModelSerializer):
     """贴吧序列化器"""
-    owner = UserSerializer(read_only=True)
+    owner = UserSimpleSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     is_member = serializers.SerializerMethodField()
     member_role = serializers.SerializerMethodField()
+    activity = serializers.SerializerMethodField()
     
     class Meta:
         model = Tieba
@@ -24,27 +35,21 @@ class TiebaSerializer(serializers.ModelSerializer):
             'id', 'name', 'description', 'avatar', 'banner', 'owner', 'category',
             'member_count', 'post_count', 'today_post_count', 'total_view_count',
             'status', 'is_recommended', 'is_official', 'join_rule', 'post_rule',
-            'created_at', 'updated_at', 'last_activity_at', 'is_member', 'member_role'
+            'created_at', 'updated_at', 'last_activity_at', 'is_member', 'member_role',
+            'activity'
         ]
     
     def get_is_member(self, obj):
         """检查当前用户是否为该贴吧成员"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return TiebaMember.objects.filter(
-                tieba=obj, user=request.user, is_active=True
-            ).exists()
-        return False
+        return obj.id in get_member_roles(self.context)
     
     def get_member_role(self, obj):
         """获取当前用户在贴吧中的角色"""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            member = TiebaMember.objects.filter(
-                tieba=obj, user=request.user, is_active=True
-            ).first()
-            return member.role if member else None
-        return None
+        return get_member_roles(self.context).get(obj.id)
+    
+    def get_activity(self, obj):
+        """近 24 小时的发帖、评论数，来自活跃度快照"""
+        return tieba_activity.stats(obj.id)
 
 
 class TiebaCreateSerializer(serializers.ModelSerializer):
@@ -63,7 +68,7 @@ class TiebaCreateSerializer(serializers.ModelSerializer):
 
 class TiebaMemberSerializer(serializers.ModelSerializer):
     """贴吧成员序列化器"""
-    user = UserSerializer(read_only=True)
+    user = UserSimpleSerializer(read_only=True)
     
     class Meta:
         model = TiebaMember
@@ -73,7 +78,7 @@ class TiebaMemberSerializer(serializers.ModelSerializer):
 
 class TiebaAnnouncementSerializer(serializers.ModelSerializer):
     """贴吧公告序列化器"""
-    author = UserSerializer(read_only=True)
+    author = UserSimpleSerializer(read_only=True)
     
     class Meta:
         model = TiebaAnnouncement
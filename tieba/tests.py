@@ -0,0 +1,227 @@
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from comments.models import Comment
+from posts.models import Post
+from tieba_project.background import flush_all
+from tieba_project.cache_fill import store
+from tieba_project.likes import like_engine
+from tieba_project.pagination import KeysetPagination
+from tieba_project.reconcile import reconcile
+from users.models import User
+
+from .activity import ROLLOVER_LOCK_KEY, MemoryActivityStore, TiebaActivity
+from .membership import (
+    MEMBER_ROLES_CACHE_TIMEOUT, invalidate_member_roles, load_member_roles, member_roles_key
+)
+from .models import Category, Tieba, TiebaMember
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReconcileTests(TransactionTestCase):
+    """应用写入的计数与对账的统计口径一致"""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='password', email='owner@example.com')
+        self.user = User.objects.create_user(username='user', password='password', email='user@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.owner, category=category, status=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        flush_all()
+
+    def drift(self):
+        return {report.spec.name: report.drifted for report in reconcile(fix=False) if report.drifted}
+
+    def test_clean_run_reports_no_drift_after_create_and_delete(self):
+        client = self.client
+        self.assertEqual(client.post(reverse('join-tieba', args=[self.tieba.id])).status_code, 200)
+        self.assertEqual(client.post(reverse('follow-user', args=[self.owner.id])).status_code, 200)
+
+        # 未发布即删除、发布后删除、保持发布的帖子
+        draft = Post.objects.create(title='草稿', content='内容', author=self.user, tieba=self.tieba)
+        client.delete(reverse('post-delete', args=[draft.id]))
+        removed = Post.objects.create(title='删除', content='内容', author=self.user, tieba=self.tieba, status=1)
+        client.delete(reverse('post-delete', args=[removed.id]))
+        post = Post.objects.create(title='帖子', content='内容', author=self.user, tieba=self.tieba, status=1)
+
+        # 未发布即删除的评论、已发布的评论和楼中楼回复、发布后删除的回复
+        for _ in range(2):
+            response = client.post(reverse('comment-create'), {'post': post.id, 'content': '评论'})
+            self.assertEqual(response.status_code, 201)
+        hidden, comment = Comment.objects.filter(post=post).order_by('id')
+        client.delete(reverse('comment-delete', args=[hidden.id]))
+        comment.status = 1
+        comment.save()
+        for _ in range(2):
+            Comment.objects.create(post=post, parent=comment, author=self.user, content='回复', status=1)
+        client.delete(reverse('comment-delete', args=[Comment.objects.filter(parent=comment).last().id]))
+
+        client.post(reverse('post-like', args=[post.id]))
+        client.post(reverse('post-collect', args=[post.id]))
+        client.post(reverse('comment-like', args=[comment.id]))
+        like_engine.flush()
+
+        self.assertEqual(self.drift(), {})
+        post.refresh_from_db()
+        self.assertEqual((post.reply_count, post.like_count, post.collect_count), (2, 1, 1))
+
+    def test_drift_is_reported_and_fixed(self):
+        Post.objects.create(title='帖子', content='内容', author=self.user, tieba=self.tieba, status=1)
+        Tieba.objects.filter(pk=self.tieba.pk).update(post_count=5)
+        User.objects.filter(pk=self.user.pk).update(post_count=0)
+
+        self.assertEqual(self.drift(), {'tieba.post_count': 1, 'user.post_count': 1})
+        reconcile()
+        self.assertEqual(self.drift(), {})
+        self.assertEqual(Tieba.objects.values_list('post_count', flat=True).get(pk=self.tieba.pk), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RolloverCommandTests(TestCase):
+    """内存存储下命令拒绝执行、后台线程跳过重置，不清零今日帖子数也不占用当天的锁"""
+
+    def test_refuses_with_memory_store(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='password', email='owner@example.com')
+        category = Category.objects.create(name='category')
+        tieba = Tieba.objects.create(name='tieba', owner=owner, category=category, status=1, today_post_count=3)
+
+        with self.assertRaises(CommandError):
+            call_command('rollover_tieba_activity', force=True)
+        tieba.refresh_from_db()
+        self.assertEqual(tieba.today_post_count, 3)
+        self.assertIsNone(cache.get(ROLLOVER_LOCK_KEY.format(date=timezone.localdate())))
+
+    def test_automatic_rollover_is_skipped_with_memory_store(self):
+        cache.clear()
+        owner = User.objects.create_user(username='owner', password='password', email='owner@example.com')
+        tieba = Tieba.objects.create(name='tieba', owner=owner, status=1, today_post_count=3)
+        activity = TiebaActivity(MemoryActivityStore(), flush_interval=60, snapshot_seconds=60)
+        activity._last_rollover = timezone.localdate() - timezone.timedelta(days=1)
+
+        with self.assertLogs('tieba.activity', 'WARNING'):
+            activity._tick()
+        tieba.refresh_from_db()
+        self.assertEqual(tieba.today_post_count, 3)
+        self.assertEqual(activity._last_rollover, timezone.localdate())
+        self.assertIsNone(cache.get(ROLLOVER_LOCK_KEY.format(date=timezone.localdate())))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TiebaListQueryTests(TestCase):
+    """贴吧列表的查询数与页大小无关"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='user', password='password', email='user@example.com')
+        for i in range(30):
+            owner = User.objects.create_user(username=f'owner{i}', password='password', email=f'owner{i}@example.com')
+            category = Category.objects.create(name=f'category{i}')
+            tieba = Tieba.objects.create(name=f'tieba{i}', owner=owner, category=category, status=1, member_count=i)
+            if i % 3 == 0:
+                TiebaMember.objects.create(tieba=tieba, user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def list_tiebas(self, page_size):
+        cache.clear()
+        response = self.client.get(reverse('tieba-list'), {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return response
+
+    def test_query_count_is_constant(self):
+        with CaptureQueriesContext(connection) as small:
+            self.list_tiebas(3)
+        with self.assertNumQueries(len(small)):
+            response = self.list_tiebas(30)
+        members = [tieba['is_member'] for tieba in response.data['results']]
+        self.assertEqual(members.count(True), 10)
+
+
+    def test_pages_walk_the_ranking_with_an_approximate_count(self):
+        cache.clear()
+        url = reverse('tieba-list')
+        response = self.client.get(url, {'page_size': 8})
+        self.assertEqual(response.data['count'], 30)
+        # 总数缓存在翻页期间保持不变；排名升到游标之前的贴吧（这里是新建的）在本轮翻页中被跳过
+        Tieba.objects.create(name='new', owner=self.user, status=1, member_count=100)
+
+        names = [tieba['name'] for tieba in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.data['count'], 30)
+            names += [tieba['name'] for tieba in response.data['results']]
+        self.assertEqual(names, [f'tieba{i}' for i in range(29, -1, -1)])
+
+    def test_count_is_null_when_not_provided(self):
+        paginator = KeysetPagination(('-member_count', '-post_count', '-id'))
+        self.assertIsNone(paginator.get_paginated_response([]).data['count'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MemberRolesCacheTests(TestCase):
+    """失效后，失效前开始的填充晚写入也不会被读到"""
+
+    def test_late_fill_after_invalidation_is_ignored(self):
+        cache.clear()
+        user = User.objects.create_user(username='user', password='password', email='user@example.com')
+        tieba = Tieba.objects.create(name='tieba', owner=user, status=1)
+        self.assertEqual(load_member_roles(user.id), {})
+        stale_key = member_roles_key(user.id)
+
+        TiebaMember.objects.create(tieba=tieba, user=user, role='member')
+        invalidate_member_roles(user.id)
+        # 失效前开始的填充此时才写回旧结果
+        store(stale_key, {}, MEMBER_ROLES_CACHE_TIMEOUT)
+
+        self.assertNotEqual(member_roles_key(user.id), stale_key)
+        self.assertEqual(load_member_roles(user.id), {tieba.id: 'member'})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TiebaStaffCacheTests(TestCase):
+    """成员保存或删除后，成员列表中缓存的管理团队随之更新"""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user(username='owner', password='password', email='owner@example.com')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.owner, status=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            TiebaMember.objects.create(tieba=self.tieba, user=self.owner, role='owner')
+            user = User.objects.create_user(username='member', password='password', email='member@example.com')
+            self.member = TiebaMember.objects.create(tieba=self.tieba, user=user)
+
+    def roles(self):
+        response = APIClient().get(reverse('tieba-members', args=[self.tieba.id]))
+        return [(item['user']['username'], item['role']) for item in response.data['results']]
+
+    def test_role_change_and_removal_refresh_the_staff_list(self):
+        self.assertEqual(self.roles(), [('owner', 'owner'), ('member', 'member')])
+
+        self.member.role = 'moderator'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.save(update_fields=['role'])
+        self.assertEqual(self.roles(), [('owner', 'owner'), ('member', 'moderator')])
+        self.assertEqual(load_member_roles(self.member.user_id), {self.tieba.id: 'moderator'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            TiebaMember.objects.filter(pk=self.member.pk).delete()
+        self.assertEqual(self.roles(), [('owner', 'owner')])
+        self.assertEqual(load_member_roles(self.member.user_id), {})
+
+    def test_counter_saves_keep_the_cache(self):
+        self.roles()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.member.save(update_fields=['post_count'])
+        self.assertEqual(callbacks, [])
@@ -4,7 +4,7 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.db.models import Q
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 
@@ -14,7 +14,15 @@ from .serializers import (
     TiebaMemberSerializer, TiebaAnnouncementSerializer, 
     TiebaApplySerializer, TiebaApplyCreateSerializer
 )
-from users.models import UserActivity
+from users.activity_log import activity_logger
+from .activity import tieba_activity
+from .membership import load_member_roles, load_tieba_staff
+from search.backends import DOC_TIEBA
+from search.indexer import load_in_order, search_ids
+from tieba_project.conditional import conditional
+from tieba_project.counters import add_relation, counter, remove_relation
+from tieba_project.pagination import KeysetPagination, cached_count
+from tieba_project.response_cache import cache_anonymous_response, get_versions
 
 
 class CategoryListView(APIView):
@@ -22,6 +30,7 @@ class CategoryListView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(cache_anonymous_response(['category']))
     def get(self, request):
         """获取分类列表"""
         categories = Category.objects.filter(is_active=True).order_by('sort_order')
@@ -36,33 +45,28 @@ class TiebaListView(APIView):
     
     def get(self, request):
         """获取贴吧列表"""
-        tiebas = Tieba.objects.filter(status=1).order_by('-member_count', '-post_count')
+        tiebas = Tieba.objects.visible()
         
         # 支持搜索和过滤
         search_query = request.GET.get('q', '')
         category_id = request.GET.get('category')
         
-        if search_query:
-            tiebas = tiebas.filter(Q(name__icontains=search_query) | Q(description__icontains=search_query))
-        
         if category_id:
             tiebas = tiebas.filter(category_id=category_id)
         
-        # 分页
-        page = self.paginate_queryset(tiebas, request)
-        if page is not None:
-            serializer = TiebaSerializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        if search_query:
+            count, ids = search_ids(DOC_TIEBA, search_query, limit=settings.SEARCH_MAX_RESULTS)
+            tiebas = tiebas.filter(id__in=ids)
+        else:
+            count = cached_count(tiebas, f'tieba_list_count:{category_id}')
         
-        serializer = TiebaSerializer(tiebas, many=True, context={'request': request})
-        return Response(serializer.data)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
+        # 分页：按成员数排序是产品要求，但成员数和帖子数会在翻页期间变化，
+        # 游标只保证不重复扫描、不做 OFFSET，翻页期间排名变化的贴吧可能重复出现或被跳过，不保证快照一致；
+        # count 是按分类缓存 5 分钟的近似值（搜索时为索引命中数），不随翻页重新统计
+        paginator = KeysetPagination(('-member_count', '-post_count', '-id'))
+        page = paginator.paginate_queryset(tiebas, request)
+        serializer = TiebaSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data, count=count)
 
 
 class TiebaCreateView(APIView):
@@ -76,14 +80,13 @@ class TiebaCreateView(APIView):
             tieba = serializer.save(owner=request.user)
             
             # 创建者自动成为吧主
-            TiebaMember.objects.create(
-                tieba=tieba,
-                user=request.user,
-                role='owner'
+            add_relation(
+                TiebaMember, [counter(tieba, 'member_count')],
+                defaults={'role': 'owner'}, tieba=tieba, user=request.user
             )
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='tieba_create',
                 target_type='tieba',
@@ -98,15 +101,32 @@ class TiebaCreateView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def tieba_stamp(request, tieba_id):
+    """贴吧详情的版本戳：更新时间、计数、分类/贴吧范围版本、活跃度统计和当前用户的角色"""
+    row = Tieba.objects.visible().filter(id=tieba_id).values_list(
+        'updated_at', 'member_count', 'post_count', 'today_post_count', 'total_view_count', 'last_activity_at'
+    ).first()
+    if row is None:
+        return None
+    role = load_member_roles(request.user.id).get(tieba_id) if request.user.is_authenticated else None
+    parts = [
+        *row, role, *get_versions(['category', f'tieba:{tieba_id}']),
+        sorted(tieba_activity.stats(tieba_id).items()),
+    ]
+    return parts, row[0]
+
+
 class TiebaDetailView(APIView):
     """贴吧详情视图"""
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(conditional(tieba_stamp))
+    @method_decorator(cache_anonymous_response(lambda request, tieba_id: [f'tieba:{tieba_id}', 'category']))
     def get(self, request, tieba_id):
         """获取贴吧详情"""
         try:
-            tieba = Tieba.objects.get(id=tieba_id, status=1)
+            tieba = Tieba.objects.visible().get(id=tieba_id)
             serializer = TiebaSerializer(tieba, context={'request': request})
             return Response(serializer.data)
         except Tieba.DoesNotExist:
@@ -122,23 +142,16 @@ class JoinTiebaView(APIView):
         try:
             tieba = Tieba.objects.get(id=tieba_id, status=1)
             
-            # 检查是否已加入
-            if TiebaMember.objects.filter(tieba=tieba, user=request.user).exists():
-                return Response({'error': '已加入该贴吧'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 创建成员关系
-            member = TiebaMember.objects.create(
-                tieba=tieba,
-                user=request.user,
-                role='member'
+            # 创建成员关系并更新贴吧统计，已加入时唯一约束拦下重复插入
+            member, created = add_relation(
+                TiebaMember, [counter(tieba, 'member_count')],
+                defaults={'role': 'member'}, tieba=tieba, user=request.user
             )
-            
-            # 更新贴吧统计
-            tieba.member_count += 1
-            tieba.save()
+            if not created:
+                return Response({'error': '已加入该贴吧'}, status=status.HTTP_400_BAD_REQUEST)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='join_tieba',
                 target_type='tieba',
@@ -171,15 +184,12 @@ class LeaveTiebaView(APIView):
             if member.role == 'owner':
                 return Response({'error': '吧主不能离开贴吧'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # 删除成员关系
-            member.delete()
-            
-            # 更新贴吧统计
-            tieba.member_count -= 1
-            tieba.save()
+            # 删除成员关系并更新贴吧统计
+            if not remove_relation(TiebaMember, [counter(tieba, 'member_count')], pk=member.pk):
+                return Response({'error': '未加入该贴吧'}, status=status.HTTP_400_BAD_REQUEST)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='leave_tieba',
                 target_type='tieba',
@@ -198,32 +208,26 @@ class TiebaMembersView(APIView):
     permission_classes = [permissions.AllowAny]
     
     def get(self, request, tieba_id):
-        """获取贴吧成员列表"""
+        """获取贴吧成员列表，管理团队在前，其余成员按加入时间排序"""
         try:
             tieba = Tieba.objects.get(id=tieba_id)
-            members = TiebaMember.objects.filter(tieba=tieba, is_active=True).select_related('user')
             
-            # 按角色排序
-            role_order = {'owner': 0, 'admin': 1, 'moderator': 2, 'member': 3}
-            members = sorted(members, key=lambda x: role_order.get(x.role, 4))
+            # 普通成员沿 (tieba, is_active, role_rank, joined_at, id) 索引按游标翻页
+            members = TiebaMember.objects.filter(
+                tieba=tieba, is_active=True, role_rank=TiebaMember.MEMBER_RANK
+            ).select_related('user')
+            paginator = KeysetPagination(('joined_at', 'id'), page_size=50)
+            page = paginator.paginate_queryset(members, request)
             
-            page = self.paginate_queryset(members, request)
-            if page is not None:
-                serializer = TiebaMemberSerializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
+            # 管理团队来自缓存，只放在第一页
+            if not request.GET.get(paginator.cursor_query_param):
+                page = load_tieba_staff(tieba.id) + page
             
-            serializer = TiebaMemberSerializer(members, many=True)
-            return Response(serializer.data)
+            serializer = TiebaMemberSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data, count=tieba.member_count)
             
         except Tieba.DoesNotExist:
             return Response({'error': '贴吧不存在'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 50
-        return paginator.paginate_queryset(queryset, request)
 
 
 class TiebaAnnouncementsView(APIView):
@@ -231,13 +235,14 @@ class TiebaAnnouncementsView(APIView):
     
     permission_classes = [permissions.AllowAny]
     
+    @method_decorator(cache_anonymous_response(lambda request, tieba_id: [f'tieba:{tieba_id}']))
     def get(self, request, tieba_id):
         """获取贴吧公告列表"""
         try:
             tieba = Tieba.objects.get(id=tieba_id)
             announcements = TiebaAnnouncement.objects.filter(
                 tieba=tieba, is_active=True
-            ).order_by('-is_pinned', '-created_at')
+            ).select_related('author').order_by('-is_pinned', '-created_at')
             
             serializer = TiebaAnnouncementSerializer(announcements, many=True)
             return Response(serializer.data)
@@ -248,10 +253,11 @@ class TiebaAnnouncementsView(APIView):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_anonymous_response(['tieba'])
 def recommended_tiebas(request):
     """推荐贴吧"""
-    tiebas = Tieba.objects.filter(
-        status=1, is_recommended=True
+    tiebas = Tieba.objects.visible().filter(
+        is_recommended=True
     ).order_by('-member_count')[:10]
     
     serializer = TiebaSerializer(tiebas, many=True, context={'request': request})
@@ -260,9 +266,16 @@ def recommended_tiebas(request):
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
+@cache_anonymous_response(['tieba'], timeout=getattr(settings, 'TIEBA_ACTIVITY_SNAPSHOT_SECONDS', 60))
 def hot_tiebas(request):
-    """热门贴吧"""
-    tiebas = Tieba.objects.filter(status=1).order_by('-today_post_count', '-member_count')[:20]
+    """热门贴吧：近 24 小时最活跃的贴吧，不足时按成员数补齐"""
+    limit = 20
+    tiebas = load_in_order(Tieba.objects.visible(), tieba_activity.hot(limit))
+    if len(tiebas) < limit:
+        tiebas += list(
+            Tieba.objects.visible().exclude(id__in=[tieba.id for tieba in tiebas])
+            .order_by('-member_count')[:limit - len(tiebas)]
+        )
     
     serializer = TiebaSerializer(tiebas, many=True, context={'request': request})
     return Response({'hot_tiebas': serializer.data})
@@ -276,10 +289,8 @@ def search_tiebas(request):
     if not query:
         return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
     
-    tiebas = Tieba.objects.filter(
-        Q(name__icontains=query) | Q(description__icontains=query),
-        status=1
-    ).order_by('-member_count', '-post_count')
+    _, ids = search_ids(DOC_TIEBA, query, limit=20)
+    tiebas = load_in_order(Tieba.objects.visible(), ids)
     
-    serializer = TiebaSerializer(tiebas[:20], many=True, context={'request': request})
+    serializer = TiebaSerializer(tiebas, many=True, context={'request': request})
     return Response({'results': serializer.data})
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+后台批量写入
+
+浏览量、浏览历史、热度分、关注动态、贴吧活跃度、用户活动、点赞和搜索词日志
+在请求中只把数据放进各自的缓冲区，由 BackgroundBatcher 的后台线程每隔 interval 秒
+调用一次 flush 批量写入；缓冲区积压到批量大小时调用 wake() 提前写入。
+
+flush() 可在任意线程同步调用，与后台线程的写入互斥；stop() 停止后台线程并写完剩余数据。
+所有实例登记在进程内：flush_all() 供测试和管理命令同步写完全部缓冲，
+进程退出时依次 stop，内存中尚未写入的数据不会丢失。
+"""
+
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+_batchers = []
+_batchers_lock = threading.Lock()
+
+
+class BackgroundBatcher:
+    """按间隔在后台线程调用 flush 的批量写入器
+
+    flush 为写入函数，返回本次写入的条数；抛出异常时由调用方负责把数据放回缓冲区。
+    """
+
+    def __init__(self, name, flush, interval, error_message='后台批量写入失败'):
+        self.name = name
+        self.interval = interval
+        self.error_message = error_message
+        self._flush = flush
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        with _batchers_lock:
+            _batchers.append(self)
+
+    def start(self):
+        """确保后台线程在运行，向缓冲区写入数据后调用"""
+        if self._stopped or (self._worker is not None and self._worker.is_alive()):
+            return
+        with self._worker_lock:
+            if not self._stopped and (self._worker is None or not self._worker.is_alive()):
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def wake(self):
+        """不等间隔到期，立即在后台写入"""
+        self._wake.set()
+        self.start()
+
+    def flush(self):
+        """同步写入，返回写入的条数"""
+        with self._flush_lock:
+            return self._flush()
+
+    def stop(self, timeout=5):
+        """停止后台线程并写完剩余数据"""
+        self._stopped = True
+        self._wake.set()
+        worker = self._worker
+        if worker is not None and worker is not threading.current_thread():
+            worker.join(timeout)
+        return self.flush()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(self.error_message)
+            finally:
+                close_old_connections()
+
+
+def flush_all(rounds=3):
+    """同步写完全部缓冲
+
+    一个子系统的写入可能向另一个子系统产生数据（如点赞写入后重算热度分），
+    因此重复写入直到没有新数据，最多 rounds 轮。
+    """
+    for _ in range(rounds):
+        with _batchers_lock:
+            batchers = list(_batchers)
+        if not sum(batcher.flush() or 0 for batcher in batchers):
+            return
+
+
+@atexit.register
+def _stop_all():
+    """进程退出前停止后台线程，写入尚未写入的数据"""
+    with _batchers_lock:
+        batchers = list(_batchers)
+    for batcher in batchers:
+        try:
+            batcher.stop()
+        except Exception:
+            logger.exception('进程退出时写入失败: %s', batcher.name)
@@ -0,0 +1,303 @@
+"""
+两级缓存后端
+
+在共享缓存（默认为 Django 自带的 RedisCache）前加一层进程内 LRU：
+    读取先查本地，本地条目在 LOCAL_TIMEOUT 秒内视为新鲜，直接返回；
+    过期或未命中再读共享缓存并回填本地；get_many 只把本地未命中的键合并成一次请求。
+    写入、删除同时作用于两级，add / incr 以共享缓存的结果为准，保证跨进程的锁和计数正确。
+其他进程的修改最多在 LOCAL_TIMEOUT 秒后可见。
+
+降级：共享缓存报错或超时后，RETRY_INTERVAL 秒内不再访问它，
+读取返回本地条目，即使已过新鲜期，只要仍在 STALE_TIMEOUT 内；写入只写本地。
+
+本地 LRU 和统计数据在进程内各线程共享，stats() 返回命中、未命中、过期数据命中、
+错误次数和共享缓存的平均延迟。SHARED_BACKEND 可换成 LocMemCache，供测试和开发环境使用。
+"""
+
+import logging
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# LOCATION + KEY_PREFIX -> _TierState，同一进程内所有线程共享
+_states = {}
+_states_lock = threading.Lock()
+
+
+class _TierState:
+    """进程内共享的本地 LRU、统计数据和共享缓存的可用状态"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # 键 -> (序列化后的值, 新鲜期截止, 过期数据可用截止)
+        self.down_until = 0.0
+        self.counts = {
+            'local_hits': 0,
+            'shared_hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'errors': 0,
+            'shared_calls': 0,
+        }
+        self.shared_seconds = 0.0
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+
+class SharedCacheUnavailable(Exception):
+    """共享缓存暂时不可用"""
+
+
+class TwoTierCache(BaseCache):
+    """进程内 LRU + 共享缓存的两级缓存"""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.stale_timeout = options.get('STALE_TIMEOUT', 300)
+        self.retry_interval = options.get('RETRY_INTERVAL', 5)
+
+        shared_class = import_string(options.get('SHARED_BACKEND', 'django.core.cache.backends.redis.RedisCache'))
+        shared_params = {
+            key: params[key] for key in ('TIMEOUT', 'KEY_PREFIX', 'VERSION', 'KEY_FUNCTION') if key in params
+        }
+        shared_params['OPTIONS'] = options.get('SHARED_OPTIONS', {})
+        self.shared = shared_class(location, shared_params)
+
+        state_key = (str(location), params.get('KEY_PREFIX', ''))
+        with _states_lock:
+            if state_key not in _states:
+                _states[state_key] = _TierState(options.get('LOCAL_MAX_ENTRIES', 10000))
+            self.state = _states[state_key]
+
+    # 共享缓存
+
+    def _shared(self, method, *args, **kwargs):
+        """调用共享缓存，记录延迟；出错后在 retry_interval 内快速失败"""
+        state = self.state
+        if state.down_until > time.monotonic():
+            raise SharedCacheUnavailable
+        start = time.perf_counter()
+        try:
+            return getattr(self.shared, method)(*args, **kwargs)
+        except Exception as exc:
+            state.down_until = time.monotonic() + self.retry_interval
+            state.incr('errors')
+            logger.warning('共享缓存不可用（%s），%d 秒内使用本地缓存', exc, self.retry_interval)
+            raise SharedCacheUnavailable from exc
+        finally:
+            elapsed = time.perf_counter() - start
+            with state.lock:
+                state.counts['shared_calls'] += 1
+                state.shared_seconds += elapsed
+
+    # 本地 LRU
+
+    def _local_key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _local_ttl(self, timeout):
+        timeout = self.get_backend_timeout(timeout)
+        if timeout is None:
+            return self.local_timeout
+        return max(0.0, min(self.local_timeout, timeout - time.time()))
+
+    def _local_set(self, local_key, value, timeout=DEFAULT_TIMEOUT):
+        ttl = self._local_ttl(timeout)
+        if ttl <= 0:
+            self._local_delete(local_key)
+            return
+        fresh_until = time.monotonic() + ttl
+        entry = (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), fresh_until, fresh_until + self.stale_timeout)
+        state = self.state
+        with state.lock:
+            state.entries[local_key] = entry
+            state.entries.move_to_end(local_key)
+            while len(state.entries) > state.max_entries:
+                state.entries.popitem(last=False)
+
+    def _local_get(self, local_key):
+        """返回 (值, 是否新鲜)，不存在或超过过期数据可用期时返回 (_MISSING, False)"""
+        state = self.state
+        with state.lock:
+            entry = state.entries.get(local_key)
+            if entry is None:
+                return _MISSING, False
+            data, fresh_until, stale_until = entry
+            now = time.monotonic()
+            if stale_until <= now:
+                del state.entries[local_key]
+                return _MISSING, False
+            state.entries.move_to_end(local_key)
+        return pickle.loads(data), fresh_until > now
+
+    def _local_delete(self, local_key):
+        with self.state.lock:
+            self.state.entries.pop(local_key, None)
+
+    # 缓存接口
+
+    def get(self, key, default=None, version=None):
+        local_key = self._local_key(key, version)
+        value, fresh = self._local_get(local_key)
+        if fresh:
+            self.state.incr('local_hits')
+            return value
+        try:
+            shared_value = self._shared('get', key, _MISSING, version=version)
+        except SharedCacheUnavailable:
+            if value is not _MISSING:
+                self.state.incr('stale_hits')
+                return value
+            self.state.incr('misses')
+            return default
+        if shared_value is _MISSING:
+            self._local_delete(local_key)
+            self.state.incr('misses')
+            return default
+        self._local_set(local_key, shared_value)
+        self.state.incr('shared_hits')
+        return shared_value
+
+    def get_many(self, keys, version=None):
+        result = {}
+        stale = {}
+        remaining = []
+        for key in keys:
+            value, fresh = self._local_get(self._local_key(key, version))
+            if fresh:
+                result[key] = value
+            else:
+                remaining.append(key)
+                if value is not _MISSING:
+                    stale[key] = value
+        self.state.incr('local_hits', len(result))
+        if not remaining:
+            return result
+
+        try:
+            shared_values = self._shared('get_many', remaining, version=version)
+        except SharedCacheUnavailable:
+            result.update(stale)
+            self.state.incr('stale_hits', len(stale))
+            self.state.incr('misses', len(remaining) - len(stale))
+            return result
+        for key in remaining:
+            local_key = self._local_key(key, version)
+            if key in shared_values:
+                self._local_set(local_key, shared_values[key])
+                result[key] = shared_values[key]
+            else:
+                self._local_delete(local_key)
+        self.state.incr('shared_hits', len(shared_values))
+        self.state.incr('misses', len(remaining) - len(shared_values))
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        try:
+            self._shared('set', key, value, timeout=timeout, version=version)
+        except SharedCacheUnavailable:
+            pass
+        self._local_set(self._local_key(key, version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        try:
+            failed = self._shared('set_many', data, timeout=timeout, version=version)
+        except SharedCacheUnavailable:
+            failed = []
+        for key, value in data.items():
+            self._local_set(self._local_key(key, version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self._local_key(key, version)
+        try:
+            added = self._shared('add', key, value, timeout=timeout, version=version)
+        except SharedCacheUnavailable:
+            # 降级期间锁只在本进程内有效
+            current, _ = self._local_get(local_key)
+            added = current is _MISSING
+        if added:
+            self._local_set(local_key, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        try:
+            return self._shared('touch', key, timeout=timeout, version=version)
+        except SharedCacheUnavailable:
+            return False
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self._local_key(key, version)
+        try:
+            value = self._shared('incr', key, delta, version=version)
+        except SharedCacheUnavailable:
+            current, _ = self._local_get(local_key)
+            if current is _MISSING:
+                raise ValueError("Key '%s' not found" % key)
+            value = current + delta
+            self._local_set(local_key, value)
+            return value
+        self._local_delete(local_key)
+        return value
+
+    def delete(self, key, version=None):
+        self._local_delete(self._local_key(key, version))
+        try:
+            return self._shared('delete', key, version=version)
+        except SharedCacheUnavailable:
+            return False
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._local_delete(self._local_key(key, version))
+        try:
+            self._shared('delete_many', keys, version=version)
+        except SharedCacheUnavailable:
+            pass
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        with self.state.lock:
+            self.state.entries.clear()
+        try:
+            self._shared('clear')
+        except SharedCacheUnavailable:
+            pass
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+
+    def stats(self):
+        """本进程的命中、未命中、错误次数和共享缓存平均延迟（毫秒）"""
+        state = self.state
+        with state.lock:
+            stats = dict(state.counts)
+            stats['local_entries'] = len(state.entries)
+            calls = stats['shared_calls']
+            stats['shared_avg_ms'] = round(state.shared_seconds / calls * 1000, 3) if calls else 0.0
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['stale_hits'] + stats['misses']
+        stats['hit_rate'] = round((lookups - stats['misses']) / lookups, 4) if lookups else 0.0
+        stats['shared_available'] = state.down_until <= time.monotonic()
+        return stats
+
+    def reset_stats(self):
+        state = self.state
+        with state.lock:
+            for name in state.counts:
+                state.counts[name] = 0
+            state.shared_seconds = 0.0
@@ -0,0 +1,131 @@
+"""
+防击穿的缓存填充
+
+get_or_fill(key, compute, timeout) 和 @cached 装饰器为热点缓存提供三层保护：
+    单飞：缓存缺失时，同一进程内每个键只有一个线程（领头线程）负责填充，
+          其余线程等待它的完成事件；跨进程用 cache.add 加锁，只有拿到锁的请求执行 compute，
+          其余等待结果写入。等待都以 lock_timeout 秒为限，超时后自行计算。
+          compute 执行期间不持有任何进程级的锁，嵌套填充其他键不会互相阻塞成死锁。
+    提前刷新：按 XFetch 算法，临近过期时每个请求以一定概率提前重算，
+          计算越慢（delta）、越接近过期，概率越高，避免大量请求同时遇到过期。
+    过期可用：条目在缓存中比 timeout 多保留 stale_timeout 秒，
+          过期后由拿到锁的请求重算，其余请求直接返回旧值，不再等待；stale_timeout 默认等于 timeout。
+缓存中保存 (值, 到期时间, 上次计算耗时)，直接 cache.delete(key) 即可让条目失效。
+"""
+
+import functools
+import inspect
+import math
+import random
+import threading
+import time
+
+from django.core.cache import cache
+
+LOCK_KEY = '{key}:fill_lock'
+
+# 进程内正在填充的键 -> (完成事件, 领头线程ID)，只在登记和注销时短暂加锁
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def store(key, value, timeout, stale_timeout=None, delta=0.0):
+    """写入条目，供主动刷新缓存的代码使用"""
+    entry = (value, time.time() + timeout, delta)
+    cache.set(key, entry, timeout + (timeout if stale_timeout is None else stale_timeout))
+    return value
+
+
+def _compute_and_store(key, compute, timeout, stale_timeout):
+    start = time.monotonic()
+    value = compute()
+    return store(key, value, timeout, stale_timeout, delta=time.monotonic() - start)
+
+
+def _should_refresh(expires_at, delta, beta):
+    """XFetch：now - delta * beta * ln(rand) >= expires_at 时提前重算"""
+    return time.time() - delta * beta * math.log(1.0 - random.random()) >= expires_at
+
+
+def get_or_fill(key, compute, timeout, stale_timeout=None, beta=1.0, lock_timeout=10):
+    """读取缓存，缺失、过期或被选中提前刷新时由单个请求调用 compute 重算"""
+    entry = cache.get(key)
+    if entry is not None:
+        value, expires_at, delta = entry
+        if not _should_refresh(expires_at, delta, beta):
+            return value
+        if not cache.add(LOCK_KEY.format(key=key), 1, lock_timeout):
+            # 其他请求正在重算，先返回旧值
+            return value
+        try:
+            return _compute_and_store(key, compute, timeout, stale_timeout)
+        finally:
+            cache.delete(LOCK_KEY.format(key=key))
+
+    thread_id = threading.get_ident()
+    with _inflight_lock:
+        inflight = _inflight.get(key)
+        if inflight is None:
+            event = threading.Event()
+            _inflight[key] = (event, thread_id)
+    if inflight is not None:
+        event, owner = inflight
+        # 同一线程在 compute 中再次请求同一个键时直接计算，不等待自己
+        if owner != thread_id and event.wait(lock_timeout):
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[0]
+        return _compute_and_store(key, compute, timeout, stale_timeout)
+
+    try:
+        return _fill_across_processes(key, compute, timeout, stale_timeout, lock_timeout)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        event.set()
+
+
+def _fill_across_processes(key, compute, timeout, stale_timeout, lock_timeout):
+    """领头线程的填充：再次检查缓存，用 cache.add 锁与其他进程单飞"""
+    entry = cache.get(key)
+    if entry is not None:
+        return entry[0]
+    if cache.add(LOCK_KEY.format(key=key), 1, lock_timeout):
+        try:
+            return _compute_and_store(key, compute, timeout, stale_timeout)
+        finally:
+            cache.delete(LOCK_KEY.format(key=key))
+
+    # 其他进程正在计算，等待结果；超时后自行计算
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return _compute_and_store(key, compute, timeout, stale_timeout)
+
+
+def cached(key, timeout, stale_timeout=None, beta=1.0, lock_timeout=10):
+    """用 get_or_fill 缓存函数结果
+
+    key 为键模板，用函数参数格式化，例如 'tieba:staff:{tieba_id}'。
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def make_key(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            return key.format(**bound.arguments)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return get_or_fill(
+                make_key(*args, **kwargs), lambda: func(*args, **kwargs),
+                timeout, stale_timeout=stale_timeout, beta=beta, lock_timeout=lock_timeout,
+            )
+
+        wrapper.make_key = make_key
+        return wrapper
+    return decorator
@@ -0,0 +1,58 @@
+"""
+条件 GET（ETag / Last-Modified）
+
+@conditional(stamp) 修饰详情和列表接口，在执行视图之前调用 stamp(request, **视图参数)，
+stamp 只读取资源的版本戳（updated_at、楼层数、计数字段、response_cache 中的范围版本号、
+当前用户的点赞状态等），返回 (版本戳列表, 最后修改时间)，资源不存在时返回 None 交给视图处理。
+
+ETag 由请求路径（含查询参数）、当前用户和版本戳计算，不序列化响应体；
+If-None-Match 命中时直接返回 304，不执行视图中的查询和序列化。
+
+最后修改时间只反映内容的修改（编辑、新回复），计数和当前用户的点赞状态变化时不会前进，
+只发送 If-Modified-Since 的客户端会拿到过期的计数。因此默认不发送 Last-Modified、
+也不处理 If-Modified-Since；只有响应内容完全由最后修改时间决定的接口才传 last_modified=True。
+"""
+
+import functools
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(request, parts):
+    viewer = request.user.pk if request.user.is_authenticated else 0
+    raw = '|'.join(str(part) for part in (request.get_full_path(), viewer, *parts))
+    return 'W/' + quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+def conditional(stamp, last_modified=False):
+    """为 GET 接口加上 ETag（last_modified 为 True 时还有 Last-Modified），条件请求命中时返回 304
+
+    可直接修饰函数视图，APIView 方法需配合 method_decorator 使用。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            result = stamp(request, *args, **kwargs)
+            if result is None:
+                return view(request, *args, **kwargs)
+
+            parts, modified_at = result
+            etag = make_etag(request, parts)
+            timestamp = int(modified_at.timestamp()) if last_modified and modified_at else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is not None:
+                return response
+
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response['ETag'] = etag
+                if timestamp is not None:
+                    response['Last-Modified'] = http_date(timestamp)
+                patch_vary_headers(response, ['Authorization', 'Cookie'])
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,111 @@
+"""
+反范式计数字段的原子更新
+
+计数只通过单列 UPDATE ... SET field = field + n 修改，不读取后整行 save()，
+并发请求不会互相覆盖，也不会改写同一行的其他字段；减少时不低于 0。
+
+关系行（点赞、收藏、关注、成员）的增删与对应计数在同一事务中完成，
+计数只按本事务实际插入或删除的行数变化：重复点击、并发请求中
+由唯一约束拦下的插入和已被删除的行都不会改变计数。
+
+帖子、评论等带状态的行只在可见（status == 1）时计入，由 VisibilityCounted 在保存时
+按可见状态的变化增减，新建、发布、删除走同一规则，与 reconcile 的统计口径一致。
+"""
+
+from collections import namedtuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+# 一个计数字段：模型、主键、字段名
+CounterRef = namedtuple('CounterRef', ['model', 'pk', 'field'])
+
+
+def counter(instance, field):
+    """实例上的计数字段"""
+    return CounterRef(type(instance), instance.pk, field)
+
+
+def adjust(model, pk, **deltas):
+    """原子地增减一行的若干计数字段"""
+    adjust_rows(model.objects.filter(pk=pk), **deltas)
+
+
+def adjust_rows(queryset, **deltas):
+    """原子地增减查询集中各行的计数字段，用于没有主键的定位方式"""
+    updates = {}
+    for field, amount in deltas.items():
+        if amount > 0:
+            updates[field] = F(field) + amount
+        elif amount < 0:
+            updates[field] = Greatest(F(field) + amount, 0)
+    if updates:
+        queryset.update(**updates)
+
+
+def apply(counters, amount):
+    """对一组计数字段统一加上 amount"""
+    for ref in counters:
+        adjust(ref.model, ref.pk, **{ref.field: amount})
+
+
+def refresh(instance, *fields):
+    """原子更新后重新读取实例上的计数字段"""
+    instance.refresh_from_db(fields=fields)
+    return instance
+
+
+class VisibilityCounted:
+    """只有可见行计入计数的模型混入类，子类实现 update_counters(amount)
+
+    保存时在同一事务中锁住原行读取保存前的状态，变为可见时 update_counters(1)，
+    不再可见时 update_counters(-1)。QuerySet.update 修改状态不经过这里，由对账修正。
+    """
+
+    VISIBLE_STATUS = 1
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'status' not in update_fields:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            was_visible = False
+            if not self._state.adding:
+                was_visible = type(self)._default_manager.select_for_update().filter(
+                    pk=self.pk, status=self.VISIBLE_STATUS
+                ).exists()
+            super().save(*args, **kwargs)
+            is_visible = self.status == self.VISIBLE_STATUS
+            if is_visible != was_visible:
+                self.update_counters(1 if is_visible else -1)
+
+
+def add_relation(model, counters=(), defaults=None, **lookup):
+    """创建关系行并增加计数，返回 (对象, 是否新建)；已存在时计数不变"""
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                obj = model.objects.create(**lookup, **(defaults or {}))
+        except IntegrityError:
+            return model.objects.get(**lookup), False
+        apply(counters, 1)
+    return obj, True
+
+
+def remove_relation(model, counters=(), **lookup):
+    """删除关系行并按实际删除的行数减少计数，返回删除的行数"""
+    with transaction.atomic():
+        _, deleted = model.objects.filter(**lookup).delete()
+        removed = deleted.get(model._meta.label, 0)
+        if removed:
+            apply(counters, -removed)
+    return removed
+
+
+def toggle_relation(model, counters=(), **lookup):
+    """存在则删除、不存在则创建，同步计数，返回操作后关系是否存在"""
+    if remove_relation(model, counters, **lookup):
+        return False
+    add_relation(model, counters, **lookup)
+    return True
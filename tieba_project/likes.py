@@ -0,0 +1,467 @@
+"""
+点赞 / 收藏引擎
+
+点赞、收藏的切换不再在请求中写数据库：
+    每个对象的点赞用户集合（首次访问时从数据库加载）放在存储中，切换只是集合上的增删，
+    点赞数即集合大小；切换结果同时记入待写入表，按 (关系, 对象, 用户) 只保留最后一次状态。
+    后台线程每 LIKE_FLUSH_INTERVAL 秒取走待写入表，批量插入、删除关系行，
+    按实际插入和删除的行数原子增减对象上的计数字段。
+
+"我是否点过赞"：已加载集合的对象直接查集合；其余对象的关系都已写入数据库，
+先查当前用户的布隆过滤器（记录该用户点过赞的全部对象，首次使用时从数据库构建，
+此后每次点赞同步置位），过滤器判定"没有"的对象无需查询，只有"可能有"的对象才查数据库。
+取消点赞不清除过滤器中的位，只会增加一次数据库确认。
+
+有待写入记录的对象，其集合在写入提交前（包括已被取走、正在写入期间）不会被淘汰或过期，
+因此集合与数据库合起来总是最新状态。
+
+存储后端由 settings.LIKE_STORE_BACKEND 选择：
+    memory  进程内集合，按 LRU 淘汰，适合单进程部署和开发环境
+    redis   Redis 集合、位图和哈希，多进程共享
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .background import BackgroundBatcher
+from .counters import adjust_rows
+from .response_cache import bump
+
+# 关系模型 -> (目标外键字段, 目标对象上的计数字段)
+RELATIONS = {
+    'posts.PostLike': ('post', 'like_count'),
+    'posts.PostCollect': ('post', 'collect_count'),
+    'comments.CommentLike': ('comment', 'like_count'),
+}
+
+FLUSH_LOCK_KEY = 'likes:flush_lock'
+
+# 一次切换：关系, 对象ID, 用户ID
+LikeKey = namedtuple('LikeKey', ['kind', 'object_id', 'user_id'])
+
+
+def bloom_positions(object_id, bits, hashes):
+    """对象ID在布隆过滤器中的位（双重哈希，跨进程稳定）"""
+    digest = hashlib.md5(str(object_id).encode()).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class MemoryLikeStore:
+    """进程内点赞存储"""
+
+    def __init__(self, max_objects, bloom_bits, bloom_hashes, max_users=None):
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.max_objects = max_objects
+        self.max_users = max_users or max_objects
+        self._lock = threading.Lock()
+        self._sets = OrderedDict()      # (关系, 对象ID) -> 用户ID集合
+        self._blooms = OrderedDict()    # (关系, 用户ID) -> bytearray
+        self._ready = set()             # 已从数据库构建过的过滤器
+        self._pending = {}              # LikeKey -> (是否存在, 时间戳)
+        self._flushing = {}             # 已取走、尚未提交的待写入记录
+
+    def load(self, kind, object_id, user_ids):
+        with self._lock:
+            self._sets.setdefault((kind, object_id), set(user_ids))
+            self._evict(keep=(kind, object_id))
+
+    def _evict(self, keep):
+        if len(self._sets) <= self.max_objects:
+            return
+        # 正在写入的对象若被淘汰，提交前重新加载会读到旧的数据库状态
+        pending = {(key.kind, key.object_id) for key in (*self._pending, *self._flushing)}
+        for key in list(self._sets):
+            if len(self._sets) <= self.max_objects:
+                break
+            if key != keep and key not in pending:
+                del self._sets[key]
+
+    def toggle(self, kind, object_id, user_id, timestamp):
+        """切换关系，返回 (切换后是否存在, 对象的关系总数)；集合未加载时返回 None"""
+        with self._lock:
+            members = self._sets.get((kind, object_id))
+            if members is None:
+                return None
+            self._sets.move_to_end((kind, object_id))
+            active = user_id not in members
+            if active:
+                members.add(user_id)
+                self._set_bits(kind, user_id, [object_id])
+            else:
+                members.discard(user_id)
+            self._pending[LikeKey(kind, object_id, user_id)] = (active, timestamp)
+            return active, len(members)
+
+    def members(self, kind, object_ids, user_id):
+        """返回 {对象ID: 是否存在}，只包含集合已加载的对象"""
+        with self._lock:
+            return {
+                object_id: user_id in self._sets[(kind, object_id)]
+                for object_id in object_ids if (kind, object_id) in self._sets
+            }
+
+    def bloom_ready(self, kind, user_id):
+        with self._lock:
+            return (kind, user_id) in self._ready
+
+    def bloom_add(self, kind, user_id, object_ids, ready=False):
+        with self._lock:
+            self._set_bits(kind, user_id, object_ids)
+            if ready:
+                self._ready.add((kind, user_id))
+
+    def _set_bits(self, kind, user_id, object_ids):
+        bloom = self._blooms.get((kind, user_id))
+        if bloom is None:
+            bloom = self._blooms[(kind, user_id)] = bytearray(self.bloom_bits // 8)
+            while len(self._blooms) > self.max_users:
+                key, _ = self._blooms.popitem(last=False)
+                self._ready.discard(key)
+        self._blooms.move_to_end((kind, user_id))
+        for object_id in object_ids:
+            for bit in bloom_positions(object_id, self.bloom_bits, self.bloom_hashes):
+                bloom[bit >> 3] |= 1 << (bit & 7)
+
+    def bloom_check(self, kind, user_id, object_ids):
+        """返回过滤器判定可能存在的对象ID"""
+        with self._lock:
+            bloom = self._blooms.get((kind, user_id))
+            if bloom is None:
+                return set()
+            return {
+                object_id for object_id in object_ids
+                if all(bloom[bit >> 3] & (1 << (bit & 7))
+                       for bit in bloom_positions(object_id, self.bloom_bits, self.bloom_hashes))
+            }
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushing.update(pending)
+        return pending
+
+    def done(self, pending):
+        """写入提交后调用，对象的集合可以被淘汰"""
+        with self._lock:
+            for key in pending:
+                self._flushing.pop(key, None)
+
+    def restore(self, pending):
+        """写入失败时放回，期间产生的更新记录优先"""
+        with self._lock:
+            for key, value in pending.items():
+                self._flushing.pop(key, None)
+                self._pending.setdefault(key, value)
+
+
+class RedisLikeStore:
+    """基于 Redis 的点赞存储
+
+    每个对象一个集合（含占位成员 0 表示已加载），每个用户一个位图作布隆过滤器，
+    待写入记录放在一个哈希中；切换通过 Lua 脚本原子完成。
+    """
+
+    PREFIX = 'likes'
+    PENDING_KEY = 'likes:pending'
+    FLUSHING_KEY = 'likes:pending:flushing'
+
+    LOAD_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        redis.call('SADD', KEYS[1], 0)
+        for i = 2, #ARGV, 1000 do
+            redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+        end
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    """
+
+    TOGGLE_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 0 then
+        return false
+    end
+    local active = 1
+    if redis.call('SREM', KEYS[1], ARGV[1]) == 1 then
+        active = 0
+    else
+        redis.call('SADD', KEYS[1], ARGV[1])
+        for i = 5, #ARGV do
+            redis.call('SETBIT', KEYS[3], ARGV[i], 1)
+        end
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+    end
+    redis.call('HSET', KEYS[2], ARGV[2], active .. ':' .. ARGV[3])
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    return {active, redis.call('SCARD', KEYS[1]) - 1}
+    """
+
+    def __init__(self, url, ttl, bloom_bits, bloom_hashes):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._response_error = redis.exceptions.ResponseError
+        self.ttl = ttl
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self._load = self._client.register_script(self.LOAD_SCRIPT)
+        self._toggle = self._client.register_script(self.TOGGLE_SCRIPT)
+
+    def _set_key(self, kind, object_id):
+        return f'{self.PREFIX}:{kind}:{object_id}'
+
+    def _bloom_key(self, kind, user_id):
+        return f'{self.PREFIX}:{kind}:bloom:{user_id}'
+
+    def load(self, kind, object_id, user_ids):
+        self._load(keys=[self._set_key(kind, object_id)], args=[self.ttl, *user_ids])
+
+    def toggle(self, kind, object_id, user_id, timestamp):
+        # 待写入记录超过 TTL 前必然已写入，集合不会在写入前过期
+        result = self._toggle(
+            keys=[self._set_key(kind, object_id), self.PENDING_KEY, self._bloom_key(kind, user_id)],
+            args=[user_id, f'{kind}|{object_id}|{user_id}', timestamp, self.ttl,
+                  *bloom_positions(object_id, self.bloom_bits, self.bloom_hashes)],
+        )
+        if result is None:
+            return None
+        return bool(result[0]), int(result[1])
+
+    def members(self, kind, object_ids, user_id):
+        object_ids = list(object_ids)
+        pipe = self._client.pipeline(transaction=False)
+        for object_id in object_ids:
+            key = self._set_key(kind, object_id)
+            pipe.exists(key)
+            pipe.sismember(key, user_id)
+        results = pipe.execute()
+        return {
+            object_id: bool(results[2 * i + 1])
+            for i, object_id in enumerate(object_ids) if results[2 * i]
+        }
+
+    def bloom_ready(self, kind, user_id):
+        return bool(self._client.exists(self._bloom_key(kind, user_id) + ':ready'))
+
+    def bloom_add(self, kind, user_id, object_ids, ready=False):
+        key = self._bloom_key(kind, user_id)
+        pipe = self._client.pipeline(transaction=False)
+        for object_id in object_ids:
+            for bit in bloom_positions(object_id, self.bloom_bits, self.bloom_hashes):
+                pipe.setbit(key, bit, 1)
+        # 过滤器比 ready 标记多保留一小时，标记有效期内过滤器不会过期
+        pipe.expire(key, self.ttl + 3600)
+        if ready:
+            pipe.set(key + ':ready', 1, ex=self.ttl)
+        pipe.execute()
+
+    def bloom_check(self, kind, user_id, object_ids):
+        object_ids = list(object_ids)
+        key = self._bloom_key(kind, user_id)
+        pipe = self._client.pipeline(transaction=False)
+        for object_id in object_ids:
+            for bit in bloom_positions(object_id, self.bloom_bits, self.bloom_hashes):
+                pipe.getbit(key, bit)
+        bits = pipe.execute()
+        hashes = self.bloom_hashes
+        return {
+            object_id for i, object_id in enumerate(object_ids)
+            if all(bits[i * hashes:(i + 1) * hashes])
+        }
+
+    def drain(self):
+        """取走待写入哈希；上次写入中断遗留的哈希优先处理"""
+        if not self._client.exists(self.FLUSHING_KEY):
+            try:
+                self._client.rename(self.PENDING_KEY, self.FLUSHING_KEY)
+            except self._response_error:
+                # 键不存在说明没有待写入记录
+                return {}
+        pipe = self._client.pipeline()
+        pipe.hgetall(self.FLUSHING_KEY)
+        pipe.delete(self.FLUSHING_KEY)
+        raw, _ = pipe.execute()
+        pending = {}
+        for field, value in raw.items():
+            kind, object_id, user_id = field.decode().split('|')
+            active, timestamp = value.decode().split(':')
+            pending[LikeKey(kind, int(object_id), int(user_id))] = (active == '1', float(timestamp))
+        return pending
+
+    def done(self, pending):
+        # 集合只按 TTL 过期，切换时续期，写入期间不会被淘汰
+        pass
+
+    def restore(self, pending):
+        pipe = self._client.pipeline(transaction=False)
+        for key, (active, timestamp) in pending.items():
+            field = f'{key.kind}|{key.object_id}|{key.user_id}'
+            pipe.hsetnx(self.PENDING_KEY, field, f'{int(active)}:{timestamp}')
+        pipe.execute()
+
+
+class LikeEngine:
+    """点赞、收藏的切换、查询与异步写入"""
+
+    def __init__(self, store, flush_interval, batch_size):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._batcher = BackgroundBatcher(
+            'like-engine', self.flush, flush_interval, '点赞、收藏写入失败，记录已放回待写入表'
+        )
+
+    @staticmethod
+    def kind(model):
+        return model._meta.label
+
+    def _load(self, kind, object_id):
+        model = apps.get_model(kind)
+        field, _ = RELATIONS[kind]
+        user_ids = model.objects.filter(**{f'{field}_id': object_id}).values_list('user_id', flat=True)
+        self.store.load(kind, object_id, list(user_ids))
+
+    def toggle(self, model, object_id, user_id):
+        """切换用户与对象的关系，返回 (切换后是否存在, 对象的关系总数)"""
+        kind = self.kind(model)
+        result = self.store.toggle(kind, object_id, user_id, time.time())
+        if result is None:
+            self._load(kind, object_id)
+            result = self.store.toggle(kind, object_id, user_id, time.time())
+        self._batcher.start()
+        return result
+
+    def active_ids(self, model, user_id, object_ids):
+        """object_ids 中用户存在关系的对象ID"""
+        kind = self.kind(model)
+        object_ids = set(object_ids)
+        known = self.store.members(kind, object_ids, user_id)
+        hits = {object_id for object_id, active in known.items() if active}
+        unknown = object_ids - known.keys()
+        if not unknown:
+            return hits
+
+        field, _ = RELATIONS[kind]
+        relations = model.objects.filter(user_id=user_id)
+        if not self.store.bloom_ready(kind, user_id):
+            liked = relations.values_list(f'{field}_id', flat=True)
+            self.store.bloom_add(kind, user_id, list(liked), ready=True)
+        maybe = self.store.bloom_check(kind, user_id, unknown)
+        if maybe:
+            hits.update(relations.filter(**{f'{field}_id__in': maybe}).values_list(f'{field}_id', flat=True))
+        return hits
+
+    def flush(self):
+        """把待写入的切换批量写入数据库，返回处理的记录数"""
+        if not cache.add(FLUSH_LOCK_KEY, 1, 60):
+            return 0
+        try:
+            pending = self.store.drain()
+            if not pending:
+                return 0
+            try:
+                by_kind = defaultdict(dict)
+                for key, value in pending.items():
+                    by_kind[key.kind][key] = value
+                for kind, changes in by_kind.items():
+                    self._persist(kind, changes)
+            except Exception:
+                self.store.restore(pending)
+                raise
+            self.store.done(pending)
+            return len(pending)
+        finally:
+            cache.delete(FLUSH_LOCK_KEY)
+
+    def _persist(self, kind, changes):
+        model = apps.get_model(kind)
+        field, counter_field = RELATIONS[kind]
+        target = model._meta.get_field(field).related_model
+        object_ids = {key.object_id for key in changes}
+        # 写入前对象可能已被删除
+        existing_targets = set(target.objects.filter(pk__in=object_ids).values_list('pk', flat=True))
+
+        deltas = defaultdict(int)
+        with transaction.atomic():
+            removals = defaultdict(list)
+            for key, (active, _) in changes.items():
+                if not active:
+                    removals[key.object_id].append(key.user_id)
+            for object_id, user_ids in removals.items():
+                _, deleted = model.objects.filter(**{f'{field}_id': object_id, 'user_id__in': user_ids}).delete()
+                deltas[object_id] -= deleted.get(kind, 0)
+
+            additions = {
+                (key.object_id, key.user_id): timestamp
+                for key, (active, timestamp) in changes.items()
+                if active and key.object_id in existing_targets
+            }
+            if additions:
+                present = set(
+                    model.objects.filter(
+                        **{f'{field}_id__in': {o for o, _ in additions}},
+                        user_id__in={u for _, u in additions},
+                    ).values_list(f'{field}_id', 'user_id')
+                )
+                rows = [
+                    model(**{f'{field}_id': object_id, 'user_id': user_id},
+                          created_at=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc))
+                    for (object_id, user_id), timestamp in additions.items()
+                    if (object_id, user_id) not in present
+                ]
+                model.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+                for row in rows:
+                    deltas[getattr(row, f'{field}_id')] += 1
+
+            groups = defaultdict(list)
+            for object_id, delta in deltas.items():
+                if delta:
+                    groups[delta].append(object_id)
+            for delta, pks in groups.items():
+                adjust_rows(target.objects.filter(pk__in=pks), **{counter_field: delta})
+
+        if target._meta.label == 'posts.Post':
+            from posts.hot_score import hot_scores
+            for object_id in deltas:
+                hot_scores.touch(object_id)
+        elif target._meta.label == 'comments.Comment' and deltas:
+            # 评论点赞数变化，使所在帖子评论接口的 ETag 失效，并更新搜索索引中的热度
+            post_ids = set(target.objects.filter(pk__in=list(deltas)).values_list('post_id', flat=True))
+            if post_ids:
+                bump(*(f'comments:post:{post_id}' for post_id in post_ids))
+            from search.indexer import search_index
+            search_index.touch(target, deltas)
+
+
+def _build_engine():
+    bloom_bits = getattr(settings, 'LIKE_BLOOM_BITS', 8192)
+    bloom_hashes = getattr(settings, 'LIKE_BLOOM_HASHES', 5)
+    if getattr(settings, 'LIKE_STORE_BACKEND', 'memory') == 'redis':
+        store = RedisLikeStore(
+            settings.REDIS_URL,
+            ttl=getattr(settings, 'LIKE_CACHE_SECONDS', 24 * 3600),
+            bloom_bits=bloom_bits,
+            bloom_hashes=bloom_hashes,
+        )
+    else:
+        store = MemoryLikeStore(
+            max_objects=getattr(settings, 'LIKE_MAX_OBJECTS', 10000),
+            bloom_bits=bloom_bits,
+            bloom_hashes=bloom_hashes,
+        )
+    return LikeEngine(
+        store,
+        flush_interval=getattr(settings, 'LIKE_FLUSH_INTERVAL', 2),
+        batch_size=getattr(settings, 'LIKE_BATCH_SIZE', 1000),
+    )
+
+
+like_engine = _build_engine()
@@ -0,0 +1,154 @@
+"""
+游标（Keyset）分页
+
+按一组组成全序的排序键翻页，例如 ('-is_top', '-created_at', '-id')：
+下一页的条件是 "排序键元组严格位于上一页最后一条之后"，走索引定位，
+不做 OFFSET 扫描，也不执行 COUNT(*)。总数只在调用方提供时返回，
+通常取自反范式计数字段或 cached_count 缓存的近似值。
+"""
+
+import base64
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .cache_fill import get_or_fill
+
+
+def encode_cursor(position):
+    """把排序键取值编码为游标字符串"""
+    values = [v.isoformat() if isinstance(v, (datetime, date)) else v for v in position]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标字符串，格式错误时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+    if not isinstance(values, list):
+        raise ValueError('invalid cursor')
+    return values
+
+
+def cached_count(queryset, key, timeout=300):
+    """缓存的近似总数，避免每次翻页都执行 COUNT(*)"""
+    return get_or_fill(key, queryset.count, timeout)
+
+
+def resolve_field(model, path):
+    """沿 a__b 路径找到模型字段，找不到时返回 None"""
+    field = None
+    for name in path.split('__'):
+        if model is None:
+            return None
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        model = field.related_model
+    if field is not None and field.is_relation:
+        return field.target_field
+    return field
+
+
+class KeysetPagination:
+    """基于排序键的游标分页"""
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = '无效的游标'
+
+    def __init__(self, ordering, page_size=20, max_page_size=100):
+        self.ordering = tuple(ordering)
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.request = None
+        self.next_position = None
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_position(self, request):
+        """解析请求中的游标，没有游标时返回 None"""
+        self.request = request
+        cursor = request.GET.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = decode_cursor(cursor)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def paginate_queryset(self, queryset, request):
+        """按请求中的游标返回一页数据"""
+        position = self.get_position(request)
+        page, self.next_position = self.paginate(queryset, position, self.get_page_size(request))
+        return page
+
+    def paginate(self, queryset, position=None, page_size=None):
+        """返回 (当前页对象列表, 下一页位置)，没有下一页时位置为 None"""
+        page_size = page_size or self.page_size
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(self.coerce(queryset.model, position)))
+            except (ValueError, TypeError, ValidationError):
+                # 游标能解码但取值与排序字段的类型不符
+                raise NotFound(self.invalid_cursor_message)
+        rows = list(queryset[:page_size + 1])
+        if len(rows) > page_size:
+            return rows[:page_size], self.position_of(rows[page_size - 1])
+        return rows, None
+
+    def coerce(self, model, position):
+        """按排序字段的类型转换游标取值，类型不符时抛出 ValidationError；非模型字段（注解）原样返回"""
+        values = []
+        for field, value in zip(self.ordering, position):
+            model_field = resolve_field(model, field.lstrip('-'))
+            values.append(value if model_field is None else model_field.to_python(value))
+        return values
+
+    def after(self, position):
+        """位于 position 之后的过滤条件：(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def position_of(self, obj):
+        return [attrgetter(field.lstrip('-').replace('__', '.'))(obj) for field in self.ordering]
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data, count=None):
+        return Response(OrderedDict([
+            ('count', count),
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
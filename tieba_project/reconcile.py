@@ -0,0 +1,182 @@
+"""
+反范式计数字段的对账
+
+每个计数字段都能从源表重新统计（COUNTERS）。对账按目标表主键分块：
+每块读取当前计数，用一条 GROUP BY 查询统计源表中的真实值，找出偏差；
+修正时锁住偏差行重新统计一次再按新值分组批量 UPDATE，
+与同一时刻在事务中增减计数的请求互不覆盖。
+帖子、评论只统计可见（status == 1）的行，与 counters.VisibilityCounted 的计数口径一致，
+应用正常写入的计数在对账中不会出现偏差。
+
+增量模式只检查自上次对账以来有源表行新增或修改的目标行，
+源表行被物理删除（取消点赞、取消关注、退出贴吧）不会留下时间戳，
+这类偏差需要定期执行一次全量对账。
+"""
+
+from collections import defaultdict, namedtuple
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from comments.models import Comment, CommentLike
+from posts.models import Post, PostCollect, PostLike
+from tieba.models import Tieba, TiebaMember
+from users.models import FollowRelation
+
+User = get_user_model()
+
+LAST_RUN_CACHE_KEY = 'counters:reconcile:last_run'
+
+# target_keys 与 group_by 一一对应：目标行的这些字段等于源表行的分组字段时计入
+# changed_field 为源表中标记新增或修改时间的字段，用于增量对账
+CounterSpec = namedtuple('CounterSpec', [
+    'name', 'target', 'field', 'target_keys', 'source', 'group_by', 'filters', 'changed_field',
+])
+
+COUNTERS = [
+    CounterSpec('tieba.member_count', Tieba, 'member_count', ('id',),
+                TiebaMember, ('tieba_id',), {'is_active': True}, 'joined_at'),
+    CounterSpec('tieba.post_count', Tieba, 'post_count', ('id',),
+                Post, ('tieba_id',), {'status': 1}, 'updated_at'),
+    CounterSpec('post.reply_count', Post, 'reply_count', ('id',),
+                Comment, ('post_id',), {'status': 1}, 'updated_at'),
+    CounterSpec('post.like_count', Post, 'like_count', ('id',),
+                PostLike, ('post_id',), {}, 'created_at'),
+    CounterSpec('post.collect_count', Post, 'collect_count', ('id',),
+                PostCollect, ('post_id',), {}, 'created_at'),
+    CounterSpec('comment.reply_count', Comment, 'reply_count', ('id',),
+                Comment, ('parent_id',), {'status': 1}, 'updated_at'),
+    CounterSpec('comment.like_count', Comment, 'like_count', ('id',),
+                CommentLike, ('comment_id',), {}, 'created_at'),
+    CounterSpec('user.post_count', User, 'post_count', ('id',),
+                Post, ('author_id',), {'status': 1}, 'updated_at'),
+    CounterSpec('user.comment_count', User, 'comment_count', ('id',),
+                Comment, ('author_id',), {'status': 1}, 'updated_at'),
+    CounterSpec('user.follower_count', User, 'follower_count', ('id',),
+                FollowRelation, ('following_id',), {}, 'created_at'),
+    CounterSpec('user.following_count', User, 'following_count', ('id',),
+                FollowRelation, ('follower_id',), {}, 'created_at'),
+    CounterSpec('member.post_count', TiebaMember, 'post_count', ('tieba_id', 'user_id'),
+                Post, ('tieba_id', 'author_id'), {'status': 1}, 'updated_at'),
+    CounterSpec('member.comment_count', TiebaMember, 'comment_count', ('tieba_id', 'user_id'),
+                Comment, ('post__tieba_id', 'author_id'), {'status': 1}, 'updated_at'),
+]
+
+
+class DriftReport:
+    """单个计数字段的对账结果"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.checked = 0
+        self.drifted = 0
+        self.total_drift = 0
+        self.fixed = 0
+        self.samples = []
+
+    def add(self, pk, current, expected, max_samples=10):
+        self.drifted += 1
+        self.total_drift += abs(expected - current)
+        if len(self.samples) < max_samples:
+            self.samples.append((pk, current, expected))
+
+
+def count_sources(spec, keys):
+    """统计 keys（目标键元组的集合）在源表中的真实计数"""
+    if not keys:
+        return {}
+    lookups = {
+        f'{group}__in': {key[i] for key in keys}
+        for i, group in enumerate(spec.group_by)
+    }
+    rows = (
+        spec.source.objects.filter(**spec.filters, **lookups)
+        .values(*spec.group_by).annotate(total=Count('pk')).order_by()
+    )
+    counts = {}
+    for row in rows:
+        key = tuple(row[group] for group in spec.group_by)
+        if key in keys:
+            counts[key] = row['total']
+    return counts
+
+
+def reconcile_chunk(spec, queryset, report, fix):
+    """对一块目标行对账，fix 为 True 时修正偏差"""
+    rows = list(queryset.values('pk', spec.field, *spec.target_keys))
+    report.checked += len(rows)
+    keys = {tuple(row[key] for key in spec.target_keys) for row in rows}
+    counts = count_sources(spec, keys)
+
+    drifted = {}
+    for row in rows:
+        key = tuple(row[k] for k in spec.target_keys)
+        expected = counts.get(key, 0)
+        if row[spec.field] != expected:
+            report.add(row['pk'], row[spec.field], expected)
+            drifted[row['pk']] = key
+    if fix and drifted:
+        report.fixed += fix_drift(spec, drifted)
+
+
+def fix_drift(spec, drifted):
+    """锁住偏差行后重新统计并按新值分组批量更新，返回更新的行数"""
+    with transaction.atomic():
+        list(spec.target.objects.select_for_update().filter(pk__in=drifted).values_list('pk'))
+        counts = count_sources(spec, set(drifted.values()))
+        groups = defaultdict(list)
+        for pk, key in drifted.items():
+            groups[counts.get(key, 0)].append(pk)
+        updated = 0
+        for value, pks in groups.items():
+            updated += spec.target.objects.filter(pk__in=pks).update(**{spec.field: value})
+    return updated
+
+
+def changed_target_ids(spec, since):
+    """自 since 以来源表有变化的目标行主键"""
+    keys = set(
+        spec.source.objects.filter(**{f'{spec.changed_field}__gte': since})
+        .values_list(*spec.group_by).order_by().distinct()
+    )
+    keys = {key for key in keys if None not in key}
+    if spec.target_keys == ('id',):
+        return sorted(key[0] for key in keys)
+    lookups = {
+        f'{target_key}__in': {key[i] for key in keys}
+        for i, target_key in enumerate(spec.target_keys)
+    }
+    targets = spec.target.objects.filter(**lookups).values_list('pk', *spec.target_keys)
+    return sorted(pk for pk, *key in targets if tuple(key) in keys)
+
+
+def reconcile(specs=None, since=None, fix=True, chunk_size=1000):
+    """对账并返回各计数字段的 DriftReport；since 为 None 时全量对账"""
+    reports = []
+    for spec in specs or COUNTERS:
+        report = DriftReport(spec)
+        if since is None:
+            last_pk = 0
+            while True:
+                chunk = spec.target.objects.filter(pk__gt=last_pk).order_by('pk')[:chunk_size]
+                pks = list(chunk.values_list('pk', flat=True))
+                if not pks:
+                    break
+                last_pk = pks[-1]
+                reconcile_chunk(spec, spec.target.objects.filter(pk__in=pks), report, fix)
+        else:
+            pks = changed_target_ids(spec, since)
+            for start in range(0, len(pks), chunk_size):
+                reconcile_chunk(spec, spec.target.objects.filter(pk__in=pks[start:start + chunk_size]), report, fix)
+        reports.append(report)
+    return reports
+
+
+def get_last_run():
+    return cache.get(LAST_RUN_CACHE_KEY)
+
+
+def set_last_run(started_at):
+    cache.set(LAST_RUN_CACHE_KEY, started_at, None)
@@ -0,0 +1,146 @@
+"""
+匿名读接口的响应缓存
+
+分类列表、推荐/热门贴吧、贴吧详情、热门/推荐帖子和帖子列表首页对所有匿名访客返回相同内容，
+用 cache_anonymous_response 缓存响应数据（经 get_or_fill 单飞填充），
+键由路径、查询参数和所依赖范围的版本号组成：
+    category            分类
+    tieba               全部贴吧
+    tieba:<id>          单个贴吧（含公告）
+    post                全部帖子
+    post:tieba:<id>     某个贴吧的帖子
+    hot_posts           热榜，hot_scores 刷新热榜后更新
+    comments:post:<id>  某个帖子下的评论（含点赞），供 conditional 计算评论接口的 ETag
+Tieba、Post、Category、TiebaAnnouncement、Comment 保存或删除后（事务提交时）由信号更新相关范围的版本号，
+旧版本的缓存不再被命中，等待过期即可，因此无需按键逐个删除。
+版本号取纳秒时间戳而不是自增值，版本键被淘汰后重新生成的版本不会与旧缓存重合。
+版本键保留 RESPONSE_CACHE_VERSION_TIMEOUT 秒，应长于响应缓存连同过期可用期的最长保留时间，
+不再被访问的范围（如已删除的贴吧）的版本键随之过期。
+
+计数字段（成员数、回复数等）通过 UPDATE 原子修改，不触发信号，
+只在 RESPONSE_CACHE_TIMEOUT 内存在有限的延迟。登录用户和非 GET 请求不走缓存。
+"""
+
+import functools
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from rest_framework.response import Response
+
+from .cache_fill import get_or_fill
+
+VERSION_KEY = 'response_cache:version:{scope}'
+RESPONSE_KEY = 'response_cache:{digest}'
+
+
+def version_timeout():
+    return getattr(settings, 'RESPONSE_CACHE_VERSION_TIMEOUT', 86400)
+
+
+def get_versions(scopes):
+    """读取各范围的版本号，不存在时生成"""
+    keys = {VERSION_KEY.format(scope=scope): scope for scope in scopes}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, time.time_ns(), version_timeout())
+        versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """更新范围的版本号，使依赖它们的缓存失效"""
+    version = time.time_ns()
+    cache.set_many({VERSION_KEY.format(scope=scope): version for scope in scopes}, version_timeout())
+
+
+def bump_on_commit(*scopes):
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def response_key(request, scopes):
+    query = urlencode(sorted(request.GET.items()))
+    versions = get_versions(scopes)
+    raw = f'{request.path}?{query}|{"|".join(scopes)}|{versions}'
+    return RESPONSE_KEY.format(digest=hashlib.md5(raw.encode()).hexdigest())
+
+
+class _Uncacheable(Exception):
+    """视图返回了非 200 响应，不写入缓存"""
+
+    def __init__(self, response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def cache_anonymous_response(scopes, timeout=None, when=None):
+    """缓存匿名 GET 请求的 200 响应
+
+    scopes 为范围列表，或接收 (request, **视图参数) 返回范围列表的函数；
+    when 接收 request，返回 False 时不使用缓存（例如非首页）。
+    可直接修饰函数视图，APIView 方法需配合 method_decorator 使用。
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET' or request.user.is_authenticated
+                    or (when is not None and not when(request))):
+                return view(request, *args, **kwargs)
+
+            view_scopes = scopes(request, **kwargs) if callable(scopes) else scopes
+            key = response_key(request, view_scopes)
+            ttl = timeout if timeout is not None else getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+            def render():
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    raise _Uncacheable(response)
+                return response.data
+
+            try:
+                return Response(get_or_fill(key, render, ttl))
+            except _Uncacheable as exc:
+                return exc.response
+        return wrapper
+    return decorator
+
+
+def _tieba_changed(sender, instance, **kwargs):
+    bump_on_commit('tieba', f'tieba:{instance.pk}')
+
+
+def _post_changed(sender, instance, **kwargs):
+    bump_on_commit('post', f'post:tieba:{instance.tieba_id}')
+
+
+def _category_changed(sender, instance, **kwargs):
+    bump_on_commit('category', 'tieba')
+
+
+def _announcement_changed(sender, instance, **kwargs):
+    bump_on_commit(f'tieba:{instance.tieba_id}')
+
+
+def _comment_changed(sender, instance, **kwargs):
+    bump_on_commit(f'comments:post:{instance.post_id}')
+
+
+def connect_signals():
+    from comments.models import Comment
+    from posts.models import Post
+    from tieba.models import Category, Tieba, TiebaAnnouncement
+
+    handlers = {
+        Tieba: _tieba_changed,
+        Post: _post_changed,
+        Category: _category_changed,
+        TiebaAnnouncement: _announcement_changed,
+        Comment: _comment_changed,
+    }
+    for model, handler in handlers.items():
+        post_save.connect(handler, sender=model, dispatch_uid=f'response_cache_save_{model.__name__}')
+        post_delete.connect(handler, sender=model, dispatch_uid=f'response_cache_delete_{model.__name__}')
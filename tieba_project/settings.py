@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     'tieba',
     'posts',
     'comments',
+    'search',
 ]
 
 MIDDLEWARE = [
@@ -74,9 +75,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # 并发写入时等待锁而不是立即报 database is locked；测试库用文件，
+        # 内存共享缓存模式是表级锁，多线程测试下读写会直接冲突
+        'OPTIONS': {'timeout': 30},
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# 测试时搜索索引和活动归档写到临时目录
+TEST_RUNNER = 'tieba_project.test_runner.TiebaTestRunner'
+
 # MySQL configuration (uncomment for production)
 # DATABASES = {
 #     'default': {
@@ -157,17 +165,102 @@ CORS_ALLOW_CREDENTIALS = True
 # Redis configuration (for caching and Celery)
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
 
-# Cache configuration
+# Cache configuration: 进程内 LRU + 共享缓存（Redis），测试时可把共享缓存换成 LocMemCache
 CACHES = {
     'default': {
-        'BACKEND': 'django_redis.cache.RedisCache',
+        'BACKEND': 'tieba_project.cache_backend.TwoTierCache',
         'LOCATION': REDIS_URL,
         'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'SHARED_BACKEND': config('CACHE_SHARED_BACKEND', default='django.core.cache.backends.redis.RedisCache'),
+            'SHARED_OPTIONS': {
+                'socket_connect_timeout': config('CACHE_SOCKET_TIMEOUT', default=0.5, cast=float),
+                'socket_timeout': config('CACHE_SOCKET_TIMEOUT', default=0.5, cast=float),
+            },
+            'LOCAL_MAX_ENTRIES': config('CACHE_LOCAL_MAX_ENTRIES', default=10000, cast=int),
+            'LOCAL_TIMEOUT': config('CACHE_LOCAL_TIMEOUT', default=5, cast=int),
+            'STALE_TIMEOUT': config('CACHE_STALE_TIMEOUT', default=300, cast=int),
+            'RETRY_INTERVAL': config('CACHE_RETRY_INTERVAL', default=5, cast=int),
         }
     }
 }
 
+# View counter configuration (memory / redis)
+VIEW_COUNTER_BACKEND = config('VIEW_COUNTER_BACKEND', default='memory')
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=10, cast=int)
+
+# Post view history configuration
+VIEW_HISTORY_BATCH_SIZE = config('VIEW_HISTORY_BATCH_SIZE', default=500, cast=int)
+VIEW_HISTORY_FLUSH_INTERVAL = config('VIEW_HISTORY_FLUSH_INTERVAL', default=5, cast=int)
+VIEW_HISTORY_MAX_PER_USER = config('VIEW_HISTORY_MAX_PER_USER', default=500, cast=int)
+VIEW_HISTORY_TTL_DAYS = config('VIEW_HISTORY_TTL_DAYS', default=180, cast=int)
+
+# Full-text search configuration
+SEARCH_BACKEND = config('SEARCH_BACKEND', default='search.backends.SQLiteFTS5Backend')
+SEARCH_INDEX_PATH = config('SEARCH_INDEX_PATH', default=str(BASE_DIR / 'search_index.sqlite3'))
+SEARCH_MAX_RESULTS = config('SEARCH_MAX_RESULTS', default=1000, cast=int)
+SEARCH_INDEX_FLUSH_INTERVAL = config('SEARCH_INDEX_FLUSH_INTERVAL', default=2, cast=int)
+
+# Search suggestion configuration
+SUGGESTION_REBUILD_INTERVAL = config('SUGGESTION_REBUILD_INTERVAL', default=300, cast=int)
+SUGGESTION_TIEBA_LIMIT = config('SUGGESTION_TIEBA_LIMIT', default=50000, cast=int)
+SUGGESTION_POST_LIMIT = config('SUGGESTION_POST_LIMIT', default=20000, cast=int)
+SUGGESTION_QUERY_LIMIT = config('SUGGESTION_QUERY_LIMIT', default=20000, cast=int)
+
+# User activity log configuration
+ACTIVITY_LOG_BATCH_SIZE = config('ACTIVITY_LOG_BATCH_SIZE', default=500, cast=int)
+ACTIVITY_LOG_FLUSH_INTERVAL = config('ACTIVITY_LOG_FLUSH_INTERVAL', default=2, cast=int)
+ACTIVITY_LOG_MAX_QUEUE_SIZE = config('ACTIVITY_LOG_MAX_QUEUE_SIZE', default=20000, cast=int)
+# 高频操作的采样比例，未列出的操作全部记录
+ACTIVITY_LOG_SAMPLE_RATES = {
+    'post_like': config('ACTIVITY_LOG_LIKE_SAMPLE_RATE', default=0.2, cast=float),
+    'comment_like': config('ACTIVITY_LOG_LIKE_SAMPLE_RATE', default=0.2, cast=float),
+}
+# user_activity 表保留的自然月数（含当月），更早的月份归档到 ACTIVITY_ARCHIVE_DIR
+ACTIVITY_HOT_MONTHS = config('ACTIVITY_HOT_MONTHS', default=3, cast=int)
+ACTIVITY_ARCHIVE_DIR = config('ACTIVITY_ARCHIVE_DIR', default=str(BASE_DIR / 'archive' / 'user_activity'))
+
+# Search query log configuration (memory / redis)
+QUERY_LOG_BACKEND = config('QUERY_LOG_BACKEND', default='memory')
+QUERY_LOG_FLUSH_INTERVAL = config('QUERY_LOG_FLUSH_INTERVAL', default=2, cast=int)
+HOT_SEARCH_CACHE_SECONDS = config('HOT_SEARCH_CACHE_SECONDS', default=60, cast=int)
+
+# Tieba activity counter configuration (memory / redis)
+TIEBA_ACTIVITY_BACKEND = config('TIEBA_ACTIVITY_BACKEND', default='memory')
+TIEBA_ACTIVITY_FLUSH_INTERVAL = config('TIEBA_ACTIVITY_FLUSH_INTERVAL', default=5, cast=int)
+TIEBA_ACTIVITY_SNAPSHOT_SECONDS = config('TIEBA_ACTIVITY_SNAPSHOT_SECONDS', default=60, cast=int)
+
+# Post hot score configuration
+HOT_SCORE_DECAY = config('HOT_SCORE_DECAY', default=45000, cast=int)
+HOT_SCORE_FLUSH_INTERVAL = config('HOT_SCORE_FLUSH_INTERVAL', default=30, cast=int)
+HOT_LIST_SIZE = config('HOT_LIST_SIZE', default=100, cast=int)
+HOT_LIST_CACHE_SECONDS = config('HOT_LIST_CACHE_SECONDS', default=600, cast=int)
+
+# Anonymous response cache configuration
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+# 范围版本键的保留时间，应长于 RESPONSE_CACHE_TIMEOUT 加过期可用期
+RESPONSE_CACHE_VERSION_TIMEOUT = config('RESPONSE_CACHE_VERSION_TIMEOUT', default=86400, cast=int)
+
+# Like / collect engine configuration (memory / redis)
+LIKE_STORE_BACKEND = config('LIKE_STORE_BACKEND', default='memory')
+LIKE_FLUSH_INTERVAL = config('LIKE_FLUSH_INTERVAL', default=2, cast=int)
+LIKE_BATCH_SIZE = config('LIKE_BATCH_SIZE', default=1000, cast=int)
+LIKE_MAX_OBJECTS = config('LIKE_MAX_OBJECTS', default=10000, cast=int)
+LIKE_CACHE_SECONDS = config('LIKE_CACHE_SECONDS', default=86400, cast=int)
+# 每个用户布隆过滤器的位数和哈希个数，8192 位、5 个哈希在 800 个点赞内误判率约 1%
+LIKE_BLOOM_BITS = config('LIKE_BLOOM_BITS', default=8192, cast=int)
+LIKE_BLOOM_HASHES = config('LIKE_BLOOM_HASHES', default=5, cast=int)
+
+# Home timeline configuration (memory / redis)
+TIMELINE_BACKEND = config('TIMELINE_BACKEND', default='memory')
+# 每个用户时间线保留的帖子ID数
+TIMELINE_SIZE = config('TIMELINE_SIZE', default=800, cast=int)
+# 粉丝数达到该值的作者发帖不推送，读取时合并
+TIMELINE_FANOUT_THRESHOLD = config('TIMELINE_FANOUT_THRESHOLD', default=10000, cast=int)
+TIMELINE_BATCH_SIZE = config('TIMELINE_BATCH_SIZE', default=1000, cast=int)
+TIMELINE_FLUSH_INTERVAL = config('TIMELINE_FLUSH_INTERVAL', default=1, cast=int)
+TIMELINE_MAX_USERS = config('TIMELINE_MAX_USERS', default=10000, cast=int)
+TIMELINE_CACHE_SECONDS = config('TIMELINE_CACHE_SECONDS', default=259200, cast=int)
+
 # Celery configuration
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
@@ -0,0 +1,29 @@
+"""
+测试运行器
+
+测试期间把搜索索引和活动归档写到临时目录，不污染开发环境的索引文件和归档文件。
+"""
+
+import os
+import tempfile
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TiebaTestRunner(DiscoverRunner):
+    """把文件型存储重定向到临时目录的测试运行器"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._files_dir = tempfile.TemporaryDirectory(prefix='tieba-test-')
+        self._files_override = override_settings(
+            SEARCH_INDEX_PATH=os.path.join(self._files_dir.name, 'search_index.sqlite3'),
+            ACTIVITY_ARCHIVE_DIR=os.path.join(self._files_dir.name, 'archive', 'user_activity'),
+        )
+        self._files_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._files_override.disable()
+        self._files_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,434 @@
+import random
+import threading
+import time
+from collections import Counter
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+from comments.models import Comment
+from posts.models import Post, PostLike
+from tieba.models import Category, Tieba
+from users.models import FollowRelation, User
+from users.views import follow_counters
+
+from .background import BackgroundBatcher, flush_all
+from .cache_backend import TwoTierCache
+from .cache_fill import get_or_fill
+from .conditional import conditional
+from .counters import toggle_relation
+from .likes import MemoryLikeStore, like_engine
+from .pagination import encode_cursor
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+
+
+def run_threads(targets, timeout=10):
+    """并发执行 targets，返回仍未结束的线程数"""
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + timeout
+    for thread in threads:
+        thread.join(max(0, deadline - time.monotonic()))
+    return sum(thread.is_alive() for thread in threads)
+
+
+class BackgroundBatcherTests(SimpleTestCase):
+    """后台批量写入器"""
+
+    def make(self, interval=60):
+        written = []
+        buffer = []
+        lock = threading.Lock()
+
+        def flush():
+            with lock:
+                items = buffer[:]
+                buffer.clear()
+            written.extend(items)
+            return len(items)
+
+        return BackgroundBatcher('test-batcher', flush, interval), buffer, written
+
+    def test_flush_is_synchronous(self):
+        batcher, buffer, written = self.make()
+        buffer.extend([1, 2])
+        self.assertEqual(batcher.flush(), 2)
+        self.assertEqual(written, [1, 2])
+        self.assertEqual(batcher.flush(), 0)
+
+    def test_wake_flushes_in_background(self):
+        batcher, buffer, written = self.make()
+        buffer.append(1)
+        batcher.wake()
+        deadline = time.monotonic() + 5
+        while not written and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(written, [1])
+        batcher.stop()
+
+    def test_stop_writes_the_rest_and_does_not_restart(self):
+        batcher, buffer, written = self.make(interval=0.01)
+        batcher.start()
+        buffer.append(1)
+        batcher.stop()
+        self.assertEqual(written, [1])
+        self.assertFalse(batcher._worker.is_alive())
+        batcher.start()
+        self.assertFalse(batcher._worker.is_alive())
+
+    def test_flush_all_repeats_until_nothing_is_produced(self):
+        upstream, _, _ = self.make()
+        downstream, buffer, written = self.make()
+        produced = []
+
+        def chained():
+            # 上游写入后向下游产生数据
+            if produced:
+                return 0
+            produced.append(1)
+            buffer.append('derived')
+            return 1
+
+        upstream._flush = chained
+        flush_all()
+        self.assertEqual(written, ['derived'])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class GetOrFillTests(SimpleTestCase):
+    """防击穿缓存填充"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        results = []
+        alive = run_threads([lambda: results.append(get_or_fill('k', compute, 60))] * 20)
+        self.assertEqual(alive, 0)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 20)
+
+    def test_nested_fills_do_not_block_each_other(self):
+        barrier = threading.Barrier(2)
+
+        def outer(key, inner_key):
+            def compute():
+                # 两个线程都在填充外层键时再填充各自的内层键
+                barrier.wait(5)
+                return get_or_fill(inner_key, lambda: inner_key, 60)
+            return lambda: get_or_fill(key, compute, 60)
+
+        started = time.monotonic()
+        alive = run_threads([outer('a', 'c'), outer('b', 'd')])
+        self.assertEqual(alive, 0)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(get_or_fill('a', lambda: None, 60), 'c')
+
+    def test_dependency_cycle_is_bounded_by_lock_timeout(self):
+        barrier = threading.Barrier(2)
+
+        def outer(key, other):
+            def compute():
+                barrier.wait(5)
+                return get_or_fill(other, lambda: other, 60, lock_timeout=0.5)
+            return lambda: get_or_fill(key, compute, 60, lock_timeout=0.5)
+
+        self.assertEqual(run_threads([outer('a', 'b'), outer('b', 'a')], timeout=5), 0)
+
+    def test_same_thread_reentry_computes_directly(self):
+        def compute():
+            return get_or_fill('k', lambda: 'inner', 60, lock_timeout=5)
+
+        started = time.monotonic()
+        self.assertEqual(get_or_fill('k', compute, 60, lock_timeout=5), 'inner')
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class TwoTierCacheTests(SimpleTestCase):
+    """两级缓存：以 LocMemCache 作为共享缓存"""
+
+    def setUp(self):
+        # 本地 LRU 按 LOCATION 在进程内共享，每个用例用独立的 LOCATION
+        self.cache = TwoTierCache(self.id(), {'OPTIONS': {
+            'SHARED_BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCAL_TIMEOUT': 0.1,
+            'STALE_TIMEOUT': 60,
+            'RETRY_INTERVAL': 60,
+        }})
+        self.shared = self.cache.shared
+
+    def tearDown(self):
+        self.cache.clear()
+
+    def counts(self, *names):
+        stats = self.cache.stats()
+        return tuple(stats[name] for name in names)
+
+    def test_local_hit_does_not_touch_shared(self):
+        self.cache.set('k', 'v')
+        with mock.patch.object(self.shared, 'get', side_effect=AssertionError('shared get')):
+            self.assertEqual(self.cache.get('k'), 'v')
+        self.assertEqual(self.counts('local_hits', 'shared_hits', 'misses'), (1, 0, 0))
+
+    def test_shared_hit_fills_local_and_miss_returns_default(self):
+        self.shared.set('k', 'v')
+        self.assertEqual(self.cache.get('k'), 'v')
+        self.assertEqual(self.cache.get('k'), 'v')
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.assertEqual(self.counts('local_hits', 'shared_hits', 'misses'), (1, 1, 1))
+
+    def test_get_many_batches_local_misses(self):
+        self.cache.set('local', 1)
+        self.shared.set('shared', 2)
+        with mock.patch.object(self.shared, 'get_many', wraps=self.shared.get_many) as get_many:
+            result = self.cache.get_many(['local', 'shared', 'missing'])
+        self.assertEqual(result, {'local': 1, 'shared': 2})
+        get_many.assert_called_once_with(['shared', 'missing'], version=None)
+        self.assertEqual(self.counts('local_hits', 'shared_hits', 'misses'), (1, 1, 1))
+        self.assertEqual(self.cache.get_many(['local', 'shared']), {'local': 1, 'shared': 2})
+        self.assertEqual(self.counts('local_hits'), (3,))
+
+    def test_serves_stale_entries_while_shared_fails(self):
+        self.cache.set('k', 'v')
+        self.cache.set_many({'a': 1, 'b': 2})
+        time.sleep(0.15)
+        with mock.patch.object(self.shared, 'get', side_effect=ConnectionError('down')) as get:
+            self.assertEqual(self.cache.get('k'), 'v')
+            self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        # 出错后在 RETRY_INTERVAL 内不再访问共享缓存
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(self.cache.get_many(['a', 'b', 'missing']), {'a': 1, 'b': 2})
+        stats = self.cache.stats()
+        self.assertEqual((stats['stale_hits'], stats['misses'], stats['errors']), (3, 2, 1))
+        self.assertFalse(stats['shared_available'])
+
+        # 降级期间写入只写本地
+        self.cache.set('k', 'new')
+        self.assertEqual(self.cache.get('k'), 'new')
+        self.assertEqual(self.shared.get('k'), 'v')
+
+    def test_stats(self):
+        self.cache.set('k', 'v')
+        self.cache.get('k')
+        self.cache.get('missing')
+        stats = self.cache.stats()
+        self.assertEqual(stats['hit_rate'], 0.5)
+        self.assertEqual(stats['local_entries'], 1)
+        self.assertGreater(stats['shared_calls'], 0)
+        self.assertTrue(stats['shared_available'])
+        self.cache.reset_stats()
+        self.assertEqual(self.counts('local_hits', 'misses', 'shared_calls'), (0, 0, 0))
+
+    def test_add_and_incr_use_the_shared_result(self):
+        # 其他进程已持有锁：本地没有该键，add 仍以共享缓存为准
+        self.shared.add('lock', 'other')
+        self.assertFalse(self.cache.add('lock', 'mine'))
+        self.assertTrue(self.cache.add('free', 'mine'))
+        self.assertEqual(self.shared.get('free'), 'mine')
+
+        self.shared.set('n', 1)
+        self.assertEqual(self.cache.get('n'), 1)
+        self.shared.incr('n')
+        self.assertEqual(self.cache.incr('n'), 3)
+        self.assertEqual(self.cache.get('n'), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CounterStressTests(TransactionTestCase):
+    """大量并发切换后计数与关系行完全一致"""
+
+    THREADS = 16
+    TOGGLES_PER_THREAD = 150
+
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            User.objects.create_user(username=f'user{i}', password='password', email=f'user{i}@example.com')
+            for i in range(8)
+        ]
+        category = Category.objects.create(name='category')
+        tieba = Tieba.objects.create(name='tieba', owner=self.users[0], category=category, status=1)
+        self.posts = [
+            Post.objects.create(title=f'帖子{i}', content='内容', author=self.users[0], tieba=tieba, status=1)
+            for i in range(4)
+        ]
+
+    def tearDown(self):
+        flush_all()
+
+    def run_workers(self, work):
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.TOGGLES_PER_THREAD):
+                    work(rng)
+            finally:
+                connection.close()
+        self.assertEqual(run_threads([lambda seed=seed: worker(seed) for seed in range(self.THREADS)], timeout=300), 0)
+
+    def test_concurrent_follow_toggles(self):
+        user_ids = [user.id for user in self.users]
+
+        def toggle(rng):
+            follower_id, following_id = rng.sample(user_ids, 2)
+            toggle_relation(
+                FollowRelation, follow_counters(follower_id, following_id),
+                follower_id=follower_id, following_id=following_id,
+            )
+
+        self.run_workers(toggle)
+        followers = dict(FollowRelation.objects.values_list('following_id').annotate(total=Count('pk')).order_by())
+        following = dict(FollowRelation.objects.values_list('follower_id').annotate(total=Count('pk')).order_by())
+        for user in User.objects.filter(id__in=user_ids):
+            self.assertEqual(user.follower_count, followers.get(user.id, 0))
+            self.assertEqual(user.following_count, following.get(user.id, 0))
+
+    def test_concurrent_like_toggles(self):
+        toggles = Counter()
+        lock = threading.Lock()
+        user_ids = [user.id for user in self.users]
+        post_ids = [post.id for post in self.posts]
+
+        def toggle(rng):
+            pair = (rng.choice(post_ids), rng.choice(user_ids))
+            like_engine.toggle(PostLike, *pair)
+            with lock:
+                toggles[pair] += 1
+            # 切换的同时不断写入，覆盖写入与加载、切换交错的情况
+            if rng.random() < 0.05:
+                like_engine.flush()
+
+        self.run_workers(toggle)
+        like_engine.flush()
+
+        liked = {pair for pair, times in toggles.items() if times % 2}
+        self.assertEqual(set(PostLike.objects.values_list('post_id', 'user_id')), liked)
+        for post in Post.objects.filter(id__in=post_ids):
+            self.assertEqual(post.like_count, sum(1 for post_id, _ in liked if post_id == post.id))
+
+
+class MemoryLikeStoreTests(SimpleTestCase):
+    """取走但尚未提交的记录所在对象不会被淘汰"""
+
+    def test_flushing_objects_are_not_evicted(self):
+        store = MemoryLikeStore(max_objects=1, bloom_bits=64, bloom_hashes=2)
+        store.load('posts.PostLike', 1, [])
+        store.toggle('posts.PostLike', 1, 10, time.time())
+        pending = store.drain()
+
+        store.load('posts.PostLike', 2, [])
+        self.assertEqual(store.members('posts.PostLike', [1], 10), {1: True})
+
+        store.done(pending)
+        store.load('posts.PostLike', 3, [])
+        self.assertEqual(store.members('posts.PostLike', [1], 10), {})
+
+    def test_restored_objects_stay_pinned(self):
+        store = MemoryLikeStore(max_objects=1, bloom_bits=64, bloom_hashes=2)
+        store.load('posts.PostLike', 1, [])
+        store.toggle('posts.PostLike', 1, 10, time.time())
+        store.restore(store.drain())
+        store.load('posts.PostLike', 2, [])
+        self.assertEqual(store.members('posts.PostLike', [1], 10), {1: True})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTests(TestCase):
+    """游标取值与排序字段类型不符时返回 404"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        category = Category.objects.create(name='category')
+        self.tieba = Tieba.objects.create(name='tieba', owner=self.user, category=category, status=1)
+        self.post = Post.objects.create(title='帖子', content='内容', author=self.user, tieba=self.tieba, status=1)
+        self.client = APIClient()
+
+    def tearDown(self):
+        flush_all()
+
+    def get(self, url, cursor):
+        return self.client.get(url, {'cursor': encode_cursor(cursor)})
+
+    def test_wrongly_typed_cursor_values_return_404(self):
+        comments = reverse('comment-list', args=[self.post.id])
+        members = reverse('tieba-members', args=[self.tieba.id])
+        self.assertEqual(self.get(comments, ['abc', 'def']).status_code, 404)
+        self.assertEqual(self.get(comments, [[1], {'a': 1}]).status_code, 404)
+        self.assertEqual(self.get(members, ['x', 'y']).status_code, 404)
+
+    def test_valid_cursor_pages_through(self):
+        comments = [
+            Comment.objects.create(post=self.post, author=self.user, content=f'评论{i}', floor_number=i, status=1)
+            for i in range(1, 4)
+        ]
+        url = reverse('comment-list', args=[self.post.id])
+        response = self.get(url, [comments[0].floor_number, comments[0].id])
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ConditionalGetTests(TransactionTestCase):
+    """带计数的接口只按 ETag 协商，If-Modified-Since 不会返回过期的计数"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='author', password='password', email='author@example.com')
+        tieba = Tieba.objects.create(name='tieba', owner=user, status=1)
+        self.post = Post.objects.create(title='帖子', content='内容', author=user, tieba=tieba, status=1)
+        self.url = reverse('post-detail', args=[self.post.id])
+        self.client = APIClient()
+
+    def tearDown(self):
+        flush_all()
+
+    def test_counter_endpoints_use_etag_only(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        future = http_date(time.time() + 3600)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=future).status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Post.objects.filter(pk=self.post.pk).update(like_count=3)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like_count'], 3)
+
+
+class ConditionalLastModifiedTests(SimpleTestCase):
+    """last_modified=True 的接口发送 Last-Modified 并处理 If-Modified-Since"""
+
+    def test_opt_in_last_modified(self):
+        modified_at = timezone.now() - timezone.timedelta(hours=1)
+        view = conditional(lambda request: (['v1'], modified_at), last_modified=True)(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+
+        request = factory.get('/resource/')
+        request.user = AnonymousUser()
+        response = view(request)
+        self.assertEqual(response['Last-Modified'], http_date(int(modified_at.timestamp())))
+
+        request = factory.get('/resource/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        request.user = AnonymousUser()
+        self.assertEqual(view(request).status_code, 304)
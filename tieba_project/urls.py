@@ -11,6 +11,7 @@ urlpatterns = [
     path('api/tieba/', include('tieba.urls')),
     path('api/posts/', include('posts.urls')),
     path('api/comments/', include('comments.urls')),
+    path('api/search/', include('search.urls')),
 ]
 
 # Serve media files in development
@@ -0,0 +1,173 @@
+"""
+用户活动按月归档
+
+user_activity 表只保留最近 ACTIVITY_HOT_MONTHS 个自然月（含当月，按 TIME_ZONE 划分）的记录，
+更早的月份由 archive_user_activity 命令导出为按月分区的 JSONL.gz 文件：
+    ACTIVITY_ARCHIVE_DIR/user_activity-2024-01.jsonl.gz
+同一个月再次归档（例如迟到的记录）时追加为 user_activity-2024-01.1.jsonl.gz 等分片。
+
+需求原本是按月对 user_activity 做表分区，但项目使用的 SQLite（以及 Django ORM）不支持声明式分区，
+因此改为“热表保留 + 归档文件”：表中只留最近几个月，冷数据按月写入文件，效果等同于按月分区后卸载旧分区。
+
+归档按 created_at < 截止时间 选取记录（异步写入的记录主键顺序与时间顺序不一定一致），
+按主键分批导出；文件写完并改名后，只按导出的主键删除，不会删到导出之后写入的记录。
+
+iter_activities 同时查询归档文件和数据库，供审计使用。
+"""
+
+import glob
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import UserActivity
+
+ARCHIVE_FIELDS = [
+    'id', 'user_id', 'action', 'target_type', 'target_id', 'ip_address', 'user_agent', 'created_at',
+]
+
+
+def get_archive_dir():
+    return str(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive', 'user_activity')))
+
+
+def month_start(value):
+    """value 所在自然月（当地时区）第一天零点"""
+    local = timezone.localtime(value)
+    return local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    """把月初时间 start 前后移动 months 个月"""
+    index = start.year * 12 + start.month - 1 + months
+    naive = start.replace(tzinfo=None, year=index // 12, month=index % 12 + 1)
+    return timezone.make_aware(naive)
+
+
+def month_label(value):
+    return timezone.localtime(value).strftime('%Y-%m')
+
+
+def archive_cutoff(hot_months=None, now=None):
+    """早于该时间的记录应归档"""
+    hot_months = hot_months or getattr(settings, 'ACTIVITY_HOT_MONTHS', 3)
+    return add_months(month_start(now or timezone.now()), 1 - hot_months)
+
+
+def _month_paths(label, archive_dir=None):
+    pattern = os.path.join(archive_dir or get_archive_dir(), f'user_activity-{label}*.jsonl.gz')
+    return sorted(glob.glob(pattern))
+
+
+def _new_month_path(label, archive_dir):
+    part = len(_month_paths(label, archive_dir))
+    suffix = f'.{part}' if part else ''
+    return os.path.join(archive_dir, f'user_activity-{label}{suffix}.jsonl.gz')
+
+
+class _MonthWriters:
+    """按月份写入临时文件，全部成功后再改名为正式文件"""
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self._files = {}
+        self.counts = {}
+
+    def write(self, row):
+        label = month_label(row['created_at'])
+        handle = self._files.get(label)
+        if handle is None:
+            path = _new_month_path(label, self.archive_dir)
+            handle = self._files[label] = (path, gzip.open(path + '.tmp', 'wt', encoding='utf-8'))
+            self.counts[label] = 0
+        record = dict(row, created_at=row['created_at'].isoformat())
+        handle[1].write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.counts[label] += 1
+
+    def commit(self):
+        for path, handle in self._files.values():
+            handle.close()
+            os.replace(path + '.tmp', path)
+
+    def abort(self):
+        for path, handle in self._files.values():
+            handle.close()
+            os.remove(path + '.tmp')
+
+
+def archive_before(cutoff, chunk_size=5000, archive_dir=None):
+    """把早于 cutoff 的记录导出到按月归档文件并从表中删除，返回 {月份: 条数}"""
+    archive_dir = archive_dir or get_archive_dir()
+    os.makedirs(archive_dir, exist_ok=True)
+    writers = _MonthWriters(archive_dir)
+
+    exported = []
+    queryset = UserActivity.objects.filter(created_at__lt=cutoff).order_by('id').values(*ARCHIVE_FIELDS)
+    try:
+        while True:
+            last_id = exported[-1] if exported else 0
+            rows = list(queryset.filter(id__gt=last_id)[:chunk_size])
+            if not rows:
+                break
+            for row in rows:
+                writers.write(row)
+                exported.append(row['id'])
+    except BaseException:
+        writers.abort()
+        raise
+    writers.commit()
+
+    for start in range(0, len(exported), chunk_size):
+        UserActivity.objects.filter(id__in=exported[start:start + chunk_size]).delete()
+    return writers.counts
+
+
+def _read_month(label, archive_dir):
+    seen = set()
+    for path in _month_paths(label, archive_dir):
+        with gzip.open(path, 'rt', encoding='utf-8') as handle:
+            for line in handle:
+                record = json.loads(line)
+                if record['id'] in seen:
+                    # 归档后删除前中断会重复导出，按主键去重
+                    continue
+                seen.add(record['id'])
+                record['created_at'] = parse_datetime(record['created_at'])
+                yield record
+
+
+def iter_activities(user_id=None, action=None, target_type=None, target_id=None,
+                    start=None, end=None, archive_dir=None):
+    """按时间顺序遍历 [start, end) 内的活动记录，依次读取归档文件和数据库"""
+    archive_dir = archive_dir or get_archive_dir()
+    filters = {'user_id': user_id, 'action': action, 'target_type': target_type, 'target_id': target_id}
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    def matches(record):
+        if any(record[key] != value for key, value in filters.items()):
+            return False
+        return (start is None or record['created_at'] >= start) and (end is None or record['created_at'] < end)
+
+    labels = sorted({
+        os.path.basename(path)[len('user_activity-'):][:7]
+        for path in glob.glob(os.path.join(archive_dir, 'user_activity-*.jsonl.gz'))
+    })
+    for label in labels:
+        if start is not None and label < month_label(start):
+            continue
+        if end is not None and label > month_label(end):
+            continue
+        for record in _read_month(label, archive_dir):
+            if matches(record):
+                yield record
+
+    queryset = UserActivity.objects.filter(**filters)
+    if start is not None:
+        queryset = queryset.filter(created_at__gte=start)
+    if end is not None:
+        queryset = queryset.filter(created_at__lt=end)
+    yield from queryset.order_by('created_at', 'id').values(*ARCHIVE_FIELDS).iterator()
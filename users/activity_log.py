@@ -0,0 +1,107 @@
+"""
+用户活动异步记录
+
+视图调用 activity_logger.log(...) 只把 UserActivity 对象放入有界队列，
+由后台线程凑满 ACTIVITY_LOG_BATCH_SIZE 条或等待 ACTIVITY_LOG_FLUSH_INTERVAL 秒后
+一次 bulk_create 写入，请求中不再执行 INSERT。整批写入违反约束时（如用户已被删除）
+逐条重试，只丢弃写不进去的记录。
+
+采样：ACTIVITY_LOG_SAMPLE_RATES 中列出的高频操作（如点赞）只按比例记录。
+背压：队列满时，可采样的高频操作直接丢弃；登录、发帖等其他操作退回到同步写入，
+保证不丢失，同时自然地减慢产生日志的请求。
+"""
+
+import logging
+import queue
+import random
+
+from django.conf import settings
+from django.db import DataError, IntegrityError, transaction
+from django.utils import timezone
+
+from tieba_project.background import BackgroundBatcher
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityLogger:
+    """用户活动批量记录器"""
+
+    def __init__(self, batch_size, flush_interval, max_queue_size, sample_rates):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rates = sample_rates
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._batcher = BackgroundBatcher(
+            'activity-logger', self.flush, flush_interval, '用户活动批量写入失败，丢弃该批记录'
+        )
+        self.dropped = 0
+
+    def log(self, user, action, **fields):
+        """记录一次用户活动，返回是否被记录（未被采样丢弃）"""
+        from .models import UserActivity
+
+        rate = self.sample_rates.get(action, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+
+        activity = UserActivity(user_id=user.pk, action=action, created_at=timezone.now(), **fields)
+        try:
+            self._queue.put_nowait(activity)
+        except queue.Full:
+            if rate < 1.0:
+                self.dropped += 1
+                return False
+            # 队列积压时重要操作同步写入
+            activity.save()
+            return True
+        if self._queue.qsize() >= self.batch_size:
+            self._batcher.wake()
+        else:
+            self._batcher.start()
+        return True
+
+    def flush(self):
+        """按批次同步写入队列中的全部记录，返回写入条数"""
+        total = 0
+        while True:
+            activities = []
+            while len(activities) < self.batch_size:
+                try:
+                    activities.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not activities:
+                return total
+            self._write(activities)
+            total += len(activities)
+
+    def _write(self, activities):
+        from .models import UserActivity
+
+        try:
+            with transaction.atomic():
+                UserActivity.objects.bulk_create(activities, batch_size=self.batch_size)
+            return
+        except (IntegrityError, DataError):
+            pass
+        # 整批失败时逐条写入，一条记录的外键失效不影响同批的其他记录
+        for activity in activities:
+            activity.pk = None
+            try:
+                with transaction.atomic():
+                    activity.save(force_insert=True)
+            except (IntegrityError, DataError) as exc:
+                logger.warning(
+                    '丢弃无法写入的用户活动 user=%s action=%s target=%s:%s（%s）',
+                    activity.user_id, activity.action, activity.target_type, activity.target_id, exc,
+                )
+
+
+activity_logger = ActivityLogger(
+    batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 500),
+    flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 2),
+    max_queue_size=getattr(settings, 'ACTIVITY_LOG_MAX_QUEUE_SIZE', 20000),
+    sample_rates=getattr(settings, 'ACTIVITY_LOG_SAMPLE_RATES', {}),
+)
+
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from users.activity_archive import archive_before, archive_cutoff, get_archive_dir
+
+
+class Command(BaseCommand):
+    """归档已关闭月份的用户活动，建议每月初由定时任务执行"""
+
+    help = '把 ACTIVITY_HOT_MONTHS 之前的用户活动导出为按月的 JSONL.gz 文件并从 user_activity 表删除'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=None, help='表中保留的自然月数（含当月）')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='每次读取和删除的行数')
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['keep_months'])
+        self.stdout.write(f'归档 {cutoff:%Y-%m-%d} 之前的用户活动到 {get_archive_dir()}')
+        counts = archive_before(cutoff, chunk_size=options['chunk_size'])
+        if not counts:
+            self.stdout.write('没有需要归档的记录')
+            return
+        for label, count in sorted(counts.items()):
+            self.stdout.write(f'{label}: {count} 条')
+        self.stdout.write(self.style.SUCCESS(f'共归档 {sum(counts.values())} 条'))
@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from users.activity_archive import iter_activities
+
+
+def _parse_day(value):
+    day = parse_date(value)
+    if day is None:
+        raise CommandError(f'日期格式应为 YYYY-MM-DD: {value}')
+    return timezone.make_aware(timezone.datetime(day.year, day.month, day.day))
+
+
+class Command(BaseCommand):
+    """查询用户活动（含已归档月份），每行输出一条 JSON"""
+
+    help = '按用户、操作和时间范围查询用户活动，包括已归档的月份'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=None, help='用户ID')
+        parser.add_argument('--action', default=None, help='操作类型')
+        parser.add_argument('--target-type', default=None, help='目标类型')
+        parser.add_argument('--target-id', type=int, default=None, help='目标ID')
+        parser.add_argument('--start', default=None, help='开始日期（含），YYYY-MM-DD')
+        parser.add_argument('--end', default=None, help='结束日期（不含），YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        records = iter_activities(
+            user_id=options['user'],
+            action=options['action'],
+            target_type=options['target_type'],
+            target_id=options['target_id'],
+            start=_parse_day(options['start']) if options['start'] else None,
+            end=_parse_day(options['end']) if options['end'] else None,
+        )
+        for record in records:
+            record = dict(record, created_at=record['created_at'].isoformat())
+            self.stdout.write(json.dumps(record, ensure_ascii=False))
@@ -96,6 +96,10 @@ class FollowRelation(models.Model):
     class Meta:
         db_table = 'follow_relation'
         unique_together = ('follower', 'following')
+        indexes = [
+            models.Index(fields=['follower', 'created_at']),
+            models.Index(fields=['following', 'created_at']),
+        ]
         verbose_name = '关注关系'
         verbose_name_plural = '关注关系'
 
@@ -104,11 +108,21 @@ class UserActivity(models.Model):
     """用户活动记录"""
     
     ACTION_CHOICES = [
+        ('register', '注册'),
         ('login', '登录'),
         ('logout', '登出'),
         ('post_create', '发帖'),
+        ('post_update', '编辑帖子'),
+        ('post_delete', '删除帖子'),
         ('post_like', '点赞帖子'),
+        ('post_collect', '收藏帖子'),
         ('comment_create', '评论'),
+        ('comment_update', '编辑评论'),
+        ('comment_delete', '删除评论'),
+        ('comment_like', '点赞评论'),
+        ('tieba_create', '创建贴吧'),
+        ('join_tieba', '加入贴吧'),
+        ('leave_tieba', '离开贴吧'),
         ('follow', '关注'),
         ('unfollow', '取消关注'),
     ]
@@ -128,4 +142,5 @@ class UserActivity(models.Model):
         indexes = [
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['action', 'created_at']),
+            models.Index(fields=['created_at']),
         ]
\ No newline at end of file
@@ -71,6 +71,15 @@ class UserSerializer(serializers.ModelSerializer):
                            'follower_count', 'following_count']
 
 
+class UserSimpleSerializer(serializers.ModelSerializer):
+    """用户卡片序列化器，用于列表中的作者、吧主等公开展示"""
+    
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'nickname', 'avatar']
+        read_only_fields = fields
+
+
 class UserUpdateSerializer(serializers.ModelSerializer):
     """用户更新序列化器"""
     
@@ -0,0 +1,106 @@
+import os
+import tempfile
+from datetime import timedelta
+
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from tieba_project.background import flush_all
+
+from .activity_archive import archive_before, iter_activities, month_label
+from .activity_log import ActivityLogger
+from .models import User, UserActivity
+
+
+class ActivityLoggerTests(TransactionTestCase):
+    """用户活动批量写入"""
+
+    def setUp(self):
+        self.logger = ActivityLogger(batch_size=500, flush_interval=60, max_queue_size=10, sample_rates={})
+        self.user = User.objects.create_user(username='user', password='password', email='user@example.com')
+
+    def tearDown(self):
+        flush_all()
+
+    def test_one_bad_row_does_not_discard_the_batch(self):
+        removed = User.objects.create_user(username='removed', password='password', email='removed@example.com')
+        for action in ('login', 'post_create'):
+            self.logger.log(self.user, action)
+        self.logger.log(removed, 'login')
+        self.logger.log(self.user, 'logout')
+        removed_id = removed.pk
+        removed.delete()
+
+        with self.assertLogs('users.activity_log', 'WARNING') as logs:
+            self.assertEqual(self.logger.flush(), 4)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn(f'user={removed_id} action=login', logs.output[0])
+        self.assertEqual(
+            sorted(UserActivity.objects.values_list('action', flat=True)), ['login', 'logout', 'post_create']
+        )
+
+    def test_sampled_actions_are_dropped_at_rate_zero(self):
+        sampled = ActivityLogger(batch_size=500, flush_interval=60, max_queue_size=10, sample_rates={'post_like': 0})
+        self.assertFalse(sampled.log(self.user, 'post_like'))
+        self.assertTrue(sampled.log(self.user, 'login'))
+        self.assertEqual(sampled.flush(), 1)
+
+    def test_full_queue_writes_important_actions_synchronously(self):
+        small = ActivityLogger(
+            batch_size=500, flush_interval=60, max_queue_size=1, sample_rates={'post_like': 0.999999}
+        )
+        small.log(self.user, 'login')
+        small.log(self.user, 'post_create')
+        self.assertEqual(list(UserActivity.objects.values_list('action', flat=True)), ['post_create'])
+        self.assertFalse(small.log(self.user, 'post_like'))
+        self.assertEqual(small.dropped, 1)
+        self.assertEqual(small.flush(), 1)
+
+
+class ActivityArchiveTests(TestCase):
+    """按 created_at 归档，按导出的主键删除，归档后仍可按时间查询"""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.user = User.objects.create_user(username='user', password='password', email='user@example.com')
+        self.cutoff = timezone.make_aware(timezone.datetime(2024, 3, 1))
+
+    def log(self, action, created_at):
+        return UserActivity.objects.create(user=self.user, action=action, created_at=created_at)
+
+    def test_cutoff_boundary_and_late_rows(self):
+        old = self.log('login', self.cutoff - timedelta(days=40))
+        self.log('logout', self.cutoff)
+        # 异步写入的迟到记录主键更大，时间却早于截止时间
+        late = self.log('follow', self.cutoff - timedelta(seconds=1))
+        newer = self.log('unfollow', self.cutoff + timedelta(days=1))
+
+        counts = archive_before(self.cutoff, chunk_size=1, archive_dir=self.dir.name)
+        self.assertEqual(counts, {month_label(old.created_at): 1, month_label(late.created_at): 1})
+        self.assertEqual(
+            sorted(UserActivity.objects.values_list('action', flat=True)), ['logout', 'unfollow']
+        )
+        self.assertEqual(archive_before(self.cutoff, archive_dir=self.dir.name), {})
+        self.assertTrue(UserActivity.objects.filter(pk=newer.pk).exists())
+
+    def test_round_trip_through_iter_activities(self):
+        created = [self.cutoff - timedelta(days=40), self.cutoff - timedelta(days=1), self.cutoff + timedelta(hours=1)]
+        for index, created_at in enumerate(created):
+            UserActivity.objects.create(
+                user=self.user, action='login', target_type='post', target_id=index,
+                ip_address=f'10.0.0.{index}', created_at=created_at,
+            )
+        archive_before(self.cutoff, archive_dir=self.dir.name)
+        self.assertEqual(len(os.listdir(self.dir.name)), 2)
+
+        records = list(iter_activities(user_id=self.user.id, archive_dir=self.dir.name))
+        self.assertEqual([record['created_at'] for record in records], created)
+        self.assertEqual([record['target_id'] for record in records], [0, 1, 2])
+        self.assertEqual(records[0]['ip_address'], '10.0.0.0')
+
+        window = iter_activities(
+            target_type='post', start=self.cutoff - timedelta(days=2), end=self.cutoff + timedelta(days=1),
+            archive_dir=self.dir.name,
+        )
+        self.assertEqual([record['target_id'] for record in window], [1, 2])
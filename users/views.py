@@ -5,9 +5,14 @@ from rest_framework.views import APIView
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.db.models import Q
 
-from .models import User, UserProfile, FollowRelation, UserActivity
+from .models import User, UserProfile, FollowRelation
+from .activity_log import activity_logger
+from posts.timeline import home_timeline
+from search.backends import DOC_USER
+from search.indexer import load_in_order, search_ids
+from tieba_project.counters import CounterRef, add_relation, remove_relation
+from tieba_project.pagination import KeysetPagination
 from .serializers import (
     UserRegistrationSerializer, UserLoginSerializer, UserSerializer,
     UserUpdateSerializer, PasswordChangeSerializer, FollowRelationSerializer,
@@ -29,7 +34,7 @@ class UserRegistrationView(APIView):
             UserProfile.objects.create(user=user)
             
             # 记录用户活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=user,
                 action='register',
                 ip_address=self.get_client_ip(request)
@@ -63,7 +68,7 @@ class UserLoginView(APIView):
             login(request, user)
             
             # 记录登录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=user,
                 action='login',
                 ip_address=self.get_client_ip(request)
@@ -91,7 +96,7 @@ class UserLogoutView(APIView):
     @method_decorator(login_required)
     def post(self, request):
         # 记录登出活动
-        UserActivity.objects.create(
+        activity_logger.log(
             user=request.user,
             action='logout',
             ip_address=self.get_client_ip(request)
@@ -169,6 +174,14 @@ class PasswordChangeView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def follow_counters(follower_id, following_id):
+    """关注关系变化时需要同步的计数字段"""
+    return [
+        CounterRef(User, follower_id, 'following_count'),
+        CounterRef(User, following_id, 'follower_count'),
+    ]
+
+
 class FollowUserView(APIView):
     """关注用户视图"""
     
@@ -182,24 +195,17 @@ class FollowUserView(APIView):
             if target_user == request.user:
                 return Response({'error': '不能关注自己'}, status=status.HTTP_400_BAD_REQUEST)
             
-            # 检查是否已关注
-            if FollowRelation.objects.filter(follower=request.user, following=target_user).exists():
-                return Response({'error': '已关注该用户'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 创建关注关系
-            follow_relation = FollowRelation.objects.create(
-                follower=request.user,
-                following=target_user
+            # 创建关注关系并更新双方统计，已关注时唯一约束拦下重复插入
+            follow_relation, created = add_relation(
+                FollowRelation, follow_counters(request.user.id, target_user.id),
+                follower=request.user, following=target_user
             )
-            
-            # 更新用户统计
-            request.user.following_count += 1
-            request.user.save()
-            target_user.follower_count += 1
-            target_user.save()
+            if not created:
+                return Response({'error': '已关注该用户'}, status=status.HTTP_400_BAD_REQUEST)
+            home_timeline.following_changed(request.user.id)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='follow',
                 target_type='user',
@@ -224,26 +230,17 @@ class UnfollowUserView(APIView):
         try:
             target_user = User.objects.get(id=user_id)
             
-            # 检查是否已关注
-            follow_relation = FollowRelation.objects.filter(
-                follower=request.user, 
-                following=target_user
-            ).first()
-            
-            if not follow_relation:
+            # 删除关注关系并更新双方统计
+            removed = remove_relation(
+                FollowRelation, follow_counters(request.user.id, target_user.id),
+                follower=request.user, following=target_user
+            )
+            if not removed:
                 return Response({'error': '未关注该用户'}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # 删除关注关系
-            follow_relation.delete()
-            
-            # 更新用户统计
-            request.user.following_count -= 1
-            request.user.save()
-            target_user.follower_count -= 1
-            target_user.save()
+            home_timeline.following_changed(request.user.id)
             
             # 记录活动
-            UserActivity.objects.create(
+            activity_logger.log(
                 user=request.user,
                 action='unfollow',
                 target_type='user',
@@ -267,23 +264,13 @@ class UserFollowersView(APIView):
             user = User.objects.get(id=user_id)
             followers = FollowRelation.objects.filter(following=user).select_related('follower')
             
-            page = self.paginate_queryset(followers, request)
-            if page is not None:
-                serializer = FollowRelationSerializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = FollowRelationSerializer(followers, many=True)
-            return Response(serializer.data)
+            paginator = KeysetPagination(('-created_at', '-id'))
+            page = paginator.paginate_queryset(followers, request)
+            serializer = FollowRelationSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data, count=user.follower_count)
             
         except User.DoesNotExist:
             return Response({'error': '用户不存在'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
 
 
 class UserFollowingView(APIView):
@@ -297,23 +284,13 @@ class UserFollowingView(APIView):
             user = User.objects.get(id=user_id)
             following = FollowRelation.objects.filter(follower=user).select_related('following')
             
-            page = self.paginate_queryset(following, request)
-            if page is not None:
-                serializer = FollowRelationSerializer(page, many=True)
-                return self.get_paginated_response(serializer.data)
-            
-            serializer = FollowRelationSerializer(following, many=True)
-            return Response(serializer.data)
+            paginator = KeysetPagination(('-created_at', '-id'))
+            page = paginator.paginate_queryset(following, request)
+            serializer = FollowRelationSerializer(page, many=True)
+            return paginator.get_paginated_response(serializer.data, count=user.following_count)
             
         except User.DoesNotExist:
             return Response({'error': '用户不存在'}, status=status.HTTP_404_NOT_FOUND)
-    
-    def paginate_queryset(self, queryset, request):
-        """简单的分页实现"""
-        from rest_framework.pagination import PageNumberPagination
-        paginator = PageNumberPagination()
-        paginator.page_size = 20
-        return paginator.paginate_queryset(queryset, request)
 
 
 @api_view(['GET'])
@@ -324,11 +301,8 @@ def search_users(request):
     if not query:
         return Response({'error': '搜索关键词不能为空'}, status=status.HTTP_400_BAD_REQUEST)
     
-    users = User.objects.filter(
-        Q(username__icontains=query) | 
-        Q(nickname__icontains=query) | 
-        Q(email__icontains=query)
-    ).filter(status=1)
+    _, ids = search_ids(DOC_USER, query, limit=20)  # 限制返回20条结果
+    users = load_in_order(User.objects.filter(status=1), ids)
     
-    serializer = UserSerializer(users[:20], many=True)  # 限制返回20条结果
+    serializer = UserSerializer(users, many=True)
     return Response({'results': serializer.data})
\ No newline at end of file